@@ -0,0 +1,58 @@
+'''Benchmark of the label backends of SmartObjectFinder per tile size.
+
+Runs the post-processing of find_objects_in_image (merge_touching_labels, exclude_labels_outside_size_range),
+centroids_of_labels and statistics_of_labelled_pixels on synthetic label images with both backends. The
+pyclesperanto backend is timed with numpy input and output, i.e. including the transfers between host and
+device that SmartObjectFinder pays for every tile.
+
+usage:
+    python benchmarks/label_backends.py [--tile-sizes 256 512 1024 2048] [--repeat 5]
+'''
+import argparse
+import timeit
+
+import numpy as np
+from scipy import ndimage
+
+from microscope_gym.features.label_backends import BACKENDS, get_label_backend
+
+
+def synthetic_tile(size: int, seed: int = 0) -> tuple:
+    '''Return an intensity image and a label image with blob-like objects, some of them touching.'''
+    rng = np.random.default_rng(seed)
+    image = ndimage.gaussian_filter(rng.random((size, size)), 4)
+    labels, _ = ndimage.label(image > np.percentile(image, 70))
+    # split the objects along a grid, so that touching labels have to be merged
+    labels[labels > 0] += (np.indices(labels.shape)[1] // 32 % 2 * labels.max())[labels > 0]
+    labels = np.unique(labels, return_inverse=True)[1].reshape(labels.shape).astype(np.uint32)
+    return image.astype(np.float32), labels
+
+
+def post_process(backend, image: np.ndarray, labels: np.ndarray):
+    merged = backend.merge_touching_labels(labels)
+    filtered = backend.exclude_labels_outside_size_range(merged, minimum_size=10, maximum_size=10000)
+    backend.centroids_of_labels(filtered)
+    statistics = backend.statistics_of_labelled_pixels(image, filtered)
+    return np.asarray(filtered), statistics
+
+
+def main(tile_sizes: list, repeat: int):
+    backends = {name: get_label_backend(name) for name in BACKENDS}
+    print(f"{'tile size':>10}" + "".join(f"{name + ' [ms]':>20}" for name in backends) + f"{'speed-up':>10}")
+    for size in tile_sizes:
+        image, labels = synthetic_tile(size)
+        times_ms = {}
+        for name, backend in backends.items():
+            post_process(backend, image, labels)  # warm-up, e.g. OpenCL kernel compilation
+            times_ms[name] = min(timeit.repeat(lambda: post_process(backend, image, labels),
+                                               number=1, repeat=repeat)) * 1000
+        speed_up = times_ms["pyclesperanto"] / times_ms["numpy"]
+        print(f"{size:>10}" + "".join(f"{times_ms[name]:>20.1f}" for name in backends) + f"{speed_up:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tile-sizes", type=int, nargs="+", default=[256, 512, 1024, 2048])
+    parser.add_argument("--repeat", type=int, default=5, help="number of measurements per tile size")
+    args = parser.parse_args()
+    main(args.tile_sizes, args.repeat)
@@ -0,0 +1,96 @@
+'''Microbenchmark of the Luxendo command encoding.
+
+Compares the pre-serialised command templates of the luxendo_trulive3d adapter with building and
+serialising the commands with pydantic models and dictionaries, as the adapter did before.
+
+usage:
+    python benchmarks/luxendo_command_encoding.py [--repeat 10000]
+'''
+import argparse
+import json
+import timeit
+from copy import deepcopy
+
+from microscope_gym.microscope_adapters.luxendo_emulator import DEFAULT_LOG_PATH
+from microscope_gym.microscope_adapters.luxendo_recorder import load_luxendo_log
+from microscope_gym.microscope_adapters.luxendo_trulive3d import (
+    RUN_COMMAND, SETROI_COMMAND, TIMINGS_COMMAND, APICommand, APIData, Axis, AxisCommand, CommandTemplate)
+
+
+def load_axes() -> list:
+    '''Return the stage axes of the last embedded/stages message of the recorded log.'''
+    entries = [entry for entry in load_luxendo_log(DEFAULT_LOG_PATH) if entry['topic'].endswith('embedded/stages')]
+    return [Axis(**axis_data) for axis_data in entries[-1]['message']['data']['axes']]
+
+
+def stage_command_pydantic(axes: list, request_command: APICommand, x_position_um: float) -> str:
+    axes = [axis.copy(update={'position_um': x_position_um}) if axis.name == 'x' else axis for axis in axes]
+    command = request_command.copy()
+    command.data = AxisCommand(command="set", device="stages", axes=axes)
+    return command.json(by_alias=True)
+
+
+def stage_command_template(axes: list, template: CommandTemplate, x_position_um: float) -> str:
+    values = []
+    for axis in axes:
+        values.append(x_position_um if axis.name == 'x' else axis.position_um)
+        values.append(axis.target)
+    return template.render(*values)
+
+
+def camera_commands_dict(timings_command: dict, cameras_command: dict) -> tuple:
+    command = deepcopy(timings_command)
+    command['data']['timings'] = {'exposure': 20.0, 'delaybefore': 0, 'delayafter': 12.0}
+    timings = json.dumps(command)
+    command = deepcopy(cameras_command)
+    command['data']['name'] = "long"
+    command['data']['roi'] = {'top': 0, 'left': 0, 'width': 2304, 'height': 2304}
+    return timings, json.dumps(command)
+
+
+def camera_commands_template() -> tuple:
+    return (TIMINGS_COMMAND.render(exposure=20.0, delayafter=12.0),
+            SETROI_COMMAND.render(name="long", top=0, left=0, width=2304, height=2304))
+
+
+def run_command_dict() -> str:
+    return json.dumps({"type": "operation", "data": {"device": "execution", "command": "run", "state": True}})
+
+
+def main(repeat: int):
+    axes = load_axes()
+    request_command = APICommand(type="device", data=APIData(device="stages"))
+    template_axes = []
+    for index, axis in enumerate(axes):
+        axis_data = axis.dict(by_alias=True)
+        axis_data['value'] = CommandTemplate.field(f"value_{index}")
+        axis_data['target'] = CommandTemplate.field(f"target_{index}")
+        template_axes.append(axis_data)
+    stage_template = CommandTemplate(json.loads(
+        APICommand(type="device", data=AxisCommand(command="set", device="stages", axes=template_axes))
+        .json(by_alias=True)))
+    assert json.loads(stage_command_pydantic(axes, request_command, 100.0)) == \
+        json.loads(stage_command_template(axes, stage_template, 100.0))
+    timings_command = {"type": "device", "data": {"device": "timings", "command": "set"}}
+    cameras_command = {"type": "device", "data": {"device": "cameras", "command": "setroi"}}
+    assert [json.loads(command) for command in camera_commands_dict(timings_command, cameras_command)] == \
+        [json.loads(command) for command in camera_commands_template()]
+
+    benchmarks = {
+        "set stages": (lambda: stage_command_pydantic(axes, request_command, 100.0),
+                       lambda: stage_command_template(axes, stage_template, 100.0)),
+        "timings + setroi": (lambda: camera_commands_dict(timings_command, cameras_command),
+                             camera_commands_template),
+        "execution run": (run_command_dict, lambda: RUN_COMMAND),
+    }
+    print(f"{'command':<20}{'before [µs]':>14}{'template [µs]':>16}{'speed-up':>10}")
+    for name, (before, template) in benchmarks.items():
+        before_us = min(timeit.repeat(before, number=repeat, repeat=3)) / repeat * 1e6
+        template_us = min(timeit.repeat(template, number=repeat, repeat=3)) / repeat * 1e6
+        print(f"{name:<20}{before_us:>14.2f}{template_us:>16.2f}{before_us / template_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10000, help="number of commands per measurement")
+    main(parser.parse_args().repeat)
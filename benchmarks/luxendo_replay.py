@@ -0,0 +1,35 @@
+'''End-to-end benchmark of the Luxendo adapter: replay a LuxendoLog recording against the emulator.
+
+Reports the time spent per phase (connecting, stage moves, stack and event configuration, runs and
+loading their files) and the end-to-end throughput, see luxendo_replay.SessionReplayer.
+
+usage:
+    python benchmarks/luxendo_replay.py [recording.json] [--time-scale 0] [--latency-ms 2] [--roi-size 512]
+'''
+import argparse
+
+from microscope_gym.microscope_adapters.luxendo_emulator import DEFAULT_LOG_PATH
+from microscope_gym.microscope_adapters.luxendo_replay import SessionReplayer
+
+
+def main(args: argparse.Namespace):
+    for repetition in range(args.repeat):
+        report = SessionReplayer(args.recording, time_scale=args.time_scale, latency_ms=args.latency_ms,
+                                 jitter_ms=args.jitter_ms, emulator_time_scale=args.emulator_time_scale,
+                                 roi_size=args.roi_size).run()
+        print(f"repetition {repetition + 1}/{args.repeat}")
+        print(report.format())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", nargs="?", default=DEFAULT_LOG_PATH, help="LuxendoLog recording to replay")
+    parser.add_argument("--time-scale", type=float, default=0.0,
+                        help="scales the recorded time between commands, 1 replays in real time")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency of the local broker")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="latency jitter of the local broker")
+    parser.add_argument("--emulator-time-scale", type=float, default=0.0,
+                        help="scales emulated stage moves and exposures, 1 is real time")
+    parser.add_argument("--roi-size", type=int, default=None, help="reduce the camera ROI to this size")
+    parser.add_argument("--repeat", type=int, default=1, help="number of replays")
+    main(parser.parse_args())
@@ -1 +1,14 @@
-from . import smart_object_finder
+'''Smart features built on top of the microscope_gym interface.
+
+Feature modules are imported on first access, so that their heavy dependencies
+(pyclesperanto_prototype, apoc, scikit-image) are only loaded when they are used.'''
+import importlib
+
+_submodules = ("smart_object_finder", "canny_edge_detector", "label_backends", "tile_segmentation",
+               "object_index", "tile_prescreen", "overview_workflow")
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
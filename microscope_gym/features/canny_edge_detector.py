@@ -1,6 +1,5 @@
 # I am using the following interface features:
 from microscope_gym.interface import Camera, Microscope
-from skimage.feature import canny
 
 
 def canny_edge_detector(microscope: Microscope, *args, **kwargs) -> "numpy.array":
@@ -14,4 +13,6 @@ def canny_edge_detector(microscope: Microscope, *args, **kwargs) -> "numpy.array
     Returns:
         numpy.array: results of canny edge detection
     """
+    from skimage.feature import canny
+
     return canny(microscope.acquire_image(), *args, **kwargs)
@@ -0,0 +1,183 @@
+'''Label image post-processing backends of the smart features.
+
+SmartObjectFinder post-processes the segmentation of the apoc segmenter with a few label operations.
+The backends implement them with the conventions of pyclesperanto_prototype, so that they can be
+exchanged: point lists have the shape (dimensions, labels) in x, y, z order and statistics are
+dictionaries of per-label arrays with the keys of cle.statistics_of_labelled_pixels.
+
+    ClesperantoBackend ("pyclesperanto"): pyclesperanto_prototype, runs on the GPU (or OpenCL on the CPU)
+    NumpyBackend ("numpy"): vectorised NumPy/scipy.ndimage, avoids the OpenCL overhead and the transfers
+        between host and device on machines without a GPU
+
+example:
+    backend = get_label_backend("numpy")
+    labels = backend.exclude_labels_outside_size_range(labels, minimum_size=10, maximum_size=1000)
+'''
+from abc import ABC, abstractmethod
+from typing import Dict, Union
+
+import numpy as np
+
+
+def _cle():
+    '''Import pyclesperanto_prototype on first use, initializing OpenCL takes long.'''
+    import pyclesperanto_prototype as cle
+    return cle
+
+
+class LabelBackend(ABC):
+    '''Label image operations used by the smart features.
+
+    methods:
+        merge_touching_labels(labels) -> label image
+        exclude_labels_outside_size_range(labels, minimum_size, maximum_size) -> label image
+        centroids_of_labels(labels) -> numpy.ndarray (dimensions, labels) in x, y, z order
+        statistics_of_labelled_pixels(intensity_image, labels) -> dict of per-label arrays
+    '''
+    name = ""
+
+    @abstractmethod
+    def merge_touching_labels(self, labels) -> "numpy.ndarray":
+        '''Merge labels that touch each other and number the result sequentially.'''
+
+    @abstractmethod
+    def exclude_labels_outside_size_range(self, labels, minimum_size: float = 0,
+                                          maximum_size: float = 100) -> "numpy.ndarray":
+        '''Remove labels with less than minimum_size or more than maximum_size pixels and renumber the others.'''
+
+    @abstractmethod
+    def centroids_of_labels(self, labels) -> np.ndarray:
+        '''Return the centroids of the labels 1..max(labels) as an array (dimensions, labels) in x, y, z order.'''
+
+    @abstractmethod
+    def statistics_of_labelled_pixels(self, intensity_image, labels) -> Dict[str, np.ndarray]:
+        '''Return shape and intensity statistics of the labels 1..max(labels).'''
+
+
+class ClesperantoBackend(LabelBackend):
+    name = "pyclesperanto"
+
+    def merge_touching_labels(self, labels):
+        return _cle().merge_touching_labels(labels)
+
+    def exclude_labels_outside_size_range(self, labels, minimum_size: float = 0, maximum_size: float = 100):
+        return _cle().exclude_labels_outside_size_range(labels, minimum_size=minimum_size, maximum_size=maximum_size)
+
+    def centroids_of_labels(self, labels) -> np.ndarray:
+        return np.asarray(_cle().centroids_of_labels(labels))
+
+    def statistics_of_labelled_pixels(self, intensity_image, labels) -> Dict[str, np.ndarray]:
+        return _cle().statistics_of_labelled_pixels(intensity_image, labels)
+
+
+class NumpyBackend(LabelBackend):
+    '''Label operations with bincount-based per-label sums, on the CPU without OpenCL.
+
+    statistics_of_labelled_pixels computes the keys label, area, min_intensity, max_intensity, sum_intensity,
+    mean_intensity, standard_deviation_intensity, centroid_x/y/z and mass_center_x/y/z.
+    '''
+    name = "numpy"
+
+    def merge_touching_labels(self, labels) -> np.ndarray:
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+        labels = np.asarray(labels)
+        n_labels = int(labels.max(initial=0)) + 1
+        touching_labels = []
+        for axis in range(labels.ndim):
+            before = labels[tuple(slice(None, -1) if index == axis else slice(None) for index in range(labels.ndim))]
+            after = labels[tuple(slice(1, None) if index == axis else slice(None) for index in range(labels.ndim))]
+            touching = (before != after) & (before > 0) & (after > 0)
+            touching_labels.append((before[touching], after[touching]))
+        sources = np.concatenate([pair[0] for pair in touching_labels]).astype(np.int64)
+        targets = np.concatenate([pair[1] for pair in touching_labels]).astype(np.int64)
+        graph = coo_matrix((np.ones(len(sources), dtype=np.int8), (sources, targets)), shape=(n_labels, n_labels))
+        _, components = connected_components(graph, directed=False)
+        # like pyclesperanto, merged labels are numbered in the order of their largest original label
+        present = np.bincount(labels.ravel(), minlength=n_labels) > 0
+        present[0] = False
+        largest_label = np.zeros(components.max() + 1, dtype=np.int64)
+        np.maximum.at(largest_label, components[present], np.flatnonzero(present))
+        used_components = np.unique(components[present])
+        order = used_components[np.argsort(largest_label[used_components])]
+        new_component_labels = np.zeros(components.max() + 1, dtype=labels.dtype)
+        new_component_labels[order] = np.arange(1, len(order) + 1)
+        lookup = new_component_labels[components]
+        lookup[0] = 0
+        return lookup[labels]
+
+    def exclude_labels_outside_size_range(self, labels, minimum_size: float = 0,
+                                          maximum_size: float = 100) -> np.ndarray:
+        labels = np.asarray(labels)
+        areas = np.bincount(labels.ravel())
+        keep = (areas >= minimum_size) & (areas <= maximum_size)
+        keep[0] = False
+        lookup = np.zeros(len(areas), dtype=labels.dtype)
+        lookup[keep] = np.arange(1, np.count_nonzero(keep) + 1)
+        return lookup[labels]
+
+    def centroids_of_labels(self, labels) -> np.ndarray:
+        labels = np.asarray(labels)
+        areas, coordinate_sums = self._coordinate_sums(labels)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.stack([sums[1:] / areas[1:] for sums in coordinate_sums])
+
+    def statistics_of_labelled_pixels(self, intensity_image, labels) -> Dict[str, np.ndarray]:
+        from scipy import ndimage
+        labels = np.asarray(labels)
+        intensities = np.asarray(intensity_image, dtype=np.float64)
+        flat_labels = labels.ravel()
+        n_labels = int(labels.max(initial=0)) + 1
+        label_ids = np.arange(1, n_labels)
+        areas, coordinate_sums = self._coordinate_sums(labels)
+        weighted_sums = self._coordinate_sums(labels, intensities)[1]
+        sums = np.bincount(flat_labels, weights=intensities.ravel(), minlength=n_labels)
+        squared_sums = np.bincount(flat_labels, weights=(intensities ** 2).ravel(), minlength=n_labels)
+        statistics = {'label': label_ids, 'area': areas[1:].astype(np.float64)}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = sums[1:] / areas[1:]
+            statistics.update({
+                'min_intensity': np.asarray(ndimage.minimum(intensities, labels, label_ids), dtype=np.float64),
+                'max_intensity': np.asarray(ndimage.maximum(intensities, labels, label_ids), dtype=np.float64),
+                'sum_intensity': sums[1:],
+                'mean_intensity': mean,
+                'standard_deviation_intensity': np.sqrt(np.maximum(squared_sums[1:] / areas[1:] - mean ** 2, 0)),
+            })
+            for axis_name, coordinate_sum, weighted_sum in zip("xyz", coordinate_sums, weighted_sums):
+                statistics[f'centroid_{axis_name}'] = coordinate_sum[1:] / areas[1:]
+                statistics[f'mass_center_{axis_name}'] = weighted_sum[1:] / sums[1:]
+        for axis_name in "xyz"[labels.ndim:]:
+            statistics[f'centroid_{axis_name}'] = np.zeros(n_labels - 1)
+            statistics[f'mass_center_{axis_name}'] = np.zeros(n_labels - 1)
+        return statistics
+
+    @staticmethod
+    def _coordinate_sums(labels: np.ndarray, weights: np.ndarray = None):
+        '''Return the (weighted) pixel count and the sums of the x, y (and z) coordinates of each label.'''
+        n_labels = int(labels.max(initial=0)) + 1
+        flat_labels = labels.ravel()
+        weights = None if weights is None else weights.ravel()
+        areas = np.bincount(flat_labels, weights=weights, minlength=n_labels)
+        coordinate_sums = []
+        # numpy axes are (z,) y, x, the point lists of pyclesperanto start with x
+        for axis in reversed(range(labels.ndim)):
+            shape = [1] * labels.ndim
+            shape[axis] = labels.shape[axis]
+            coordinates = np.broadcast_to(np.arange(labels.shape[axis], dtype=np.float64).reshape(shape),
+                                          labels.shape).ravel()
+            if weights is not None:
+                coordinates = coordinates * weights
+            coordinate_sums.append(np.bincount(flat_labels, weights=coordinates, minlength=n_labels))
+        return areas, coordinate_sums
+
+
+BACKENDS = {backend.name: backend for backend in (ClesperantoBackend, NumpyBackend)}
+
+
+def get_label_backend(backend: Union[str, LabelBackend] = "pyclesperanto") -> LabelBackend:
+    '''Return a backend instance for a backend name (see BACKENDS) or the given backend instance.'''
+    if isinstance(backend, LabelBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown label backend {backend!r}, available backends: {sorted(BACKENDS)}")
+    return BACKENDS[backend]()
@@ -0,0 +1,174 @@
+'''Spatial index of objects detected in stage coordinates.
+
+The tiles of a scan overlap, so the same object can be detected in neighbouring tiles. ObjectIndex keeps
+one DetectedObject per physical object: a detection within tolerance_um of a known object is merged into
+it. The objects are stored in a grid hash with cells of tolerance_um, so adding a detection and radius
+queries only look at the cells around the position, nearest queries search rings of cells outwards.
+
+The index can be reused across time points: the time point of the last detection and the last imaging
+are stored with every object, see SmartObjectFinder.scan_for_objects.
+
+example:
+    index = ObjectIndex(tolerance_um=10)
+    detected_object, is_new = index.add(y_um=100.0, x_um=250.0, metric=12.5)
+    neighbours = index.within_radius(y_um=100.0, x_um=250.0, radius_um=50)
+'''
+import math
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+class DetectedObject:
+    '''Object in the ObjectIndex.
+
+    properties:
+        id: number of the object in the index
+        y_um, x_um: mean stage position of all detections in µm
+        metric: best metric of all detections, e.g. sum_intensity
+        n_detections: number of merged detections
+        last_detected: time point of the last detection
+        last_imaged: time point at which the object was imaged last, None if it was not imaged
+    '''
+
+    def __init__(self, id: int, y_um: float, x_um: float, metric: float, time_point: int):
+        self.id = id
+        self.y_um = y_um
+        self.x_um = x_um
+        self.metric = metric
+        self.n_detections = 1
+        self.last_detected = time_point
+        self.last_imaged: Optional[int] = None
+
+    @property
+    def position_um(self) -> Tuple[float, float]:
+        return self.y_um, self.x_um
+
+    def __repr__(self):
+        return (f"DetectedObject(id={self.id}, y_um={self.y_um:.2f}, x_um={self.x_um:.2f}, metric={self.metric}, "
+                f"n_detections={self.n_detections})")
+
+
+class ObjectIndex:
+    '''Objects detected across tiles and time points, with duplicates merged.
+
+    methods:
+        add(y_um, x_um, metric) -> (DetectedObject, is_new)
+        nearest(y_um, x_um, max_distance_um) -> DetectedObject or None
+        within_radius(y_um, x_um, radius_um) -> list of DetectedObject, nearest first
+        next_time_point() -> int
+
+    properties:
+        objects: list of DetectedObject
+        positions_um: numpy.ndarray (objects, 2) of y, x positions
+        time_point: current time point
+
+    Args:
+        tolerance_um: detections closer than tolerance_um to an object are merged into the object
+    '''
+
+    def __init__(self, tolerance_um: float):
+        if tolerance_um <= 0:
+            raise ValueError("tolerance_um must be positive")
+        self.tolerance_um = tolerance_um
+        self.time_point = 0
+        self.objects: List[DetectedObject] = []
+        self._cells: Dict[Tuple[int, int], List[DetectedObject]] = {}
+        self._bounds: Optional[Tuple[int, int, int, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+    def __iter__(self) -> Iterator[DetectedObject]:
+        return iter(self.objects)
+
+    @property
+    def positions_um(self) -> np.ndarray:
+        return np.asarray([detected_object.position_um for detected_object in self.objects],
+                          dtype=float).reshape(-1, 2)
+
+    def next_time_point(self) -> int:
+        '''Start a new time point, e.g. before the next scan of the sample.'''
+        self.time_point += 1
+        return self.time_point
+
+    def add(self, y_um: float, x_um: float, metric: float = 0.0) -> Tuple[DetectedObject, bool]:
+        '''Add a detection, merging it into the nearest object within tolerance_um.
+
+        Returns:
+            (DetectedObject, is_new) -- the new or updated object and whether it was not in the index before
+        '''
+        detected_object = self.nearest(y_um, x_um, max_distance_um=self.tolerance_um)
+        if detected_object is None:
+            detected_object = DetectedObject(len(self.objects), y_um, x_um, metric, self.time_point)
+            self.objects.append(detected_object)
+            self._insert(detected_object)
+            return detected_object, True
+        self._cells[self._get_cell(*detected_object.position_um)].remove(detected_object)
+        n = detected_object.n_detections
+        detected_object.y_um = (detected_object.y_um * n + y_um) / (n + 1)
+        detected_object.x_um = (detected_object.x_um * n + x_um) / (n + 1)
+        detected_object.n_detections = n + 1
+        detected_object.metric = max(detected_object.metric, metric)
+        detected_object.last_detected = self.time_point
+        self._insert(detected_object)
+        return detected_object, False
+
+    def within_radius(self, y_um: float, x_um: float, radius_um: float) -> List[DetectedObject]:
+        '''Return the objects within radius_um of the position, nearest first.'''
+        n_cells = math.ceil(radius_um / self.tolerance_um)
+        center = self._get_cell(y_um, x_um)
+        candidates = []
+        for cell_y in range(center[0] - n_cells, center[0] + n_cells + 1):
+            for cell_x in range(center[1] - n_cells, center[1] + n_cells + 1):
+                for detected_object in self._cells.get((cell_y, cell_x), ()):
+                    distance = math.hypot(detected_object.y_um - y_um, detected_object.x_um - x_um)
+                    if distance <= radius_um:
+                        candidates.append((distance, detected_object.id, detected_object))
+        return [detected_object for _, _, detected_object in sorted(candidates)]
+
+    def nearest(self, y_um: float, x_um: float, max_distance_um: float = math.inf) -> Optional[DetectedObject]:
+        '''Return the nearest object within max_distance_um of the position or None.'''
+        if not self.objects:
+            return None
+        center = self._get_cell(y_um, x_um)
+        # rings of cells outside of the occupied cells are empty
+        max_ring = max(abs(center[0] - self._bounds[0]), abs(center[0] - self._bounds[2]),
+                       abs(center[1] - self._bounds[1]), abs(center[1] - self._bounds[3]))
+        if max_distance_um < math.inf:
+            max_ring = min(max_ring, math.ceil(max_distance_um / self.tolerance_um))
+        best, best_distance = None, math.inf
+        for ring in range(max_ring + 1):
+            # objects in this ring are at least (ring - 1) cells away from the position
+            if (ring - 1) * self.tolerance_um > best_distance:
+                break
+            for cell in self._get_ring(center, ring):
+                for detected_object in self._cells.get(cell, ()):
+                    distance = math.hypot(detected_object.y_um - y_um, detected_object.x_um - x_um)
+                    if distance < best_distance:
+                        best, best_distance = detected_object, distance
+        return best if best_distance <= max_distance_um else None
+
+    def _insert(self, detected_object: DetectedObject):
+        cell = self._get_cell(*detected_object.position_um)
+        self._cells.setdefault(cell, []).append(detected_object)
+        if self._bounds is None:
+            self._bounds = cell + cell
+        else:
+            self._bounds = (min(self._bounds[0], cell[0]), min(self._bounds[1], cell[1]),
+                            max(self._bounds[2], cell[0]), max(self._bounds[3], cell[1]))
+
+    def _get_cell(self, y_um: float, x_um: float) -> Tuple[int, int]:
+        return math.floor(y_um / self.tolerance_um), math.floor(x_um / self.tolerance_um)
+
+    @staticmethod
+    def _get_ring(center: Tuple[int, int], ring: int):
+        if ring == 0:
+            yield center
+            return
+        for offset in range(-ring, ring + 1):
+            yield center[0] - ring, center[1] + offset
+            yield center[0] + ring, center[1] + offset
+        for offset in range(-ring + 1, ring):
+            yield center[0] + offset, center[1] - ring
+            yield center[0] + offset, center[1] + ring
@@ -0,0 +1,115 @@
+'''Find objects with a low magnification objective and image them with a high magnification objective.
+
+Searching at the imaging resolution needs magnification² more tiles than searching with an overview
+objective. OverviewWorkflow scans the sample with the overview objective, maps the objects that the
+SmartObjectFinder detects into sample coordinates (the stage position plus the calibration offset of the
+objective, see Objective.calibration_offset_um), switches to the imaging objective and moves the stage so
+that each target is centred in its field of view.
+
+Targets are collected in an ObjectIndex in sample coordinates, i.e. objects that are detected in
+overlapping overview tiles are imaged once.
+
+example:
+    workflow = OverviewWorkflow(finder, overview_objective="4x air", imaging_objective="20x water")
+    targets, images = workflow.run(object_size_range=(50, 5000), max_targets=10)
+'''
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from microscope_gym.features.object_index import DetectedObject, ObjectIndex
+from microscope_gym.features.smart_object_finder import SmartObjectFinder
+
+
+class OverviewWorkflow:
+    '''Overview scan with one objective and imaging of the found objects with another objective.
+
+    methods:
+        find_targets(y_range, x_range, object_size_range) -> list of DetectedObject in sample coordinates
+        image_targets(targets, imaging_function, max_targets) -> list of images
+        run(y_range, x_range, object_size_range, imaging_function, max_targets) -> (targets, images)
+
+    properties:
+        object_index: ObjectIndex of all targets in sample coordinates
+
+    Args:
+        finder: SmartObjectFinder whose segmenter was trained on images of the overview objective
+        overview_objective: name of the objective to search with, see Microscope.objectives
+        imaging_objective: name of the objective to image the targets with
+        tolerance_um: detections closer than tolerance_um are one target, default: a quarter of the field of view
+            of the imaging objective
+        metric: statistic of the objects to order the targets of a tile by, see SmartObjectFinder.find_object_positions
+    '''
+
+    def __init__(self, finder: SmartObjectFinder, overview_objective: str, imaging_objective: str,
+                 tolerance_um: float = None, metric: str = 'sum_intensity'):
+        self.finder = finder
+        self.microscope = finder.microscope
+        for name in (overview_objective, imaging_objective):
+            if name not in self.microscope.objectives:
+                raise ValueError(f"Unknown objective {name!r}, available objectives: {list(self.microscope.objectives)}")
+        self.overview_objective = overview_objective
+        self.imaging_objective = imaging_objective
+        self.metric = metric
+        if tolerance_um is None:
+            imaging_magnification = self.microscope.objectives[imaging_objective].magnification
+            field_of_view_um = np.asarray(self.microscope.camera.image_shape) * self.microscope.camera.pixel_size_um \
+                / imaging_magnification
+            tolerance_um = float(field_of_view_um.min()) / 4
+        self.object_index = ObjectIndex(tolerance_um)
+
+    def find_targets(self, y_range: tuple = (), x_range: tuple = (),
+                     object_size_range: tuple = None) -> List[DetectedObject]:
+        '''Scan the sample with the overview objective and return the new targets in sample coordinates.
+
+        Args:
+            y_range, x_range: see Microscope.scan_stage_positions, the default step is 90 % of the field of view
+                of the overview objective
+            object_size_range: minimum and maximum size of the objects in pixels of the overview images
+        '''
+        self.microscope.switch_objective(self.overview_objective)
+        self.object_index.next_time_point()
+        new_targets = []
+        for y, x in self.microscope.scan_stage_positions(y_range=y_range, x_range=x_range):
+            overview_image = self.microscope.acquire_image()
+            segmentation = self.finder.find_objects_in_image(overview_image, object_size_range)
+            if segmentation.max() == 0:
+                continue
+            for y_stage, x_stage, value in self.finder.find_object_positions(overview_image, segmentation, y, x,
+                                                                             self.metric):
+                y_sample, x_sample = self.microscope.get_sample_position_um((y_stage, x_stage))
+                target, is_new = self.object_index.add(y_sample, x_sample, value)
+                if is_new:
+                    new_targets.append(target)
+        return new_targets
+
+    def image_targets(self, targets: List[DetectedObject] = None, imaging_function: Callable = None,
+                      max_targets: int = None) -> list:
+        '''Switch to the imaging objective and image each target once, centred in the field of view.
+
+        Args:
+            targets: targets in sample coordinates, default: all targets of object_index that were not imaged at
+                the current time point
+            imaging_function: function to call at each target, default: Microscope.acquire_image
+            max_targets: maximum number of targets to image, default: all
+        '''
+        if targets is None:
+            targets = [target for target in self.object_index if target.last_imaged != self.object_index.time_point]
+        if max_targets is not None:
+            targets = targets[:max_targets]
+        self.microscope.switch_objective(self.imaging_objective)
+        if imaging_function is None:
+            imaging_function = self.microscope.acquire_image
+        images = []
+        for target in targets:
+            y_stage, x_stage = self.microscope.get_stage_position_for_sample_position(target.position_um)
+            self.microscope.move_stage_to_nearest_position_in_range(y_position_um=y_stage, x_position_um=x_stage)
+            images.append(imaging_function())
+            target.last_imaged = self.object_index.time_point
+        return images
+
+    def run(self, y_range: tuple = (), x_range: tuple = (), object_size_range: tuple = None,
+            imaging_function: Callable = None, max_targets: int = None) -> Tuple[List[DetectedObject], list]:
+        '''Find targets with the overview objective and image them with the imaging objective.'''
+        targets = self.find_targets(y_range, x_range, object_size_range)
+        return targets, self.image_targets(targets, imaging_function, max_targets)
@@ -1,26 +1,42 @@
 '''Smart Object Finder uses the random forest classifier apoc to find objects in a microscope sample.'''
 
+import time
+import warnings
+from collections import deque
+from typing import Union
+
 import numpy as np
-import pyclesperanto_prototype as cle
-import apoc
 
 # I am using the following interface features:
 from microscope_gym.interface import Objective, Stage, Camera, Microscope
+from microscope_gym.features.label_backends import LabelBackend, get_label_backend
+from microscope_gym.features.object_index import ObjectIndex
+from microscope_gym.features.tile_prescreen import ScanStatistics, TilePrescreen
 
 
 class SmartObjectFinder:
     '''Smart Object Finder uses the random forest classifier apoc to find objects in a microscope sample.
 
+    The segmentation is post-processed by a label backend (see label_backends): "pyclesperanto" (default)
+    or "numpy" for machines without a GPU.
+
     methods:
         find_objects_in_image(image: numpy.ndarray) -> list
+        find_objects_in_images(images: list) -> list
         scan_for_objects(x_range, y_range) -> list
+
+    properties:
+        scan_statistics: ScanStatistics of the last scan_for_objects() call (see tile_prescreen)
     '''
 
     def __init__(self, microscope: Microscope,
-                 trained_apoc_segmenter: apoc.ObjectSegmenter, features: str):
+                 trained_apoc_segmenter: "apoc.ObjectSegmenter", features: str,
+                 backend: Union[str, LabelBackend] = "pyclesperanto"):
         self.microscope = microscope
         self.segmenter = trained_apoc_segmenter
         self.features = features
+        self.backend = get_label_backend(backend)
+        self.scan_statistics = ScanStatistics()
 
     def find_objects_in_image(self, overview_image: np.ndarray, object_size_range: tuple = None) -> list:
         '''Finds objects in a given image using the trained apoc segmenter.
@@ -34,13 +50,49 @@ class SmartObjectFinder:
         '''
         # Segment the image
         segmentation = self.segmenter.predict(features=self.features, image=overview_image)
+        return self.post_process_segmentation(segmentation, object_size_range)
+
+    def find_objects_in_images(self, images, object_size_range: tuple = None, padding: int = 16,
+                               tiles_per_batch: int = None) -> list:
+        '''Finds objects in a list or stack of tiles with one segmenter call per batch of tiles.
+
+        The tiles are mosaicked with borders of padding pixels (see tile_segmentation.mosaic_tiles), so the
+        feature stack is computed and the model is dispatched once per batch instead of once per tile.
+
+        Arguments:
+            images {list or numpy.ndarray} -- 2D tiles, e.g. the (tile, y, x) output of Microscope.acquire_tiled_image().
+            size_range {tuple} -- Minimum and maximum size (in number of pixels) of objects to find.
+            padding {int} -- Border around each tile in pixels, should be larger than the radius of the features.
+            tiles_per_batch {int} -- Maximum number of tiles per segmenter call, default: all tiles.
+
+        Returns:
+            list -- Label image of each tile.
+        '''
+        from microscope_gym.features.tile_segmentation import mosaic_tiles, split_mosaic
+        images = list(images)
+        tiles_per_batch = tiles_per_batch or max(len(images), 1)
+        segmentations = []
+        for start in range(0, len(images), tiles_per_batch):
+            mosaic, regions = mosaic_tiles(images[start:start + tiles_per_batch], padding=padding)
+            mosaic_segmentation = self.segmenter.predict(features=self.features, image=mosaic)
+            segmentations.extend(self.post_process_segmentation(segmentation, object_size_range)
+                                 for segmentation in split_mosaic(mosaic_segmentation, regions))
+        return segmentations
+
+    def post_process_segmentation(self, segmentation, object_size_range: tuple = None):
+        '''Merges touching objects of a segmentation and removes objects outside of the size range.
 
-        # Post-process the segmentation
-        cle.merge_touching_labels(segmentation, labels_destination=segmentation)
+        Arguments:
+            segmentation {numpy.ndarray} -- Segmentation of the apoc segmenter.
+            size_range {tuple} -- Minimum and maximum size (in number of pixels) of objects to keep.
+
+        Returns:
+            Label image of the remaining objects.
+        '''
+        segmentation = self.backend.merge_touching_labels(segmentation)
         if object_size_range:
-            cle.exclude_labels_outside_size_range(
+            segmentation = self.backend.exclude_labels_outside_size_range(
                 segmentation,
-                destination=segmentation,
                 minimum_size=object_size_range[0],
                 maximum_size=object_size_range[1])
 
@@ -49,7 +101,7 @@ class SmartObjectFinder:
     def find_centroids(self, segmentation) -> list:
 
         # Find centroids of the objects
-        centroids = cle.centroids_of_labels(segmentation)
+        centroids = self.backend.centroids_of_labels(segmentation)
         return np.flip(np.asarray(np.transpose(centroids)), axis=1)
 
     def find_best_centroid(self, original_image, segmentation, metric='sum_intensity') -> list:
@@ -58,18 +110,39 @@ class SmartObjectFinder:
         Arguments:
             original_image {numpy.ndarray} -- Image to find objects in.
             segmentation {numpy.ndarray} -- Segmentation of the image.
-            metric {str} -- Metric to sort the objects by. Must be a key in the output of cle.statistics_of_labelled_pixels().
+            metric {str} -- Metric to sort the objects by. Must be a key in the output of the backend's statistics_of_labelled_pixels().
 
         Returns:
             tuple -- (y, x) coordinates of the centroid.
         '''
         # Find centroids of the objects
-        stats = cle.statistics_of_labelled_pixels(original_image, segmentation)
+        stats = self.backend.statistics_of_labelled_pixels(original_image, segmentation)
         pixel_x = stats['centroid_x'][np.argmax(stats[metric])]
         pixel_y = stats['centroid_y'][np.argmax(stats[metric])]
 
         return (pixel_y, pixel_x)
 
+    def find_object_positions(self, original_image, segmentation, y_um: float, x_um: float,
+                              metric='sum_intensity') -> list:
+        '''Finds the stage positions of all objects in a segmentation of an image acquired at (y_um, x_um).
+
+        Arguments:
+            original_image {numpy.ndarray} -- Image to find objects in.
+            segmentation {numpy.ndarray} -- Segmentation of the image.
+            y_um, x_um {float} -- Stage position at which the image was acquired.
+            metric {str} -- Metric to sort the objects by, see find_best_centroid().
+
+        Returns:
+            list -- (y_um, x_um, metric) of each object, sorted by decreasing metric.
+        '''
+        stats = self.backend.statistics_of_labelled_pixels(original_image, segmentation)
+        positions = []
+        for index in np.argsort(-np.asarray(stats[metric]), kind='stable'):
+            offset = self.microscope.get_stage_offset_from_pixel_coordinates(
+                (stats['centroid_y'][index], stats['centroid_x'][index]))
+            positions.append((y_um + offset[0], x_um + offset[1], float(stats[metric][index])))
+        return positions
+
     def image_found_objects(self, imaging_positions: list, imaging_function: callable = None) -> list:
         '''Moves the microscope stage to each (y, x) position in imaging_positions and executes imaging_function (default: Microscope.acquire_image()).
 
@@ -111,7 +184,9 @@ class SmartObjectFinder:
         return self.image_found_objects(positions, imaging_function)
 
     def scan_for_objects(self, num_objects: int, y_range: tuple = None, x_range: tuple = None,
-                         imaging_function: callable = None, object_size_range: tuple = None, metric='sum_intensity') -> list:
+                         imaging_function: callable = None, object_size_range: tuple = None, metric='sum_intensity',
+                         n_workers: int = None, object_index: ObjectIndex = None,
+                         prescreen: TilePrescreen = None) -> list:
         '''Scans a given range of x and y positions and finds objects in each image.
 
         Arguments:
@@ -126,7 +201,18 @@ class SmartObjectFinder:
             object_size_range: tuple (optional)
                 Minimum and maximum size (in number of pixels) of objects to find, default is None.
             metric: str (optional)
-                Name of the metric to use to choose from multiple objects, default is 'sum_intensity'. Uses metrics from pyclesperanto_prototype.statistics_of_labelled_pixels().
+                Name of the metric to use to choose from multiple objects, default is 'sum_intensity'. Uses metrics from the backend's statistics_of_labelled_pixels().
+            n_workers: int (optional)
+                If given, the tiles are segmented by n_workers processes (see tile_segmentation) while the next tiles are acquired.
+                The tiles are still evaluated in scan order, default is None, i.e. segmentation in the calling thread.
+            object_index: ObjectIndex (optional)
+                If given, all objects of each tile are added to the index (see object_index) instead of only the best one, and
+                every object is imaged once per scan, even if it is detected in several overlapping tiles. Each scan starts a
+                new time point of the index, so the same index can be passed to the scans of a time lapse.
+            prescreen: TilePrescreen (optional)
+                If given, a snapshot of each tile is pre-screened (see tile_prescreen) and tiles that fail are neither captured
+                nor segmented. The skipped tiles and the time saved are counted in scan_statistics. Without a capture_function
+                and microscope.capabilities.live_preview, the full capture of each tile is pre-screened instead.
 
         Returns:
             list -- List of objects found in the scanned images.
@@ -138,17 +224,23 @@ class SmartObjectFinder:
         if imaging_function is None:
             imaging_function = self.microscope.acquire_image
 
+        if object_index is not None:
+            object_index.next_time_point()
+
         # Scan the range of x and y positions
         images = []
-        for y, x in self.microscope.scan_stage_positions(y_range=y_range, x_range=x_range):
-
-            # Acquire image
-            search_image = self.microscope.acquire_image()
+        self.scan_statistics = ScanStatistics()
+        scan_positions = self.microscope.scan_stage_positions(y_range=y_range, x_range=x_range)
+        scan_tiles = self._acquire_scan_tiles(scan_positions, prescreen)
+        for y, x, search_image, segmentation in self._segment_scan_tiles(scan_tiles, n_workers):
 
             # Find objects in the image
-            segmentation = self.find_objects_in_image(search_image, object_size_range)
+            segmentation = self.post_process_segmentation(segmentation, object_size_range)
 
-            if segmentation.max() > 0:
+            if object_index is not None:
+                self._image_new_objects(search_image, segmentation, y, x, metric, object_index, imaging_function,
+                                        images, num_objects)
+            elif segmentation.max() > 0:
                 # center the stage on the object found that maximizes sum_intensity
                 pixel_coordinates = self.find_best_centroid(search_image, segmentation)
                 offset = self.microscope.get_stage_offset_from_pixel_coordinates(pixel_coordinates)
@@ -162,3 +254,85 @@ class SmartObjectFinder:
                 break
 
         return np.asarray(images)
+
+    def _image_new_objects(self, search_image, segmentation, y, x, metric, object_index, imaging_function, images,
+                           num_objects):
+        '''Adds the objects of a tile to the index and images those that were not imaged at this time point.'''
+        if segmentation.max() == 0:
+            return
+        for y_object, x_object, value in self.find_object_positions(search_image, segmentation, y, x, metric):
+            detected_object, _ = object_index.add(y_object, x_object, value)
+            if detected_object.last_imaged == object_index.time_point or len(images) >= num_objects:
+                continue
+            self.microscope.move_stage_to_nearest_position_in_range(y_position_um=y_object, x_position_um=x_object)
+            images.append(imaging_function())
+            detected_object.last_imaged = object_index.time_point
+
+    def _acquire_scan_tiles(self, scan_positions, prescreen: TilePrescreen = None):
+        '''Yields (y, x, image) for the scan positions whose snapshot passes the prescreen.'''
+        statistics = self.scan_statistics
+        capture_function = None
+        if prescreen is not None:
+            capture_function = prescreen.capture_function
+            if capture_function is None and self.microscope.capabilities.live_preview:
+                capture_function = self.microscope.camera.take_snapshot
+            elif capture_function is None:
+                # a snapshot would be a full capture, so the capture is pre-screened and reused
+                warnings.warn("The microscope has no live preview, the full capture of each tile is pre-screened, "
+                              "which skips the segmentation but not the capture of empty tiles.")
+        for y, x in scan_positions:
+            statistics.n_tiles += 1
+            search_image = None
+            if prescreen is not None:
+                if capture_function is None:
+                    search_image = self._capture_scan_tile()
+                started = time.perf_counter()
+                passes = prescreen.passes(search_image if capture_function is None else capture_function())
+                statistics.prescreen_time_s += time.perf_counter() - started
+                if not passes:
+                    statistics.n_skipped += 1
+                    continue
+            if search_image is None:
+                search_image = self._capture_scan_tile()
+            yield y, x, search_image
+
+    def _capture_scan_tile(self):
+        started = time.perf_counter()
+        search_image = self.microscope.acquire_image()
+        self.scan_statistics.capture_time_s += time.perf_counter() - started
+        self.scan_statistics.n_captured += 1
+        return search_image
+
+    def _segment_scan_tiles(self, scan_tiles, n_workers: int = None):
+        '''Segments the (y, x, image) scan tiles and yields (y, x, image, segmentation) in scan order.
+
+        With n_workers, the images are segmented in a TileSegmentationPool and the next images are acquired
+        until the segmentation of the oldest image is done or the pool is busy. The stage is moved to the
+        scan position before each acquisition, so the caller may move it in between.
+        '''
+        statistics = self.scan_statistics
+        if not n_workers:
+            for y, x, search_image in scan_tiles:
+                started = time.perf_counter()
+                segmentation = self.segmenter.predict(features=self.features, image=search_image)
+                statistics.segmentation_time_s += time.perf_counter() - started
+                yield y, x, search_image, segmentation
+            return
+
+        from microscope_gym.features.tile_segmentation import TileSegmentationPool
+        with TileSegmentationPool(self.segmenter, self.features, n_workers=n_workers) as pool:
+            pending = deque()
+
+            def next_result():
+                y_tile, x_tile, tile, segmentation = pending.popleft()
+                started = time.perf_counter()
+                labels = segmentation.result()
+                statistics.segmentation_time_s += time.perf_counter() - started
+                return y_tile, x_tile, tile, labels
+
+            for y, x, search_image in scan_tiles:
+                pending.append((y, x, search_image, pool.submit(search_image)))
+                while pending and (pending[0][3].done() or len(pending) >= pool.max_pending):
+                    yield next_result()
+            while pending:
+                yield next_result()
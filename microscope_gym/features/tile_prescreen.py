@@ -0,0 +1,121 @@
+'''Pre-screen scan tiles with cheap image statistics before the full capture and segmentation.
+
+TilePrescreen bins a snapshot of the tile into blocks and computes two vectorised statistics:
+
+    percentile_intensity: percentile of the block means, high if the tile contains bright objects
+    local_variance: percentile of the variances within the blocks, high at object edges and texture
+
+A tile is skipped if none of the configured statistics reaches its threshold. ScanStatistics counts the
+skipped tiles and the time spent in each step of a scan, see SmartObjectFinder.scan_for_objects.
+
+The snapshot is only cheap if the microscope has a live preview (MicroscopeCapabilities.live_preview),
+otherwise Camera.take_snapshot() is a full capture. Without a capture_function, the scan therefore takes
+the snapshot with take_snapshot() only on microscopes with a live preview, and pre-screens the full capture
+of each tile on the others, which saves the segmentation but not the capture of the skipped tiles.
+
+example:
+    prescreen = TilePrescreen(intensity_threshold=200, binning=8)
+    images = finder.scan_for_objects(10, prescreen=prescreen)
+    print(finder.scan_statistics.summary())
+'''
+from typing import Callable, Dict
+
+import numpy as np
+
+
+class TilePrescreen:
+    '''Decide from cheap statistics of a snapshot whether a tile may contain objects.
+
+    methods:
+        get_statistics(image) -> {'percentile_intensity': float, 'local_variance': float}
+        passes(image) -> bool
+
+    Args:
+        intensity_threshold: tiles pass if the percentile of the binned intensities reaches it, None: not used
+        variance_threshold: tiles pass if the percentile of the variances within the bins reaches it, None: not used
+        percentile: percentile of the block statistics, high values keep tiles with small objects
+        binning: size in pixels of the square blocks the snapshot is binned into
+        capture_function: callable() -> numpy.ndarray that captures the snapshot, default: Camera.take_snapshot if the
+            microscope has a live preview, otherwise the full capture of the tile
+    '''
+
+    def __init__(self, intensity_threshold: float = None, variance_threshold: float = None,
+                 percentile: float = 99.0, binning: int = 4, capture_function: Callable[[], np.ndarray] = None):
+        if intensity_threshold is None and variance_threshold is None:
+            raise ValueError("At least one of intensity_threshold and variance_threshold must be given")
+        if binning < 1:
+            raise ValueError("binning must be at least 1")
+        self.intensity_threshold = intensity_threshold
+        self.variance_threshold = variance_threshold
+        self.percentile = percentile
+        self.binning = binning
+        self.capture_function = capture_function
+
+    def get_statistics(self, image: np.ndarray) -> Dict[str, float]:
+        image = np.asarray(image, dtype=np.float32)
+        image = image.reshape((-1,) + image.shape[-2:]).max(axis=0)
+        # crop to a multiple of the bin size, the blocks are axes 1 and 3
+        height, width = (size // self.binning * self.binning for size in image.shape)
+        if height == 0 or width == 0:
+            blocks = image.reshape(1, image.shape[0], 1, image.shape[1])
+        else:
+            blocks = image[:height, :width].reshape(height // self.binning, self.binning,
+                                                    width // self.binning, self.binning)
+        block_means = blocks.mean(axis=(1, 3))
+        block_variances = blocks.var(axis=(1, 3))
+        return {'percentile_intensity': float(np.percentile(block_means, self.percentile)),
+                'local_variance': float(np.percentile(block_variances, self.percentile))}
+
+    def passes(self, image: np.ndarray) -> bool:
+        '''Return True if the tile may contain objects, i.e. one of the statistics reaches its threshold.'''
+        statistics = self.get_statistics(image)
+        if self.intensity_threshold is not None and statistics['percentile_intensity'] >= self.intensity_threshold:
+            return True
+        return self.variance_threshold is not None and statistics['local_variance'] >= self.variance_threshold
+
+
+class ScanStatistics:
+    '''Number of tiles and time spent in each step of a scan.
+
+    Segmentation time is the time the scan waited for segmentations, i.e. without the time in which worker
+    processes segmented tiles while the scan acquired the next ones.
+
+    properties:
+        n_tiles: number of visited tiles
+        n_skipped: number of tiles skipped by the pre-screen
+        n_captured: number of tiles captured with Microscope.acquire_image
+        prescreen_time_s, capture_time_s, segmentation_time_s: total time of each step in s
+        time_saved_s: estimated time saved by skipping tiles, the mean capture time for each tile that was not
+            captured and the mean segmentation time for each skipped tile minus the time spent pre-screening
+    '''
+
+    def __init__(self):
+        self.n_tiles = 0
+        self.n_skipped = 0
+        self.n_captured = 0
+        self.prescreen_time_s = 0.0
+        self.capture_time_s = 0.0
+        self.segmentation_time_s = 0.0
+
+    @property
+    def n_segmented(self) -> int:
+        return self.n_tiles - self.n_skipped
+
+    @property
+    def skipped_fraction(self) -> float:
+        return self.n_skipped / self.n_tiles if self.n_tiles else 0.0
+
+    @property
+    def time_saved_s(self) -> float:
+        if self.n_segmented == 0:
+            return -self.prescreen_time_s
+        capture_time_per_tile_s = self.capture_time_s / self.n_captured if self.n_captured else 0.0
+        segmentation_time_per_tile_s = self.segmentation_time_s / self.n_segmented
+        return (self.n_tiles - self.n_captured) * capture_time_per_tile_s \
+            + self.n_skipped * segmentation_time_per_tile_s - self.prescreen_time_s
+
+    def summary(self) -> dict:
+        return {'n_tiles': self.n_tiles, 'n_skipped': self.n_skipped, 'n_captured': self.n_captured,
+                'skipped_fraction': self.skipped_fraction,
+                'prescreen_time_s': self.prescreen_time_s, 'capture_time_s': self.capture_time_s,
+                'segmentation_time_s': self.segmentation_time_s, 'time_saved_s': self.time_saved_s}
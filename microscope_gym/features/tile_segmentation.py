@@ -0,0 +1,243 @@
+'''Segment tiles with a trained segmenter in a pool of worker processes.
+
+The prediction of the apoc random forest is CPU-bound, so segmenting the tiles of a scan in the
+acquisition thread leaves the other cores idle. TileSegmentationPool pickles the segmenter once per
+worker process when the worker starts, i.e. the model stays loaded in every worker. The tiles and the
+label images are passed through shared memory slots that are reused for the following tiles, only the
+slot names and shapes are pickled.
+
+Results are returned in submission order: submit() returns a TileSegmentation that is resolved when its
+worker is done, map() yields the segmentations of an iterable of tiles in order while the following tiles
+are segmented.
+
+mosaic_tiles() and split_mosaic() segment many tiles with a single predict() call instead: the tiles are
+placed in a grid, each surrounded by a border of padding pixels that repeats its edge pixels. Like the
+clamp-to-edge border handling of pyclesperanto, so the feature filters see the same neighbourhood at the
+tile edges as for a single tile. The label image of the mosaic is cut back into one label image per tile.
+
+example:
+    with TileSegmentationPool(segmenter, features="gaussian_blur=1", n_workers=4) as pool:
+        for segmentation in pool.map(tiles):
+            ...
+
+    mosaic, regions = mosaic_tiles(tiles, padding=16)
+    segmentations = split_mosaic(segmenter.predict(features="gaussian_blur=1", image=mosaic), regions)
+'''
+import math
+import os
+import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+LABEL_DTYPE = np.dtype(np.uint32)
+
+# state of a worker process, set by _initialize_worker
+_worker_segmenter = None
+_worker_features = None
+
+
+def _initialize_worker(segmenter_bytes: bytes, features: str):
+    global _worker_segmenter, _worker_features
+    _worker_segmenter = pickle.loads(segmenter_bytes)
+    _worker_features = features
+
+
+def _segment_tile(tile_name: str, labels_name: str, shape: Tuple[int, ...], dtype: str) -> int:
+    '''Segment the tile in the shared memory tile_name into labels_name and return the largest label.'''
+    tile_memory, labels_memory = SharedMemory(name=tile_name), SharedMemory(name=labels_name)
+    try:
+        tile = np.ndarray(shape, dtype=np.dtype(dtype), buffer=tile_memory.buf)
+        segmentation = np.asarray(_worker_segmenter.predict(features=_worker_features, image=tile))
+        if segmentation.shape != tuple(shape):
+            raise ValueError(f"The segmentation has the shape {segmentation.shape}, expected {tuple(shape)}")
+        labels = np.ndarray(shape, dtype=LABEL_DTYPE, buffer=labels_memory.buf)
+        np.copyto(labels, segmentation, casting='unsafe')
+        del tile, labels
+        return int(segmentation.max(initial=0))
+    finally:
+        tile_memory.close()
+        labels_memory.close()
+
+
+class _Slot:
+    '''Shared memory for one tile in flight and its label image.'''
+
+    def __init__(self, nbytes: int, n_pixels: int):
+        self.tile = SharedMemory(create=True, size=max(nbytes, 1))
+        self.labels = SharedMemory(create=True, size=max(n_pixels * LABEL_DTYPE.itemsize, 1))
+
+    def fits(self, image: np.ndarray) -> bool:
+        return self.tile.size >= image.nbytes and self.labels.size >= image.size * LABEL_DTYPE.itemsize
+
+    @property
+    def names(self) -> Tuple[str, str]:
+        return self.tile.name, self.labels.name
+
+    def release(self):
+        for memory in (self.tile, self.labels):
+            memory.close()
+            memory.unlink()
+
+
+class TileSegmentation:
+    '''Pending segmentation of a tile, see TileSegmentationPool.submit().
+
+    methods:
+        done() -> bool
+        result(timeout) -> numpy.ndarray
+    '''
+
+    def __init__(self, pool: 'TileSegmentationPool', slot: _Slot, shape: Tuple[int, ...], future):
+        self._pool = pool
+        self._slot = slot
+        self._shape = shape
+        self._future = future
+        self._result: Optional[np.ndarray] = None
+
+    def done(self) -> bool:
+        return self._result is not None or self._future.done()
+
+    def result(self, timeout: float = None) -> np.ndarray:
+        '''Return the label image of the tile, raises the exception of the segmenter if it failed.'''
+        if self._result is None:
+            try:
+                self._future.result(timeout)
+                labels = np.ndarray(self._shape, dtype=LABEL_DTYPE, buffer=self._slot.labels.buf)
+                self._result = labels.copy()
+                del labels
+            finally:
+                if self._future.done():
+                    self._pool._release_slot(self._slot)
+        return self._result
+
+
+class TileSegmentationPool:
+    '''Segment tiles with segmenter.predict(features=features, image=tile) in worker processes.
+
+    methods:
+        submit(image) -> TileSegmentation
+        map(images) -> iterator of label images in the order of the images
+        close()
+
+    Args:
+        segmenter: trained segmenter, e.g. apoc.ObjectSegmenter, it is pickled once for each worker
+        features: feature specification passed to segmenter.predict
+        n_workers: number of worker processes, default: number of CPUs - 1
+        max_pending: maximum number of tiles that map() segments ahead, default: 2 * n_workers
+        start_method: multiprocessing start method, "spawn" avoids forking an initialized OpenCL context
+    '''
+
+    def __init__(self, segmenter, features: str, n_workers: int = None, max_pending: int = None,
+                 start_method: str = "spawn"):
+        self.n_workers = n_workers or max((os.cpu_count() or 2) - 1, 1)
+        self.max_pending = max_pending or 2 * self.n_workers
+        self._executor = ProcessPoolExecutor(max_workers=self.n_workers, mp_context=get_context(start_method),
+                                             initializer=_initialize_worker,
+                                             initargs=(pickle.dumps(segmenter), features))
+        self._free_slots: List[_Slot] = []
+        self._slots: List[_Slot] = []
+
+    def submit(self, image: np.ndarray) -> TileSegmentation:
+        '''Copy the image into shared memory and segment it in a worker process.'''
+        image = np.ascontiguousarray(image)
+        slot = self._get_slot(image)
+        np.ndarray(image.shape, dtype=image.dtype, buffer=slot.tile.buf)[...] = image
+        future = self._executor.submit(_segment_tile, *slot.names, image.shape, image.dtype.str)
+        return TileSegmentation(self, slot, image.shape, future)
+
+    def map(self, images: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        '''Yield the label images of the images in order, segmenting up to max_pending images ahead.'''
+        pending = deque()
+        for image in images:
+            pending.append(self.submit(image))
+            if len(pending) >= self.max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        '''Stop the workers and free the shared memory.'''
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for slot in self._slots:
+            slot.release()
+        self._slots, self._free_slots = [], []
+
+    def __enter__(self) -> 'TileSegmentationPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_slot(self, image: np.ndarray) -> _Slot:
+        for index, slot in enumerate(self._free_slots):
+            if slot.fits(image):
+                return self._free_slots.pop(index)
+        if self._free_slots:
+            # replace a free slot that is too small for the image
+            slot = self._free_slots.pop()
+            self._slots.remove(slot)
+            slot.release()
+        slot = _Slot(image.nbytes, image.size)
+        self._slots.append(slot)
+        return slot
+
+    def _release_slot(self, slot: _Slot):
+        if slot in self._slots and slot not in self._free_slots:
+            self._free_slots.append(slot)
+
+
+def mosaic_tiles(tiles: Sequence[np.ndarray], padding: int = 16,
+                 n_columns: int = None) -> Tuple[np.ndarray, List[Tuple[slice, slice]]]:
+    '''Place 2D tiles in a grid with a border of padding pixels around each tile that repeats its edge pixels.
+
+    Args:
+        tiles: list of 2D images or 3D array (tile, y, x), e.g. the output of Microscope.acquire_tiled_image
+        padding: width of the border around each tile in pixels, should cover the radius of the feature filters
+        n_columns: number of tiles per row of the mosaic, default: square grid
+
+    Returns:
+        mosaic, regions -- mosaic image and the (y, x) slices of each tile in the mosaic
+    '''
+    tiles = [np.asarray(tile) for tile in tiles]
+    if not tiles:
+        raise ValueError("No tiles to mosaic")
+    if any(tile.ndim != 2 for tile in tiles):
+        raise ValueError("Only 2D tiles can be mosaicked")
+    n_columns = n_columns or math.ceil(math.sqrt(len(tiles)))
+    n_rows = math.ceil(len(tiles) / n_columns)
+    cell_height = max(tile.shape[0] for tile in tiles) + 2 * padding
+    cell_width = max(tile.shape[1] for tile in tiles) + 2 * padding
+    mosaic = np.zeros((n_rows * cell_height, n_columns * cell_width), dtype=np.result_type(*tiles))
+    regions = []
+    for index, tile in enumerate(tiles):
+        top = index // n_columns * cell_height
+        left = index % n_columns * cell_width
+        # smaller tiles are extended up to the size of the cell
+        padded = np.pad(tile, ((padding, cell_height - tile.shape[0] - padding),
+                               (padding, cell_width - tile.shape[1] - padding)), mode='edge')
+        mosaic[top:top + cell_height, left:left + cell_width] = padded
+        regions.append((slice(top + padding, top + padding + tile.shape[0]),
+                        slice(left + padding, left + padding + tile.shape[1])))
+    return mosaic, regions
+
+
+def split_mosaic(mosaic_labels: np.ndarray, regions: List[Tuple[slice, slice]]) -> List[np.ndarray]:
+    '''Cut the label image of a mosaic (see mosaic_tiles) into one label image per tile.
+
+    The padding of neighbouring tiles touches, so the segmenter can give objects of different tiles, or of
+    the same tile, one label through the padding. Each tile is therefore relabelled: its labels are the
+    8-connected components of the foreground, like the connected components of apoc.ObjectSegmenter,
+    numbered sequentially from 1.
+    '''
+    from scipy import ndimage
+    mosaic_labels = np.asarray(mosaic_labels)
+    segmentations = []
+    for region in regions:
+        labels, _ = ndimage.label(mosaic_labels[region] > 0, structure=np.ones((3, 3)))
+        segmentations.append(labels.astype(LABEL_DTYPE))
+    return segmentations
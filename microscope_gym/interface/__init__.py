@@ -1,6 +1,7 @@
 from microscope_gym.interface.camera import Camera, CameraSettings
 from microscope_gym.interface.stage import Stage, Axis
-from microscope_gym.interface.microscope import Microscope
+from microscope_gym.interface.microscope import Microscope, MicroscopeCapabilities
 from microscope_gym.interface.objective import Objective
+from microscope_gym.interface.tile_store import SparseTileStore
 
 __version__ = "0.0.1"
@@ -4,11 +4,33 @@ TODO: consider using pydantic for validation'''
 
 
 from abc import ABC, abstractmethod
-from pydantic import ValidationError
+from typing import List
+from pydantic import BaseModel, Field, ValidationError
 import numpy as np
 from .camera import Camera
 from .stage import Stage, get_nearest_position_in_range
 from .objective import Objective
+from .tile_store import SparseTileStore
+
+
+class MicroscopeCapabilities(BaseModel):
+    '''Capabilities of a microscope adapter.
+
+    Features can use these flags to pick the fastest code path that an adapter supports
+    instead of probing the adapter at runtime. The class attribute Microscope.capabilities lists
+    what every microscope of an adapter supports; an instance can add capabilities that depend on
+    its configuration, e.g. live_preview if its camera has a live stream, but never remove one.'''
+    supports_roi: bool = Field(False, description="camera region of interest can be configured")
+    hardware_z_stack: bool = Field(False, description="z-stacks are sequenced by the microscope in a single acquisition")
+    hardware_tiling: bool = Field(False, description="tiled acquisitions are sequenced by the microscope in a single acquisition")
+    multi_channel: bool = Field(False, description="several channels can be acquired in a single acquisition")
+    multi_view: bool = Field(False, description="the microscope records several views (cameras) at once")
+    live_preview: bool = Field(False, description="Camera.take_snapshot is faster than Camera.capture_image")
+    objective_switching: bool = Field(False, description="the objective can be changed with Microscope.switch_objective")
+    asynchronous: bool = Field(False, description="commands are sent without blocking until the microscope replies")
+
+    class Config:
+        allow_mutation = False
 
 
 class Microscope(ABC):
@@ -18,20 +40,59 @@ class Microscope(ABC):
         move_stage(x, y)
         capture_image()
         acquire_z_stack()
+        acquire_tiled_image(y_range, x_range)
+        acquire_sparse_tiled_image(mask)
         get_metadata()
         get_stage_position()
+        switch_objective(name)
+        get_sample_position_um(stage_position_um) -> (y, x)
+        get_stage_position_for_sample_position(sample_position_um) -> (y, x)
 
     properties:
         camera(): Camera object
         stage(): Stage object
         objective(): Objective object
+            objective in use
+        objectives: {name: Objective}
+            all objectives of the microscope
+        capabilities: MicroscopeCapabilities
+            what the adapter supports beyond the basic interface, the class attribute holds what every
+            instance supports, instances may add to it (see MicroscopeCapabilities)
     '''
+    capabilities = MicroscopeCapabilities()
 
     def __init__(self, camera: Camera, stage: Stage,
-                 objective: Objective):
+                 objective: Objective, objectives: List[Objective] = None):
         self.camera = camera
         self.stage = stage
         self.objective = objective
+        self.objectives = {objective.name: objective}
+        self.objectives.update({other.name: other for other in objectives or []})
+
+    def switch_objective(self, name: str):
+        '''Switch to another objective of the microscope, see objectives.'''
+        if name not in self.objectives:
+            raise ValueError(f"Unknown objective {name!r}, available objectives: {list(self.objectives)}")
+        if name != self.objective.name:
+            self._change_objective(self.objectives[name])
+            self.objective = self.objectives[name]
+
+    def get_sample_position_um(self, stage_position_um: tuple = None) -> np.ndarray:
+        '''Return the (y, x) sample position in µm of the centre of the field of view of the current objective.
+
+        Sample positions do not depend on the objective, e.g. to image an object found with one objective with
+        another (see get_stage_position_for_sample_position).
+
+        Args:
+            stage_position_um (y, x): stage position, default: current stage position
+        '''
+        if stage_position_um is None:
+            stage_position_um = (self.stage.y_position_um, self.stage.x_position_um)
+        return np.asarray(stage_position_um, dtype=float) + self.objective.calibration_offset_um
+
+    def get_stage_position_for_sample_position(self, sample_position_um: tuple) -> np.ndarray:
+        '''Return the (y, x) stage position in µm that centres a sample position in the field of view of the current objective.'''
+        return np.asarray(sample_position_um, dtype=float) - self.objective.calibration_offset_um
 
     def move_stage_to(self, absolute_z_position_um=None, absolute_y_position_um=None, absolute_x_position_um=None):
         if absolute_z_position_um is not None:
@@ -81,18 +142,42 @@ class Microscope(ABC):
                 If stop and step are not given, start is interpreted as the stop argument and start will be the minimum stage x range.
                 If the tuple is empty, the entire Stage.x_range is used.
         '''
-        default_step = self.get_field_of_view_um() * 0.9
-        y_range = self._set_range(y_range, default_range=self.stage.y_range + (default_step[0],))
-        x_range = self._set_range(x_range, default_range=self.stage.x_range + (default_step[1],))
-        x_steps = int(np.ceil((x_range[1] - x_range[0]) / x_range[2]))
-        y_steps = int(np.ceil((y_range[1] - y_range[0]) / y_range[2]))
-        x_positions = np.linspace(x_range[0], x_range[1], x_steps)
-        y_positions = np.linspace(y_range[0], y_range[1], y_steps)
-        all_x_positions, all_y_positions = np.meshgrid(x_positions, y_positions)
-        for y, x in zip(all_y_positions.flatten(), all_x_positions.flatten()):
+        for y, x in zip(*self.get_scan_positions(y_range, x_range)):
             self.move_stage_to(absolute_y_position_um=y, absolute_x_position_um=x)
             yield y, x
 
+    def get_scan_positions(self, y_range: tuple = (), x_range: tuple = ()):
+        '''Return the y and x stage positions in µm that scan_stage_positions visits, in scan order.
+
+        Args:
+            y_range, x_range: see scan_stage_positions
+        '''
+        all_y_positions, all_x_positions = self._get_scan_grid(y_range, x_range)
+        return all_y_positions.flatten(), all_x_positions.flatten()
+
+    def get_mask_scan_positions(self, mask: np.ndarray, mask_pixel_size_um: float = None, mask_origin_um: tuple = (0, 0),
+                                y_range: tuple = (), x_range: tuple = ()):
+        '''Return the scan positions (see get_scan_positions) whose field of view intersects a mask.
+
+        Args:
+            mask: label image or boolean mask (y, x) of the sample, e.g. a segmentation of acquire_overview_image().
+                Masks with more dimensions are projected along the leading axes.
+            mask_pixel_size_um: pixel size of the mask in µm, default: get_sample_pixel_size_um()
+            mask_origin_um: (y, x) stage position in µm of the top left corner of the mask
+            y_range, x_range: see scan_stage_positions
+
+        Returns:
+            y_positions, x_positions, grid_indices, grid_shape --
+                stage positions in µm and (row, column) in the scan grid of the tiles that contain mask pixels,
+                and the (rows, columns) of the full scan grid
+        '''
+        all_y_positions, all_x_positions = self._get_scan_grid(y_range, x_range)
+        intersects = self._field_of_view_intersects_mask(all_y_positions, all_x_positions, mask,
+                                                         mask_pixel_size_um, mask_origin_um)
+        rows, columns = np.nonzero(intersects)
+        return (all_y_positions[rows, columns], all_x_positions[rows, columns], np.stack([rows, columns], axis=1),
+                intersects.shape)
+
     def get_stage_position(self):
         return self.stage.z_position_um, self.stage.y_position_um, self.stage.x_position_um
 
@@ -153,7 +238,7 @@ class Microscope(ABC):
                 If stop and step are not given, start is interpreted as the stop argument and start will be the minimum stage x range.
                 If the tuple is empty, the entire Stage.x_range is used.
         '''
-        return self._acquire_tiled(y_range, x_range)
+        return self._acquire_tiled(None, y_range, x_range)
 
     def acquire_tiled_z_stack(self, z_range: tuple, y_range: tuple, x_range: tuple) -> np.ndarray:
         '''Acquire tiled z-stack.
@@ -177,11 +262,33 @@ class Microscope(ABC):
         '''
         return self._acquire_tiled(z_range, y_range, x_range)
 
+    def acquire_sparse_tiled_image(self, mask: np.ndarray, mask_pixel_size_um: float = None,
+                                   mask_origin_um: tuple = (0, 0), y_range: tuple = (),
+                                   x_range: tuple = ()) -> SparseTileStore:
+        '''Acquire only the tiles of a tiled image whose field of view intersects a mask.
+
+        Args:
+            mask, mask_pixel_size_um, mask_origin_um: see get_mask_scan_positions
+            y_range, x_range: see acquire_tiled_image
+        '''
+        y_positions, x_positions, grid_indices, grid_shape = self.get_mask_scan_positions(
+            mask, mask_pixel_size_um, mask_origin_um, y_range, x_range)
+        positions_um = np.stack([y_positions, x_positions], axis=1)
+        if len(positions_um) == 0:
+            tiles = np.empty((0,) + tuple(self.camera.image_shape))
+        else:
+            tiles = self._acquire_tiles(None, y_positions, x_positions)
+        return SparseTileStore(grid_shape, grid_indices, positions_um, tiles)
+
     @abstractmethod
     def acquire_overview_image(self) -> np.ndarray:
         '''Acquire overview image that shows a larger part of the sample (often at lower resolution). Depends on the microscope vendor how this is implemented. It is recommended to use acquire_tiled_image instead if the overwiew image is used in an algorithm.'''
         pass
 
+    def _change_objective(self, objective: Objective):
+        '''Move the new objective into the light path, adapters with an objective changer override this.'''
+        pass
+
     @abstractmethod
     def get_metadata(self) -> dict:
         '''Get metadata in OME-XML format.'''
@@ -196,7 +303,47 @@ class Microscope(ABC):
             range = range + (default_range[2],)
         return range
 
+    def _get_scan_grid(self, y_range: tuple = (), x_range: tuple = ()):
+        '''Return the y and x stage positions in µm of the scan grid as arrays (rows, columns).'''
+        default_step = self.get_field_of_view_um() * 0.9
+        y_range = self._set_range(y_range, default_range=self.stage.y_range + (default_step[0],))
+        x_range = self._set_range(x_range, default_range=self.stage.x_range + (default_step[1],))
+        x_steps = int(np.ceil((x_range[1] - x_range[0]) / x_range[2]))
+        y_steps = int(np.ceil((y_range[1] - y_range[0]) / y_range[2]))
+        x_positions = np.linspace(x_range[0], x_range[1], x_steps)
+        y_positions = np.linspace(y_range[0], y_range[1], y_steps)
+        all_x_positions, all_y_positions = np.meshgrid(x_positions, y_positions)
+        return all_y_positions, all_x_positions
+
+    def _field_of_view_intersects_mask(self, y_positions: np.ndarray, x_positions: np.ndarray, mask: np.ndarray,
+                                       mask_pixel_size_um: float = None, mask_origin_um: tuple = (0, 0)) -> np.ndarray:
+        '''Return whether the field of view at each stage position contains mask pixels.
+
+        The mask pixels in each field of view are counted with a summed-area table, i.e. in constant time per position.'''
+        mask = np.asarray(mask) > 0
+        if mask.ndim > 2:
+            mask = mask.reshape((-1,) + mask.shape[-2:]).any(axis=0)
+        if mask_pixel_size_um is None:
+            mask_pixel_size_um = self.get_sample_pixel_size_um()
+        summed_area = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int64)
+        summed_area[1:, 1:] = mask.cumsum(axis=0).cumsum(axis=1)
+        half_field_of_view = self.get_field_of_view_um() / 2
+        # first and last + 1 mask row and column in the field of view; pixel i covers [i, i + 1) * pixel size
+        top = np.floor((y_positions - half_field_of_view[0] - mask_origin_um[0]) / mask_pixel_size_um)
+        bottom = np.ceil((y_positions + half_field_of_view[0] - mask_origin_um[0]) / mask_pixel_size_um)
+        left = np.floor((x_positions - half_field_of_view[1] - mask_origin_um[1]) / mask_pixel_size_um)
+        right = np.ceil((x_positions + half_field_of_view[1] - mask_origin_um[1]) / mask_pixel_size_um)
+        top, bottom = (np.clip(edge, 0, mask.shape[0]).astype(int) for edge in (top, bottom))
+        left, right = (np.clip(edge, 0, mask.shape[1]).astype(int) for edge in (left, right))
+        n_mask_pixels = (summed_area[bottom, right] - summed_area[top, right]
+                         - summed_area[bottom, left] + summed_area[top, left])
+        return n_mask_pixels > 0
+
     def _acquire_tiled(self, z_range: tuple = (), y_range: tuple = (), x_range: tuple = ()) -> np.ndarray:
+        return self._acquire_tiles(z_range, *self.get_scan_positions(y_range, x_range))
+
+    def _acquire_tiles(self, z_range: tuple, y_positions: np.ndarray, x_positions: np.ndarray) -> np.ndarray:
+        '''Acquire an image (z_range None) or a z-stack at each stage position and return them as array (tile, ...).'''
         x_position_before = self.stage.x_position_um
         y_position_before = self.stage.y_position_um
         if z_range is None:
@@ -204,7 +351,8 @@ class Microscope(ABC):
         else:
             def image_function(): return self.acquire_z_stack(z_range)
         images = []
-        for y, x in self.scan_stage_positions(y_range, x_range):
+        for y, x in zip(y_positions, x_positions):
+            self.move_stage_to(absolute_y_position_um=y, absolute_x_position_um=x)
             images.append(image_function())
         self.move_stage_to(absolute_y_position_um=y_position_before, absolute_x_position_um=x_position_before)
         return np.asarray(images)
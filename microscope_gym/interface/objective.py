@@ -1,6 +1,8 @@
 '''Microscope objective class.
 
 Since the objective does not have any methods, it is not implemented as an interface, but as a real class.'''
+from typing import Tuple
+
 from pydantic import BaseModel, Field
 
 
@@ -12,3 +14,6 @@ class Objective(BaseModel):
     numerical_aperture: float = Field(...,
                                       description="numerical aperture - NA = sin(θ) (θ = half angle of cone of light captured by objective)")
     immersion: str = Field(..., description="immersion medium (e.g. 'air', 'oil', 'water', 'glycerol', 'silicone oil')")
+    calibration_offset_um: Tuple[float, float] = Field(
+        (0.0, 0.0), description="(y, x) offset in µm of the centre of the field of view from the stage position, "
+                                "calibrated per objective to hand off coordinates between objectives")
@@ -33,6 +33,8 @@ class Stage():
     methods:
         get_nearest_positions_in_range(z_position: float, y_position: float, x_position: float) -> tuple
             get nearest position in range
+        move_axes(**positions_um: float)
+            move several axes at once, e.g. move_axes(x=100.0, y=50.0)
         wait_until_stopped(timeout_ms: float) -> bool
             wait until stage is stopped, return True if stopped, False if timeout
         is_moving() -> bool
@@ -174,6 +176,10 @@ class Stage():
                 return False
         return True
 
+    def move_axes(self, **positions_um: float):
+        '''Move the given axes to new positions (in um) with a single update, the other axes keep their position.'''
+        self._update_axes_positions(list(positions_um), list(positions_um.values()))
+
     def _update_axes_positions(self, axis_names: List[str], positions: List[float]):
         '''Write new positions to axes.
 
@@ -0,0 +1,63 @@
+'''Sparse tile store for tiled acquisitions that skip empty tiles.'''
+from typing import Iterator, Tuple
+
+import numpy as np
+
+
+class SparseTileStore:
+    '''Tiles of a regular scan grid of which only some were acquired, see Microscope.acquire_sparse_tiled_image.
+
+    methods:
+        get_tile(row, column) -> numpy.ndarray or None
+        items() -> iterator of ((row, column), tile)
+        get_acquired_mask() -> numpy.ndarray (rows, columns) of bool
+        to_dense(fill_value) -> numpy.ndarray (rows, columns, ...) with fill_value for the missing tiles
+
+    properties:
+        grid_shape: (rows, columns) of the full scan grid
+        grid_indices: numpy.ndarray (tile, 2) of the (row, column) of each acquired tile
+        positions_um: numpy.ndarray (tile, 2) of the (y, x) stage position of each acquired tile in µm
+        tiles: numpy.ndarray (tile, ...) of the acquired images
+        coverage: fraction of the grid that was acquired
+    '''
+
+    def __init__(self, grid_shape: Tuple[int, int], grid_indices: np.ndarray, positions_um: np.ndarray,
+                 tiles: np.ndarray):
+        self.grid_shape = tuple(grid_shape)
+        self.grid_indices = np.asarray(grid_indices, dtype=int).reshape(-1, 2)
+        self.positions_um = np.asarray(positions_um, dtype=float).reshape(-1, 2)
+        self.tiles = tiles
+        if not len(self.grid_indices) == len(self.positions_um) == len(tiles):
+            raise ValueError("The number of grid indices, positions and tiles must be equal")
+        self._index = {(int(row), int(column)): index for index, (row, column) in enumerate(self.grid_indices)}
+
+    def __len__(self) -> int:
+        return len(self.grid_indices)
+
+    def __contains__(self, grid_index: Tuple[int, int]) -> bool:
+        return tuple(grid_index) in self._index
+
+    @property
+    def coverage(self) -> float:
+        return len(self) / max(int(np.prod(self.grid_shape)), 1)
+
+    def get_tile(self, row: int, column: int):
+        '''Return the tile at (row, column) of the grid, or None if it was not acquired.'''
+        index = self._index.get((row, column))
+        return None if index is None else self.tiles[index]
+
+    def items(self) -> Iterator[Tuple[Tuple[int, int], np.ndarray]]:
+        for grid_index, index in self._index.items():
+            yield grid_index, self.tiles[index]
+
+    def get_acquired_mask(self) -> np.ndarray:
+        acquired = np.zeros(self.grid_shape, dtype=bool)
+        acquired[self.grid_indices[:, 0], self.grid_indices[:, 1]] = True
+        return acquired
+
+    def to_dense(self, fill_value=0) -> np.ndarray:
+        '''Return all tiles as array (rows, columns, ...), with fill_value for the tiles that were not acquired.'''
+        tiles = np.asarray(self.tiles)
+        dense = np.full(self.grid_shape + tiles.shape[1:], fill_value, dtype=tiles.dtype)
+        dense[self.grid_indices[:, 0], self.grid_indices[:, 1]] = tiles
+        return dense
@@ -1,2 +1,13 @@
-from . import mock_scope
-from . import luxendo_trulive3d
+'''Adapters that implement the microscope_gym interface for specific microscopes.
+
+Adapter modules are imported on first access, so that vendor dependencies
+(e.g. paho-mqtt and h5py for the Luxendo adapter) are only loaded when they are used.'''
+import importlib
+
+_submodules = ("mock_scope", "luxendo_trulive3d", "microscope_factory")
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,663 @@
+'''Offline stand-in for a Luxendo TruLive3D that is controlled through MQTT.
+
+The emulator answers the commands of the luxendo_trulive3d adapter with the behaviour recorded
+in a LuxendoLog_*.json file (for example docs/data/LuxendoLog_2023-04-25T07_00_42.529Z.json)
+and writes synthetic HDF5 files that the adapter Camera can read. It runs against the
+in-process LocalBroker, or against any paho-mqtt compatible client, e.g. one that is connected
+to a broker on localhost. LivePreviewServer streams live frames of the emulator over a websocket.
+
+example:
+    broker = LocalBroker(latency_ms=2, jitter_ms=1)
+    emulator = TruLive3DEmulator(broker.client(), data_directory="emulated_data")
+    emulator.start()
+    api_handler = LuxendoAPIHandler(serial_number=emulator.serial_number, mqtt_client=broker.client())
+    stage = Stage(api_handler)
+'''
+import heapq
+import itertools
+import json
+import random
+import re
+import socketserver
+import tempfile
+import threading
+import time
+import zlib
+from copy import deepcopy
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from microscope_gym.microscope_adapters.luxendo_trulive3d import compile_topic_filter
+from microscope_gym.microscope_adapters.luxendo_recorder import load_luxendo_log
+from microscope_gym.microscope_adapters.luxendo_live_preview import encode_preview_frame, encode_websocket_frame, \
+    websocket_accept_key
+
+DEFAULT_LOG_PATH = Path(__file__).resolve().parents[2] / "docs" / "data" / "LuxendoLog_2023-04-25T07_00_42.529Z.json"
+
+
+class Message:
+    '''MQTT message as passed to paho-mqtt callbacks.'''
+
+    def __init__(self, topic: str, payload: bytes, timestamp: float):
+        self.topic = topic
+        self.payload = payload
+        self.timestamp = timestamp
+        self.qos = 0
+        self.retain = False
+
+
+class BrokerClient:
+    '''Client of a LocalBroker that implements the subset of the paho.mqtt.client.Client API used by this package.
+
+    Like paho's network loop, every client delivers its messages in its own thread (started with loop_start()).
+    '''
+
+    def __init__(self, broker: 'LocalBroker'):
+        self.broker = broker
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self._userdata = None
+        self._subscriptions: Dict[str, "re.Pattern"] = {}
+        self._topic_callbacks: Dict[str, tuple] = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._last_delivery_time = 0.0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.connected = False
+
+    def user_data_set(self, userdata):
+        self._userdata = userdata
+
+    def connect(self, host: str = "localhost", port: int = 1883, keepalive: int = 60, **kwargs):
+        self.broker._add_client(self)
+        self.connected = True
+        self._schedule(time.time(), self._handle_connect)
+        return 0
+
+    def disconnect(self):
+        if not self.connected:
+            return 0
+        self.connected = False
+        self.broker._remove_client(self)
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, self._userdata, 0)
+        return 0
+
+    def loop_start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name="LocalBrokerClient", daemon=True)
+        self._thread.start()
+
+    def loop_stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def subscribe(self, topic: str, qos: int = 0, **kwargs):
+        self._subscriptions[topic] = compile_topic_filter(topic)
+        return 0, 0
+
+    def unsubscribe(self, topic: str, **kwargs):
+        self._subscriptions.pop(topic, None)
+        return 0, 0
+
+    def message_callback_add(self, sub: str, callback: Callable):
+        self._topic_callbacks[sub] = (compile_topic_filter(sub), callback)
+
+    def message_callback_remove(self, sub: str):
+        self._topic_callbacks.pop(sub, None)
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False, **kwargs):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.broker.publish(topic, payload or b'')
+
+    def is_subscribed(self, topic: str) -> bool:
+        return any(pattern.match(topic) for pattern in list(self._subscriptions.values()))
+
+    def _handle_connect(self):
+        if self.on_connect is not None:
+            self.on_connect(self, self._userdata, {}, 0)
+
+    def _deliver(self, topic: str, payload: bytes, delivery_time: float):
+        with self._condition:
+            # a client receives messages in the order in which they were published
+            delivery_time = max(delivery_time, self._last_delivery_time)
+            self._last_delivery_time = delivery_time
+        message = Message(topic, payload, delivery_time)
+        self._schedule(delivery_time, lambda: self._dispatch(message))
+
+    def _dispatch(self, message: Message):
+        # same semantics as paho: topic specific callbacks replace the generic on_message callback
+        matching_callbacks = [callback for pattern, callback in list(self._topic_callbacks.values())
+                              if pattern.match(message.topic)]
+        if not matching_callbacks and self.on_message is not None:
+            matching_callbacks = [self.on_message]
+        for callback in matching_callbacks:
+            callback(self, self._userdata, message)
+
+    def _schedule(self, delivery_time: float, action: Callable):
+        with self._condition:
+            heapq.heappush(self._queue, (delivery_time, next(self._sequence), action))
+            self._condition.notify_all()
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._queue or self._queue[0][0] > time.time()):
+                    timeout = self._queue[0][0] - time.time() if self._queue else None
+                    self._condition.wait(timeout)
+                if not self._running:
+                    return
+                _, _, action = heapq.heappop(self._queue)
+            action()
+
+
+class LocalBroker:
+    '''In-process stand-in for an MQTT broker with configurable latency and jitter.
+
+    Every message is delivered latency_ms + uniform(0, jitter_ms) after it has been published.
+    The order of the messages that a client receives is preserved.
+    '''
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._clients: List[BrokerClient] = []
+        self._lock = threading.Lock()
+
+    def client(self) -> BrokerClient:
+        '''Create a new client (a drop-in replacement for paho.mqtt.client.Client()).'''
+        return BrokerClient(self)
+
+    def publish(self, topic: str, payload: bytes):
+        published = time.time()
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            if client.is_subscribed(topic):
+                delay_ms = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+                client._deliver(topic, payload, published + delay_ms / 1000.0)
+
+    def _add_client(self, client: BrokerClient):
+        with self._lock:
+            if client not in self._clients:
+                self._clients.append(client)
+
+    def _remove_client(self, client: BrokerClient):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+
+def default_image_generator(camera_name: str, z_um: float, y_um: float, x_um: float,
+                            height_pixels: int, width_pixels: int) -> np.ndarray:
+    '''Generate a reproducible noise image for a camera at a stage position.'''
+    seed = zlib.crc32(f"{camera_name} {z_um:.3f} {y_um:.3f} {x_um:.3f}".encode())
+    rng = np.random.default_rng(seed)
+    return rng.poisson(100, size=(height_pixels, width_pixels)).astype(np.uint16)
+
+
+class TruLive3DEmulator:
+    '''Emulates a Luxendo TruLive3D on the MQTT API that is used by the luxendo_trulive3d adapter.
+
+    The initial configuration (stages, stacks, events, channels, timings, cameras and storage)
+    is taken from the last state recorded for each topic in a LuxendoLog file.
+
+    Answers:
+        <serial>/gui: get/set/add/del/replaceall/addtask/addtrigger/replacetasks for the devices
+            stages, stacks, events, channels and timings, system scopeconfig and execution run
+        <serial>/gui/directory: disk getconfig and set (selectedsource)
+        <serial>/gui/datahub: cameras setroi
+
+    Args:
+        client: paho-mqtt compatible client, e.g. LocalBroker.client()
+        log_path: LuxendoLog recording that defines the initial state of the instrument
+        data_directory: directory the synthetic HDF5 files are written to (default: temporary directory)
+        stage_speed_um_per_s: speed of the emulated stage
+        time_scale: scales emulated device durations (stage moves, exposures); 0 makes them instantaneous
+        image_generator: callable(camera_name, z_um, y_um, x_um, height_pixels, width_pixels) -> 2D array
+        stage_resolution_um: step size the stage targets are rounded to, like the 0.1 µm steps of the recorded
+            instrument (default: not rounded)
+    '''
+
+    def __init__(self, client, log_path=DEFAULT_LOG_PATH, data_directory=None,
+                 stage_speed_um_per_s: float = 10000.0, time_scale: float = 1.0,
+                 image_generator: Callable = default_image_generator, stage_resolution_um: float = None):
+        self.client = client
+        self.stage_speed_um_per_s = stage_speed_um_per_s
+        self.stage_resolution_um = stage_resolution_um
+        self.time_scale = time_scale
+        self.image_generator = image_generator
+        if data_directory is None:
+            self._temporary_directory = tempfile.TemporaryDirectory(prefix="luxendo_emulator_")
+            data_directory = self._temporary_directory.name
+        self.data_directory = Path(data_directory)
+        self.commands = []
+        self._lock = threading.RLock()
+        self._stage_timer = None
+        self._acquisition_thread = None
+        self._acquisition_counter = itertools.count()
+        self._load_state(load_luxendo_log(log_path))
+
+    def start(self, broker_address: str = "localhost", broker_port: int = 1883):
+        def on_connect(client, userdata, flags, result_code):
+            client.subscribe(self.serial_number + "/gui/#")
+
+        self.client.on_connect = on_connect
+        self.client.message_callback_add(self.serial_number + "/gui/#", self._on_command)
+        self.client.connect(broker_address, broker_port)
+        self.client.loop_start()
+
+    def stop(self):
+        if self._stage_timer is not None:
+            self._stage_timer.cancel()
+        if self._acquisition_thread is not None:
+            self._acquisition_thread.join()
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def wait_until_idle(self, timeout_s: float = 60.0) -> bool:
+        '''Wait until a running acquisition is finished.'''
+        if self._acquisition_thread is not None:
+            self._acquisition_thread.join(timeout_s)
+            return not self._acquisition_thread.is_alive()
+        return True
+
+    # state
+
+    def _load_state(self, log_entries: List[dict]):
+        self.serial_number = log_entries[0]['topic'].split('/')[0]
+        last_messages = {}
+        self.camera_serial_numbers = {}
+        for entry in log_entries:
+            topic = entry['topic'][len(self.serial_number) + 1:]
+            data = entry['message'].get('data', {})
+            if data.get('command') == 'set':
+                last_messages[topic] = entry['message']
+            if topic == 'embedded/cameras' and 'sn' in data and 'name' in data:
+                self.camera_serial_numbers[data['name']] = data['sn']
+        self.axes = last_messages['embedded/stages']['data']['axes']
+        self.stage_sets = last_messages['embedded/stages']['data'].get('stageSets', [])
+        self.stacks = last_messages['embedded/stacks']['data']['stacks']
+        self.events = last_messages['embedded/events']['data']['events']
+        self.channels = last_messages['embedded/channels']['data']['channels']
+        timings = last_messages['embedded/timings']['data']
+        self.timings = {'exposure': timings['exposure'], 'delay': timings['delay']}
+        self.disk = last_messages['datahub/directory']['data']
+        self.cameras = {}
+        for topic, message in last_messages.items():
+            if topic.startswith('datahub/cameras/') and 'roi' in message['data']:
+                self.cameras[message['data']['name']] = message['data']
+
+    def _axis(self, name: str) -> Optional[dict]:
+        for axis in self.axes:
+            if axis['name'] == name:
+                return axis
+        return None
+
+    def _find(self, elements: List[dict], name: str) -> Optional[dict]:
+        for element in elements:
+            if element['name'] == name:
+                return element
+        return None
+
+    def _new_name(self, prefix: str, elements: List[dict]) -> str:
+        names = {element['name'] for element in elements}
+        for index in itertools.count():
+            if f"{prefix}{index}" not in names:
+                return f"{prefix}{index}"
+
+    # publishing
+
+    def _publish(self, subtopic: str, message: dict):
+        self.client.publish(self.serial_number + '/' + subtopic, json.dumps(message))
+
+    def _publish_stages(self):
+        self._publish("embedded/stages", {
+            "data": {"command": "set", "axes": deepcopy(self.axes), "device": "stages", "stageSets": self.stage_sets},
+            "type": "device"})
+
+    def _publish_stacks(self):
+        self._publish("embedded/stacks", {
+            "data": {"command": "set", "device": "stacks", "stacks": deepcopy(self.stacks)}, "type": "operation"})
+
+    def _publish_events(self):
+        self._publish("embedded/events", {
+            "type": "operation", "data": {"device": "events", "command": "set", "events": deepcopy(self.events)}})
+
+    def _publish_channels(self):
+        self._publish("embedded/channels", {
+            "data": {"command": "set", "device": "channels", "channels": deepcopy(self.channels)}, "type": "operation"})
+
+    def _publish_timings(self):
+        self._publish("embedded/timings", {
+            "data": {"device": "timings", "command": "set", **self.timings}, "type": "device"})
+
+    def _publish_camera(self, name: str):
+        self._publish("embedded/cameras", {"type": "device", "data": {
+            "command": "set", "sn": self.camera_serial_numbers.get(name, name), "device": "cameras", "name": name}})
+        self._publish("datahub/cameras/" + name, {"data": deepcopy(self.cameras[name]), "type": "device"})
+
+    def _publish_disk(self):
+        self._publish("datahub/directory", {"data": deepcopy(self.disk), "type": "device"})
+
+    def _publish_execution(self, state: str):
+        self._publish("embedded/execution", {"type": "operation", "data": {
+            "device": "execution", "command": "set", "live": False,
+            "scheduler": state == "running", "schedulerstate": state}})
+
+    # command handling
+
+    def _on_command(self, client, userdata, message):
+        subtopic = message.topic[len(self.serial_number):]
+        command = json.loads(message.payload)
+        self.commands.append((subtopic, command))
+        data = command.get('data', {})
+        with self._lock:
+            if subtopic == '/gui/directory':
+                self._handle_disk(data)
+            elif subtopic == '/gui/datahub':
+                self._handle_camera(data)
+            else:
+                handler = getattr(self, "_handle_" + data.get('device', ''), None)
+                if handler is not None:
+                    handler(data)
+
+    def _handle_stages(self, data: dict):
+        if data.get('command') == 'set':
+            for requested_axis in data.get('axes', []):
+                axis = self._axis(requested_axis['name'])
+                target = requested_axis.get('value', requested_axis.get('target'))
+                if target is not None and self.stage_resolution_um:
+                    target = round(round(target / self.stage_resolution_um) * self.stage_resolution_um, 6)
+                if axis is not None and target is not None and axis['min'] <= target <= axis['max']:
+                    axis['target'] = target
+            self._start_stage_move()
+        self._publish_stages()
+
+    def _start_stage_move(self):
+        if self._stage_timer is not None:
+            self._stage_timer.cancel()
+        distance = max([abs(axis['target'] - axis['value']) for axis in self.axes] + [0])
+        duration = distance / self.stage_speed_um_per_s * self.time_scale
+        self._stage_timer = threading.Timer(duration, self._finish_stage_move)
+        self._stage_timer.daemon = True
+        self._stage_timer.start()
+
+    def _finish_stage_move(self):
+        with self._lock:
+            for axis in self.axes:
+                axis['value'] = axis['target']
+            self._publish_stages()
+
+    def _handle_stacks(self, data: dict):
+        command = data.get('command')
+        if command == 'add':
+            name = data.get('name') or self._new_name("stack_", self.stacks)
+            stack = self._make_stack(dict(data, name=name))
+            existing = self._find(self.stacks, name)
+            if existing is not None:
+                self.stacks.remove(existing)
+            self.stacks.append(stack)
+        elif command == 'del':
+            stack = self._find(self.stacks, data.get('name'))
+            if stack is not None:
+                self.stacks.remove(stack)
+        elif command == 'replaceall':
+            self.stacks = [self._make_stack(stack) for stack in data.get('stacks', [])]
+        self._publish_stacks()
+
+    def _make_stack(self, data: dict) -> dict:
+        elements = []
+        for element in data.get('elements', []):
+            tileable = element['name'] in ('x', 'y')
+            elements.append({"start": element['start'], "name": element['name'], "end": element['end'],
+                             "instack": not tileable, "canTile": tileable})
+        return {"elements": elements, "n": data.get('n', 1), "reps": data.get('reps', 1), "name": data['name'],
+                "ref": data.get('ref', 'z'), "description": data.get('description', '')}
+
+    def _handle_events(self, data: dict):
+        command = data.get('command')
+        event = self._find(self.events, data.get('event'))
+        if command == 'add':
+            self.events.append({"name": self._new_name("Event_", self.events), "tasks": [], "triggers": []})
+        elif command == 'del' and 'task' in data:
+            if event is not None:
+                event['tasks'] = [task for task in event['tasks'] if task['name'] != data['task']]
+        elif command == 'del' and 'trigger' in data:
+            if event is not None:
+                event['triggers'] = [trigger for trigger in event['triggers'] if trigger['name'] != data['trigger']]
+        elif command == 'del':
+            event = self._find(self.events, data.get('event', data.get('name')))
+            if event is not None:
+                self.events.remove(event)
+        elif command == 'addtask' and event is not None:
+            event['tasks'].extend(data.get('tasks', []))
+        elif command == 'replacetasks' and event is not None:
+            event['tasks'] = list(data.get('tasks', []))
+        elif command == 'addtrigger' and event is not None:
+            event['triggers'].extend(data.get('triggers', []))
+        self._publish_events()
+
+    def _handle_channels(self, data: dict):
+        command = data.get('command')
+        if command == 'add':
+            channel = deepcopy(self.channels[0])
+            channel['name'] = self._new_name("channel_", self.channels)
+            self.channels.append(channel)
+        elif command == 'del':
+            channel = self._find(self.channels, data.get('name'))
+            if channel is not None and len(self.channels) > 1:
+                self.channels.remove(channel)
+        self._publish_channels()
+
+    def _handle_timings(self, data: dict):
+        if data.get('command') == 'set':
+            timings = data.get('timings', data)
+            if 'exposure' in timings:
+                self.timings['exposure'] = timings['exposure']
+            if 'delayafter' in timings or 'delay' in timings:
+                self.timings['delay'] = timings.get('delayafter', timings.get('delay'))
+        self._publish_timings()
+
+    def _handle_system(self, data: dict):
+        if data.get('command') == 'scopeconfig':
+            for name in self.cameras:
+                self._publish_camera(name)
+
+    def _handle_disk(self, data: dict):
+        if data.get('command') == 'set' and 'selectedsource' in data:
+            with self._lock:
+                if any(source['name'] == data['selectedsource'] for source in self.disk['sources']['options']):
+                    self.disk['selectedsource'] = data['selectedsource']
+                    self.disk['sources']['value'] = data['selectedsource']
+        self._publish_disk()
+
+    def _handle_camera(self, data: dict):
+        camera = self.cameras.get(data.get('name'))
+        if camera is None:
+            return
+        if data.get('command') == 'setroi':
+            roi = camera['roi']
+            requested = data.get('roi', {})
+            valid = all(roi[key]['min'] <= value <= roi[key]['max'] and value % roi[key]['inc'] == 0
+                        for key, value in requested.items() if key in roi)
+            if valid:
+                for key, value in requested.items():
+                    if key in roi:
+                        roi[key]['value'] = value
+        self._publish_camera(camera['name'])
+
+    def _handle_execution(self, data: dict):
+        if data.get('command') == 'run' and data.get('state', True):
+            if self._acquisition_thread is not None and self._acquisition_thread.is_alive():
+                return
+            self._publish_execution("running")
+            self._acquisition_thread = threading.Thread(target=self._run_acquisition, name="TruLive3DEmulatorRun",
+                                                        daemon=True)
+            self._acquisition_thread.start()
+
+    def get_live_frames(self) -> List[tuple]:
+        '''Return (camera name, image) of the cameras of the first channel at the current stage position.'''
+        with self._lock:
+            position = {name: (self._axis(name) or {}).get('value', 0.0) for name in ('z', 'y', 'x')}
+            camera_names = [device['name'] for device in self.channels[0]['devices']
+                            if device['type'] == 'cameras' and device['name'] in self.cameras]
+            rois = {name: (self.cameras[name]['roi']['height']['value'], self.cameras[name]['roi']['width']['value'])
+                    for name in camera_names}
+        return [(name, self.image_generator(name, float(position['z']), float(position['y']), float(position['x']),
+                                            *rois[name]))
+                for name in camera_names]
+
+    # acquisition
+
+    def _run_acquisition(self):
+        with self._lock:
+            events = deepcopy(self.events)
+            stacks = {stack['name']: deepcopy(stack) for stack in self.stacks}
+            channels = {channel['name']: deepcopy(channel) for channel in self.channels}
+        acquisition_directory = self.data_directory / datetime.now().strftime(
+            f"%Y-%m-%d_%H%M%S_{next(self._acquisition_counter):03d}")
+        file_index = itertools.count()
+        for event in events:
+            for trigger in event['triggers']:
+                for repetition in range(trigger.get('reps', 1)):
+                    for task in sorted(event['tasks'], key=lambda task: task.get('order', 0)):
+                        stack = stacks.get(task['stack'])
+                        channel = channels.get(task['channel'])
+                        if stack is None or channel is None:
+                            continue
+                        self._acquire_stack(acquisition_directory, stack, channel, next(file_index))
+        with self._lock:
+            self._publish_execution("idle")
+
+    def _acquire_stack(self, acquisition_directory: Path, stack: dict, channel: dict, file_index: int):
+        import h5py
+        positions = {element['name']: np.linspace(element['start'], element['end'], stack['n'])
+                     for element in stack['elements']}
+        n_planes = stack['n'] * stack.get('reps', 1)
+        with self._lock:
+            timings = dict(self.timings)
+            exposure_s = (timings['exposure'] + timings['delay']) / 1000.0
+            camera_names = [device['name'] for device in channel['devices']
+                            if device['type'] == 'cameras' and device['name'] in self.cameras]
+            cameras = {name: deepcopy(self.cameras[name]) for name in camera_names}
+        time.sleep(n_planes * exposure_s * self.time_scale)
+        stack_directory = acquisition_directory / "raw" / f"{stack['name']}_{channel['name']}_obj_bottom"
+        stack_directory.mkdir(parents=True, exist_ok=True)
+        for name, camera in cameras.items():
+            height = camera['roi']['height']['value']
+            width = camera['roi']['width']['value']
+            planes = []
+            for repetition in range(stack.get('reps', 1)):
+                for plane in range(stack['n']):
+                    planes.append(self.image_generator(
+                        name,
+                        float(positions.get('z', [0.0] * stack['n'])[plane]),
+                        float(positions.get('y', [0.0] * stack['n'])[plane]),
+                        float(positions.get('x', [0.0] * stack['n'])[plane]),
+                        height, width))
+            metadata = {
+                "microscopeInfo": {"scopeType": "TruLive3D", "serialNumber": self.serial_number,
+                                   "softwareVersion": "emulator"},
+                "stack": stack,
+                "channel": channel['name'],
+                "camera": {"name": name, "sn": self.camera_serial_numbers.get(name, name),
+                           "roi": {key: value['value'] for key, value in camera['roi'].items()}},
+                "timings": timings,
+            }
+            file_path = stack_directory / f"Cam_{name}_{file_index:05d}.lux.h5"
+            with h5py.File(file_path, 'w') as image_file:
+                image_file.create_dataset('Data', data=np.asarray(planes))
+                image_file.create_dataset('metadata', data=json.dumps(metadata))
+            with self._lock:
+                self._publish("datahub/saving", {"data": {
+                    "command": "lastsavedimagespath", "device": "saving", "path": str(acquisition_directory)},
+                    "type": "device"})
+                self._publish("datahub/cameras", {"data": {
+                    "command": "response", "device": "cameras", "file_paths": [str(file_path)],
+                    "reply": "PostStack done", "sn": self.camera_serial_numbers.get(name, name)}, "type": "device"})
+
+
+class LivePreviewServer:
+    '''Websocket stand-in for the live stream of the instrument.
+
+    Every connected client receives the frames of the cameras of the first channel at the current stage
+    position of the emulator, encoded with encode_preview_frame (see luxendo_live_preview).
+
+    example:
+        server = LivePreviewServer(emulator)
+        server.start()
+        camera = Camera(api_handler, stage, disk, live_preview_url=server.url)
+
+    Args:
+        emulator: TruLive3DEmulator
+        host, port: address to listen on, port 0 picks a free port
+        frame_rate: frames per second and camera
+    '''
+
+    def __init__(self, emulator: TruLive3DEmulator, host: str = "127.0.0.1", port: int = 0, frame_rate: float = 50.0):
+        self.emulator = emulator
+        self.frame_rate = frame_rate
+        self._stopped = threading.Event()
+        preview_server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                preview_server._serve(self.request)
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"ws://{host}:{port}/live"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="LivePreviewServer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _serve(self, connection):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = connection.recv(1024)
+            if not chunk:
+                return
+            request += chunk
+        key = re.search(rb"Sec-WebSocket-Key:\s*(\S+)", request, re.IGNORECASE)
+        if key is None:
+            connection.sendall(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+            return
+        connection.sendall(("HTTP/1.1 101 Switching Protocols\r\n"
+                            "Upgrade: websocket\r\n"
+                            "Connection: Upgrade\r\n"
+                            f"Sec-WebSocket-Accept: {websocket_accept_key(key.group(1).decode())}\r\n\r\n").encode())
+        for sequence in itertools.count():
+            if self._stopped.is_set():
+                return
+            try:
+                for name, image in self.emulator.get_live_frames():
+                    connection.sendall(encode_websocket_frame(encode_preview_frame(name, sequence, image)))
+            except OSError:
+                return
+            time.sleep(1.0 / self.frame_rate)
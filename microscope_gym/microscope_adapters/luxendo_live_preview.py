@@ -0,0 +1,316 @@
+'''Live preview of a Luxendo TruLive3D through its websocket stream.
+
+The live stream delivers every camera frame as a binary websocket message, long before the frames of a
+run are written to disk. LivePreview receives the frames in a background thread and keeps the latest
+frame of each camera in a buffer that is reused for every frame, so that focus and centring loops can
+get a fresh frame with sub-second latency.
+
+A preview message consists of a 4 byte little-endian header length, a JSON header
+{"camera", "sequence", "shape", "dtype"} and the raw pixels in C order (see encode_preview_frame).
+Another message format can be used by passing a decoder to LivePreview.
+
+The websocket client (RFC 6455) only needs the standard library and supports what the preview needs:
+binary and text messages, fragmentation, ping/pong and close.
+
+example:
+    preview = LivePreview("ws://localhost:8080/live")
+    preview.start()
+    image = preview.wait_for_frame("long", timeout_s=1.0)
+    preview.stop()
+'''
+import base64
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+class WebSocketError(ConnectionError):
+    pass
+
+
+def websocket_accept_key(key: str) -> str:
+    '''Return the Sec-WebSocket-Accept value of a Sec-WebSocket-Key.'''
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+
+
+def encode_websocket_frame(payload: bytes, opcode: int = OPCODE_BINARY, mask: bool = False) -> bytes:
+    '''Encode a single, final websocket frame. Clients must mask their frames, servers must not.'''
+    length = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, mask_bit | length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, mask_bit | 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, mask_bit | 127, length)
+    if not mask:
+        return header + payload
+    masking_key = os.urandom(4)
+    return header + masking_key + _apply_mask(payload, masking_key)
+
+
+def _apply_mask(payload, masking_key: bytes) -> bytes:
+    data = np.frombuffer(payload, dtype=np.uint8)
+    key = np.resize(np.frombuffer(masking_key, dtype=np.uint8), len(data))
+    return (data ^ key).tobytes()
+
+
+class WebSocketConnection:
+    '''Minimal blocking websocket client.
+
+    receive() returns the payload of the next message as a memoryview of a buffer that is reused for
+    every message, i.e. it is only valid until the next call of receive().
+
+    methods:
+        connect()
+        receive() -> (opcode, memoryview)
+        send(payload, opcode)
+        close()
+    '''
+
+    def __init__(self, url: str, timeout_s: float = 5.0):
+        self.url = urlparse(url)
+        self.timeout_s = timeout_s
+        self._socket: Optional[socket.socket] = None
+        self._buffer = bytearray(1 << 16)
+        self._pending = b""
+        self._closed = False
+        self._send_lock = threading.Lock()
+
+    def connect(self):
+        self._socket = socket.create_connection((self.url.hostname, self.url.port or 80), self.timeout_s)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = self.url.path or "/"
+        if self.url.query:
+            path += "?" + self.url.query
+        request = (f"GET {path} HTTP/1.1\r\n"
+                   f"Host: {self.url.netloc}\r\n"
+                   "Upgrade: websocket\r\n"
+                   "Connection: Upgrade\r\n"
+                   f"Sec-WebSocket-Key: {key}\r\n"
+                   "Sec-WebSocket-Version: 13\r\n\r\n")
+        self._socket.sendall(request.encode())
+        response = b""
+        while b"\r\n\r\n" not in response:
+            chunk = self._socket.recv(1024)
+            if not chunk:
+                raise WebSocketError("Connection closed during the websocket handshake")
+            response += chunk
+        response, self._pending = response.split(b"\r\n\r\n", 1)
+        status_line, *header_lines = response.decode().split("\r\n")
+        headers = {name.strip().lower(): value.strip() for name, value in
+                   (line.split(":", 1) for line in header_lines if ":" in line)}
+        status = status_line.split()
+        if len(status) < 2 or status[1] != "101" \
+                or headers.get("sec-websocket-accept") != websocket_accept_key(key):
+            raise WebSocketError(f"Websocket handshake with {self.url.geturl()} failed: {status_line}")
+
+    def receive(self) -> Tuple[int, memoryview]:
+        '''Receive the next text or binary message, answering pings on the way.'''
+        message_opcode = None
+        length = 0
+        while True:
+            first, second = self._receive_exactly(2)
+            final = first & 0x80
+            opcode = first & 0x0F
+            payload_length = second & 0x7F
+            if payload_length == 126:
+                payload_length, = struct.unpack("!H", self._receive_exactly(2))
+            elif payload_length == 127:
+                payload_length, = struct.unpack("!Q", self._receive_exactly(8))
+            masking_key = self._receive_exactly(4) if second & 0x80 else None
+            if opcode >= OPCODE_CLOSE:
+                payload = self._receive_exactly(payload_length)
+                if masking_key is not None:
+                    payload = _apply_mask(payload, masking_key)
+                if opcode == OPCODE_CLOSE:
+                    raise WebSocketError("Websocket closed by the server")
+                if opcode == OPCODE_PING:
+                    self.send(payload, OPCODE_PONG)
+                continue
+            if opcode != OPCODE_CONTINUATION:
+                message_opcode = opcode
+            if len(self._buffer) < length + payload_length:
+                # the previous message may still be viewed, so the buffer is replaced instead of resized
+                buffer = bytearray(2 * (length + payload_length))
+                buffer[:length] = self._buffer[:length]
+                self._buffer = buffer
+            view = memoryview(self._buffer)[length:length + payload_length]
+            self._receive_into(view)
+            if masking_key is not None:
+                view[:] = _apply_mask(view, masking_key)
+            length += payload_length
+            if final:
+                return message_opcode, memoryview(self._buffer)[:length]
+
+    def send(self, payload: bytes, opcode: int = OPCODE_BINARY):
+        with self._send_lock:
+            self._socket.sendall(encode_websocket_frame(bytes(payload), opcode, mask=True))
+
+    def close(self):
+        '''Close the connection, a receive() that is blocked in another thread raises WebSocketError.'''
+        if self._socket is None or self._closed:
+            return
+        self._closed = True
+        try:
+            self.send(b"", OPCODE_CLOSE)
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+    def _receive_exactly(self, n: int) -> bytes:
+        data = bytearray(n)
+        self._receive_into(memoryview(data))
+        return bytes(data)
+
+    def _receive_into(self, view: memoryview):
+        # frames that arrived together with the handshake response
+        received = min(len(self._pending), len(view))
+        view[:received] = self._pending[:received]
+        self._pending = self._pending[received:]
+        while received < len(view):
+            n = self._socket.recv_into(view[received:])
+            if n == 0:
+                raise WebSocketError("Websocket connection closed")
+            received += n
+
+
+class PreviewFrame:
+    '''Header of a preview frame and a view of its pixels.'''
+
+    def __init__(self, camera: str, sequence: int, pixels: np.ndarray):
+        self.camera = camera
+        self.sequence = sequence
+        self.pixels = pixels
+
+
+def encode_preview_frame(camera: str, sequence: int, image: np.ndarray) -> bytes:
+    header = json.dumps({"camera": camera, "sequence": sequence, "shape": list(image.shape),
+                         "dtype": image.dtype.str}).encode()
+    return struct.pack("<I", len(header)) + header + np.ascontiguousarray(image).tobytes()
+
+
+def decode_preview_frame(payload: memoryview) -> PreviewFrame:
+    '''Decode a preview message without copying the pixels.'''
+    header_length, = struct.unpack_from("<I", payload)
+    header = json.loads(bytes(payload[4:4 + header_length]))
+    pixels = np.frombuffer(payload[4 + header_length:], dtype=np.dtype(header['dtype'])).reshape(header['shape'])
+    return PreviewFrame(header['camera'], header['sequence'], pixels)
+
+
+class LivePreview:
+    '''Latest frames of the live stream of the instrument.
+
+    The frames are received in a background thread and copied into one buffer per camera that is reused
+    as long as the frame shape does not change.
+
+    methods:
+        start()
+        stop()
+        wait_for_frame(camera, timeout_s, newer_than) -> numpy.ndarray
+        get_latest_frame(camera) -> (sequence, receive time, numpy.ndarray) or None
+
+    Args:
+        url: websocket url of the live stream, e.g. "ws://192.168.0.10:8080/live"
+        decoder: callable(memoryview) -> PreviewFrame, see decode_preview_frame
+        reconnect_interval_s: time between attempts to reconnect after the connection was lost
+    '''
+
+    def __init__(self, url: str, decoder: Callable[[memoryview], PreviewFrame] = decode_preview_frame,
+                 reconnect_interval_s: float = 0.5):
+        self.url = url
+        self.decoder = decoder
+        self.reconnect_interval_s = reconnect_interval_s
+        self.frames_received = 0
+        self._buffers: Dict[str, np.ndarray] = {}
+        self._frame_info: Dict[str, Tuple[int, float]] = {}
+        self._condition = threading.Condition()
+        self._connection: Optional[WebSocketConnection] = None
+        self._thread: Optional[threading.Thread] = None
+        self._running = threading.Event()
+
+    @property
+    def is_running(self) -> bool:
+        return self._running.is_set()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._receive_frames, name="LuxendoLivePreview", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        connection = self._connection
+        if connection is not None:
+            connection.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get_latest_frame(self, camera: str) -> Optional[Tuple[int, float, np.ndarray]]:
+        with self._condition:
+            if camera not in self._frame_info:
+                return None
+            sequence, receive_time = self._frame_info[camera]
+            return sequence, receive_time, self._buffers[camera].copy()
+
+    def wait_for_frame(self, camera: str, timeout_s: float = 1.0, newer_than: float = None) -> np.ndarray:
+        '''Return a copy of the first frame of the camera that was received after newer_than.
+
+        Args:
+            camera: camera name
+            timeout_s: maximum time to wait
+            newer_than: time.monotonic() timestamp, default: now, i.e. wait for the next frame
+        '''
+        newer_than = time.monotonic() if newer_than is None else newer_than
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frame_info.get(camera, (0, -1.0))[1] > newer_than,
+                                            timeout_s):
+                raise TimeoutError(f"Timeout ({timeout_s} s) while waiting for a live frame of {camera}")
+            return self._buffers[camera].copy()
+
+    def _receive_frames(self):
+        while self.is_running:
+            try:
+                self._connection = WebSocketConnection(self.url)
+                self._connection.connect()
+                while self.is_running:
+                    opcode, payload = self._connection.receive()
+                    if opcode == OPCODE_BINARY:
+                        self._store_frame(self.decoder(payload))
+            except (OSError, ValueError, KeyError):
+                if self.is_running:
+                    time.sleep(self.reconnect_interval_s)
+            finally:
+                if self._connection is not None:
+                    self._connection.close()
+
+    def _store_frame(self, frame: PreviewFrame):
+        with self._condition:
+            buffer = self._buffers.get(frame.camera)
+            if buffer is None or buffer.shape != frame.pixels.shape or buffer.dtype != frame.pixels.dtype:
+                buffer = self._buffers[frame.camera] = np.empty_like(frame.pixels)
+            np.copyto(buffer, frame.pixels)
+            self._frame_info[frame.camera] = (frame.sequence, time.monotonic())
+            self.frames_received += 1
+            self._condition.notify_all()
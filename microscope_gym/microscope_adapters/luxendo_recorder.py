@@ -0,0 +1,212 @@
+'''Record the MQTT messages of a Luxendo session in the LuxendoLog format and summarize command latencies.
+
+A LuxendoLog file is a JSON list of {topic, time, message} entries, e.g.
+docs/data/LuxendoLog_2023-04-25T07_00_42.529Z.json. MessageRecorder writes the messages that a
+LuxendoAPIHandler publishes and receives in the same format, with an additional "timestamp" (seconds
+since the epoch, microsecond resolution) because the "time" of the format only has millisecond
+resolution. Recordings can be loaded by the TruLive3DEmulator and replayed like the original logs.
+
+The latency summary pairs every command that was published on <serial>/gui* with the next received
+message of the same device and reports percentiles of the round-trip times per device and command:
+
+    python -m microscope_gym.microscope_adapters.luxendo_recorder recording.json
+'''
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+
+def load_luxendo_log(path) -> List[dict]:
+    '''Load a LuxendoLog recording and return its {topic, time, message} entries in chronological order.
+
+    A recording that was not closed properly (i.e. misses the closing bracket) is loaded as well.'''
+    with open(path, 'r') as log_file:
+        text = log_file.read()
+    try:
+        entries = json.loads(text)
+    except json.JSONDecodeError:
+        entries = json.loads(text.rstrip().rstrip(',') + "]")
+    return sorted(entries, key=get_entry_time)
+
+
+def parse_log_time(time_string: str) -> float:
+    '''Convert a LuxendoLog time stamp, e.g. '25/04/2023, 08:57:10.14' to seconds since the epoch.
+
+    The milliseconds in LuxendoLog time stamps are not zero-padded ('.14' means 14 ms).'''
+    date_and_time, milliseconds = time_string.rsplit('.', 1)
+    timestamp = datetime.strptime(date_and_time, "%d/%m/%Y, %H:%M:%S").timestamp()
+    return timestamp + int(milliseconds) / 1000.0
+
+
+def format_log_time(timestamp: float) -> str:
+    '''Convert seconds since the epoch to a LuxendoLog time stamp (see parse_log_time).'''
+    seconds = int(timestamp)
+    milliseconds = int(round((timestamp - seconds) * 1000))
+    if milliseconds == 1000:
+        seconds, milliseconds = seconds + 1, 0
+    return datetime.fromtimestamp(seconds).strftime("%d/%m/%Y, %H:%M:%S") + f".{milliseconds}"
+
+
+def get_entry_time(entry: dict) -> float:
+    '''Return the time of a log entry in seconds since the epoch, with the best available resolution.'''
+    if 'timestamp' in entry:
+        return entry['timestamp']
+    return parse_log_time(entry['time'])
+
+
+class MessageRecorder:
+    '''Write MQTT messages to a LuxendoLog file in a background thread.
+
+    record() only takes a time stamp and queues the message, so that it can be called from the MQTT
+    network thread without delaying the message handling. Payloads are parsed and written by the writer
+    thread.
+
+    example:
+        with MessageRecorder("recording.json") as recorder:
+            api_handler = LuxendoAPIHandler(serial_number="0200C125", recorder=recorder)
+            ...
+
+    methods:
+        record(topic, payload)
+        close()
+
+    Args:
+        path: file to write
+        flush_interval_s: maximum time until recorded messages are written to the file
+    '''
+
+    def __init__(self, path: Union[str, Path], flush_interval_s: float = 1.0):
+        self.path = Path(path)
+        self.flush_interval_s = flush_interval_s
+        self.n_recorded = 0
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._file = open(self.path, 'w')
+        self._file.write("[\n")
+        self._thread = threading.Thread(target=self._write_messages, name="LuxendoMessageRecorder", daemon=True)
+        self._thread.start()
+
+    def record(self, topic: str, payload: Union[str, bytes]):
+        if not self._closed:
+            self._queue.put((time.time(), topic, payload))
+
+    def close(self):
+        '''Write the remaining messages and close the file.'''
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self) -> 'MessageRecorder':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write_messages(self):
+        separator = ""
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval_s)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                timestamp, topic, payload = item
+                entry = {"topic": topic, "time": format_log_time(timestamp), "timestamp": timestamp,
+                         "message": self._parse_payload(payload)}
+                self._file.write(separator + json.dumps(entry))
+                separator = ",\n"
+                self.n_recorded += 1
+            if time.monotonic() - last_flush > self.flush_interval_s:
+                self._file.flush()
+                last_flush = time.monotonic()
+        self._file.write("\n]\n")
+        self._file.close()
+
+    @staticmethod
+    def _parse_payload(payload: Union[str, bytes]) -> dict:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            message = None
+        if isinstance(message, dict):
+            return message
+        if isinstance(payload, bytes):
+            payload = payload.decode(errors='replace')
+        return {"payload": payload}
+
+
+def command_latencies(entries: List[dict]) -> Dict[Tuple[str, str], List[float]]:
+    '''Return {(device, command): [command to reply latency in s]} of a recording.
+
+    Commands are the messages on <serial>/gui topics, the reply of a command is the next message on any other
+    topic that the API handler takes for its reply (see luxendo_trulive3d.is_reply), broadcasts of the device
+    are skipped. Commands of the same device are answered in the order they were sent.'''
+    # luxendo_trulive3d imports this module
+    from microscope_gym.microscope_adapters.luxendo_trulive3d import is_reply
+
+    pending: Dict[str, deque] = {}
+    latencies: Dict[Tuple[str, str], List[float]] = {}
+    for entry in sorted(entries, key=get_entry_time):
+        message = entry['message']
+        data = message.get('data')
+        if not isinstance(data, dict) or 'device' not in data:
+            continue
+        device = data['device']
+        subtopic = entry['topic'].split('/', 1)[-1]
+        if subtopic == 'gui' or subtopic.startswith('gui/'):
+            command = (data.get('command'), message.get('type'), get_entry_time(entry))
+            pending.setdefault(device, deque()).append(command)
+        elif pending.get(device) and is_reply(message, device, pending[device][0][1]):
+            command, _, sent = pending[device].popleft()
+            latencies.setdefault((device, command), []).append(get_entry_time(entry) - sent)
+    return latencies
+
+
+def summarize_latencies(entries: List[dict], percentiles=(50, 90, 99)) -> List[dict]:
+    '''Return one row per device and command with the count and the latency percentiles in ms.'''
+    rows = []
+    for (device, command), latencies in sorted(command_latencies(entries).items(), key=str):
+        latencies_ms = np.asarray(latencies) * 1000.0
+        row = {"device": device, "command": command, "n": len(latencies_ms)}
+        for percentile, value in zip(percentiles, np.percentile(latencies_ms, percentiles)):
+            row[f"p{percentile}_ms"] = float(value)
+        row["max_ms"] = float(latencies_ms.max())
+        rows.append(row)
+    return rows
+
+
+def format_summary(rows: List[dict]) -> str:
+    if not rows:
+        return "no commands with replies"
+    columns = list(rows[0])
+    cells = [[f"{row[column]:.1f}" if isinstance(row[column], float) else str(row[column]) for column in columns]
+             for row in rows]
+    widths = [max(len(column), *(len(row[index]) for row in cells)) for index, column in enumerate(columns)]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines += ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in cells]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Command to reply latencies of LuxendoLog recordings")
+    parser.add_argument("recordings", nargs="+", type=Path)
+    args = parser.parse_args(argv)
+    entries = [entry for path in args.recordings for entry in load_luxendo_log(path)]
+    print(format_summary(summarize_latencies(entries)))
+
+
+if __name__ == "__main__":
+    main()
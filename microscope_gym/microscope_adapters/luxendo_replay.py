@@ -0,0 +1,210 @@
+'''Replay LuxendoLog recordings through the luxendo_trulive3d adapter classes.
+
+SessionReplayer starts a TruLive3DEmulator in the state of a recording (see luxendo_recorder) and sends the
+commands of the recording in their original order through Stage, StackConfig, EventConfig, DiskConfig
+and Camera over a LocalBroker. The time between the commands is kept (time_scale=1), scaled, or left out
+(time_scale=0). Every command is timed by phase, e.g. 'stages' or 'stacks', and every run is split into
+'run' (until the instrument reported all files) and 'loading' (reading all files), so that regressions
+in the MQTT handling or in HDF5 loading show up without hardware.
+
+example:
+    report = SessionReplayer("LuxendoLog.json", time_scale=0).run()
+    print(report.format())
+'''
+import json
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from microscope_gym.microscope_adapters.luxendo_emulator import LocalBroker, TruLive3DEmulator
+from microscope_gym.microscope_adapters.luxendo_recorder import get_entry_time, load_luxendo_log
+from microscope_gym.microscope_adapters.luxendo_trulive3d import (
+    Camera, DiskConfig, EventConfig, LuxendoAPIHandler, Stack, StackConfig, Stage, Task)
+
+
+class ReplayReport:
+    '''Durations of the phases of a replayed session and its end-to-end throughput.
+
+    properties:
+        phases: {phase name: [duration in s of each command]}
+        wall_time_s: duration of the whole replay, including the connection
+        n_commands: number of replayed commands
+        n_frames, n_bytes: planes and bytes read from the files of all runs
+    '''
+
+    def __init__(self):
+        self.phases: Dict[str, List[float]] = {}
+        self.wall_time_s = 0.0
+        self.n_commands = 0
+        self.n_frames = 0
+        self.n_bytes = 0
+
+    def add(self, phase: str, duration_s: float):
+        self.phases.setdefault(phase, []).append(duration_s)
+
+    def summary(self) -> List[dict]:
+        '''Return one row per phase with the number of commands and the total, mean and p90 duration.'''
+        rows = []
+        for phase, durations in self.phases.items():
+            durations_ms = np.asarray(durations) * 1000.0
+            rows.append({"phase": phase, "n": len(durations_ms), "total_s": float(durations_ms.sum() / 1000.0),
+                         "mean_ms": float(durations_ms.mean()), "p90_ms": float(np.percentile(durations_ms, 90))})
+        return rows
+
+    def throughput(self) -> dict:
+        wall_time_s = max(self.wall_time_s, 1e-9)
+        return {"commands_per_s": self.n_commands / wall_time_s, "frames_per_s": self.n_frames / wall_time_s,
+                "MB_per_s": self.n_bytes / 1e6 / wall_time_s}
+
+    def format(self) -> str:
+        lines = [f"{'phase':<16}{'n':>6}{'total [s]':>12}{'mean [ms]':>12}{'p90 [ms]':>12}"]
+        for row in self.summary():
+            lines.append(f"{row['phase']:<16}{row['n']:>6}{row['total_s']:>12.3f}{row['mean_ms']:>12.2f}"
+                         f"{row['p90_ms']:>12.2f}")
+        throughput = self.throughput()
+        lines.append(f"{self.n_commands} commands, {self.n_frames} frames in {self.wall_time_s:.3f} s: "
+                     f"{throughput['commands_per_s']:.1f} commands/s, {throughput['frames_per_s']:.1f} frames/s, "
+                     f"{throughput['MB_per_s']:.1f} MB/s")
+        return "\n".join(lines)
+
+
+class SessionReplayer:
+    '''Replay the commands of a LuxendoLog recording through the adapter classes against the emulator.
+
+    Args:
+        log_path: LuxendoLog recording, it defines the initial state of the emulator and the commands
+        time_scale: scales the recorded time between commands, 1 replays in real time, 0 as fast as possible
+        latency_ms, jitter_ms: latency of the local broker
+        emulator_time_scale: scales the emulated stage moves and exposures, see TruLive3DEmulator
+        data_directory: directory for the files of the emulator (default: temporary directory)
+        roi_size: if given, the camera regions of interest are reduced to roi_size x roi_size pixels
+        timeout_ms: time to wait for replies and images
+    '''
+
+    def __init__(self, log_path, time_scale: float = 0.0, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 emulator_time_scale: float = 0.0, data_directory=None, roi_size: Optional[int] = None,
+                 timeout_ms: float = 60000):
+        self.log_path = log_path
+        self.time_scale = time_scale
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.emulator_time_scale = emulator_time_scale
+        self.data_directory = data_directory
+        self.roi_size = roi_size
+        self.timeout_ms = timeout_ms
+        # adapter objects of the running replay
+        self.stage: Optional[Stage] = None
+        self.stacks: Optional[StackConfig] = None
+        self.events: Optional[EventConfig] = None
+        self.disk: Optional[DiskConfig] = None
+        self.camera: Optional[Camera] = None
+        self.tasks: List[Task] = []
+
+    def get_commands(self) -> List[dict]:
+        '''Return the entries of the recording that the client published, in chronological order.'''
+        return [entry for entry in load_luxendo_log(self.log_path)
+                if entry['topic'].split('/', 1)[-1].split('/')[0] == 'gui'
+                and isinstance(entry['message'].get('data'), dict)]
+
+    def run(self) -> ReplayReport:
+        report = ReplayReport()
+        commands = self.get_commands()
+        broker = LocalBroker(latency_ms=self.latency_ms, jitter_ms=self.jitter_ms, seed=0)
+        emulator = TruLive3DEmulator(broker.client(), log_path=self.log_path, data_directory=self.data_directory,
+                                     time_scale=self.emulator_time_scale)
+        emulator.start()
+        started = time.perf_counter()
+        phase_started = started
+        api_handler = LuxendoAPIHandler(serial_number=emulator.serial_number, mqtt_client=broker.client(),
+                                        reply_timeout_ms=self.timeout_ms)
+        try:
+            self.stage = Stage(api_handler)
+            self.stacks = StackConfig(api_handler)
+            self.events = EventConfig(api_handler)
+            self.disk = DiskConfig(api_handler)
+            self.camera = Camera(api_handler, self.stage, self.disk, new_image_timeout_ms=self.timeout_ms,
+                                 storage_policy=None)
+            self.tasks = []
+            self._reduce_roi()
+            report.add("connect", time.perf_counter() - phase_started)
+            replay_started = time.perf_counter()
+            first_command_time = get_entry_time(commands[0]) if commands else 0.0
+            for entry in commands:
+                delay_s = (get_entry_time(entry) - first_command_time) * self.time_scale \
+                    - (time.perf_counter() - replay_started)
+                if delay_s > 0:
+                    time.sleep(delay_s)
+                self._replay(entry, report)
+                report.n_commands += 1
+            emulator.wait_until_idle()
+        finally:
+            report.wall_time_s = time.perf_counter() - started
+            if self.camera is not None:
+                self.camera.close()
+            api_handler.close()
+            emulator.stop()
+        return report
+
+    def _reduce_roi(self):
+        if self.roi_size is None:
+            return
+        for settings in list(self.camera.cameras.values()):
+            settings = settings.copy()
+            settings.width_pixels = settings.height_pixels = self.roi_size
+            self.camera.configure_camera(settings)
+        deadline = time.monotonic() + self.timeout_ms / 1000.0
+        while any(settings.width_pixels != self.roi_size for settings in self.camera.cameras.values()):
+            if time.monotonic() > deadline:
+                raise TimeoutError("The camera region of interest was not updated")
+            time.sleep(0.001)
+
+    def _replay(self, entry: dict, report: ReplayReport):
+        data = entry['message']['data']
+        device, command = data.get('device'), data.get('command')
+        phase = "run" if (device, command) == ("execution", "run") else device
+        started = time.perf_counter()
+        if (device, command) == ("execution", "run"):
+            result = self.camera.capture_views(self._get_run_stacks())
+            report.add("run", time.perf_counter() - started)
+            started = time.perf_counter()
+            for images in result.wait(self.timeout_ms / 1000.0).values():
+                for image in images:
+                    pixels = np.asarray(image)
+                    report.n_frames += pixels.shape[0]
+                    report.n_bytes += pixels.nbytes
+            phase = "loading"
+        elif (device, command) == ("stages", "set"):
+            positions_um = {axis['name']: axis.get('value', axis.get('target')) for axis in data['axes']
+                            if axis.get('value', axis.get('target')) is not None}
+            self.stage.move_axes(**positions_um)
+            self.stage.wait_until_stopped(self.timeout_ms)
+        elif (device, command) == ("stacks", "replaceall"):
+            self.stacks.replace_all([Stack(**stack) for stack in data['stacks']])
+        elif (device, command) == ("stacks", "add"):
+            self.stacks.add_element(Stack(**data))
+        elif (device, command) == ("events", "replacetasks"):
+            self.tasks = [Task(**task) for task in data['tasks']]
+            self.events.replace_tasks(data['event'], self.tasks)
+        elif (device, command) == ("timings", "set"):
+            timings = data.get('timings', data)
+            settings = self.camera.settings.copy()
+            settings.exposure_time_ms = timings.get('exposure', settings.exposure_time_ms)
+            settings.delay = timings.get('delayafter', timings.get('delay', settings.delay))
+            self.camera.configure_camera(settings)
+        elif (device, command) == ("disk", "getconfig"):
+            self.disk.request_configuration()
+        elif command == "get" and device in ("stages", "stacks", "events"):
+            {"stages": self.stage, "stacks": self.stacks, "events": self.events}[device].request_configuration()
+        else:
+            # commands without an adapter class are sent as recorded
+            phase = "other"
+            self.camera.api_handler.publish(entry['topic'], json.dumps(entry['message']))
+        report.add(phase, time.perf_counter() - started)
+
+    def _get_run_stacks(self) -> List[Stack]:
+        '''Return the stacks of the tasks that were configured last, or all stacks.'''
+        stacks = {stack.name: stack for stack in self.stacks.data}
+        run_stacks = [stacks[task.stack] for task in sorted(self.tasks, key=lambda task: task.order)
+                      if task.stack in stacks]
+        return run_stacks or list(stacks.values())
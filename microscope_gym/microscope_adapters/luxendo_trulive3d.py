@@ -1,44 +1,253 @@
-from collections import OrderedDict
-from typing import Optional, List, Tuple, Any
+from collections import OrderedDict, deque
+from typing import Optional, List, Tuple, Any, Callable, Deque, Dict, Iterable
 import warnings
 from pydantic import Field, validator, BaseModel
 from copy import deepcopy
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+import threading
+import math
 import time
 import re
 from abc import ABC, abstractmethod
 from warnings import warn
 import json
 import numpy as np
-import h5py
 from pathlib import Path
 from microscope_gym import interface
-from microscope_gym.interface import Objective, Microscope
+from microscope_gym.interface import Objective, MicroscopeCapabilities, SparseTileStore
+from microscope_gym.microscope_adapters.luxendo_live_preview import LivePreview
+from microscope_gym.microscope_adapters.luxendo_recorder import MessageRecorder
 
 
-import paho.mqtt.client as mqtt
+class LuxendoAPIException(Exception):
+    pass
 
 
-class LuxendoAPIException(Exception):
+class LuxendoTimeoutError(LuxendoAPIException, TimeoutError):
+    pass
+
+
+class LuxendoStorageError(LuxendoAPIException):
     pass
 
 
+def compile_topic_filter(topic_filter: str) -> "re.Pattern":
+    '''Compile an MQTT topic filter with '+' and '#' wildcards into a regular expression.'''
+    levels = topic_filter.split('/')
+    multi_level = levels[-1] == '#'
+    if multi_level:
+        levels = levels[:-1]
+    pattern = '/'.join('[^/]*' if level == '+' else re.escape(level) for level in levels)
+    if multi_level:
+        # 'a/#' also matches the parent topic 'a'
+        pattern = pattern + '(/.*)?' if levels else '.*'
+    return re.compile(pattern + '$')
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    return compile_topic_filter(topic_filter).match(topic) is not None
+
+
+def is_reply(payload_dict: dict, device: str, message_type: str, reply_command: str = "set") -> bool:
+    '''Return True if a message is the reply to a command of message_type to device.
+
+    The instrument replies with the full configuration of the device (command 'set'), the other messages of
+    a device, e.g. progress or stage position broadcasts, are not replies.'''
+    data = payload_dict.get('data')
+    return isinstance(data, dict) and data.get('device') == device and data.get('command') == reply_command \
+        and payload_dict.get('type', message_type) == message_type
+
+
+def get_json_loads() -> Callable:
+    '''Return orjson.loads if orjson is installed, json.loads otherwise.'''
+    try:
+        import orjson
+    except ImportError:
+        return json.loads
+    return orjson.loads
+
+
+class TopicRouter:
+    '''Dispatches MQTT messages to the handlers of matching topic filters.
+
+    Topic filters without wildcards are looked up directly, filters with wildcards are compiled once.
+    The handlers that match a topic are cached, so routing a message of a high-rate topic (e.g. stages
+    or cameras) costs a dictionary lookup. The payload is parsed once, no matter how many handlers match.
+
+    methods:
+        add(topic_filter, handler)
+        remove(topic_filter, handler=None)
+        match(topic) -> tuple of handlers
+        parse(payload) -> parsed payload
+        dispatch(topic, payload) -> parsed payload
+
+    Args:
+        loads: JSON decoder, defaults to orjson.loads if orjson is installed
+    '''
+
+    def __init__(self, loads: Callable = None):
+        self.loads = loads or get_json_loads()
+        self._exact_handlers: Dict[str, List[Callable]] = {}
+        self._wildcard_handlers: Dict[str, Tuple["re.Pattern", List[Callable]]] = {}
+        self._matches: Dict[str, Tuple[Callable, ...]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def topic_filters(self) -> List[str]:
+        return list(self._exact_handlers) + list(self._wildcard_handlers)
+
+    def add(self, topic_filter: str, handler: Callable[[str, dict], None]):
+        '''Call handler(topic, payload_dict) for every message whose topic matches the filter.'''
+        with self._lock:
+            if '+' in topic_filter or '#' in topic_filter:
+                pattern, handlers = self._wildcard_handlers.setdefault(
+                    topic_filter, (compile_topic_filter(topic_filter), []))
+            else:
+                handlers = self._exact_handlers.setdefault(topic_filter, [])
+            handlers.append(handler)
+            self._matches = {}
+
+    def remove(self, topic_filter: str, handler: Callable = None):
+        '''Remove a handler, or all handlers of the topic filter if handler is None.'''
+        with self._lock:
+            if topic_filter in self._exact_handlers:
+                handlers = self._exact_handlers[topic_filter]
+            elif topic_filter in self._wildcard_handlers:
+                handlers = self._wildcard_handlers[topic_filter][1]
+            else:
+                return
+            handlers[:] = [] if handler is None else [h for h in handlers if h != handler]
+            if not handlers:
+                self._exact_handlers.pop(topic_filter, None)
+                self._wildcard_handlers.pop(topic_filter, None)
+            self._matches = {}
+
+    def match(self, topic: str) -> Tuple[Callable, ...]:
+        handlers = self._matches.get(topic)
+        if handlers is None:
+            with self._lock:
+                handlers = list(self._exact_handlers.get(topic, []))
+                for pattern, wildcard_handlers in self._wildcard_handlers.values():
+                    if pattern.match(topic):
+                        handlers.extend(wildcard_handlers)
+                handlers = tuple(handlers)
+                self._matches[topic] = handlers
+        return handlers
+
+    def parse(self, payload) -> Any:
+        '''Parse a JSON payload, payloads that are already parsed are returned as they are.'''
+        return self.loads(payload) if isinstance(payload, (str, bytes, bytearray)) else payload
+
+    def dispatch(self, topic: str, payload) -> Any:
+        '''Parse the payload and pass it to the matching handlers. Returns the parsed payload.'''
+        payload_dict = self.parse(payload)
+        for handler in self.match(topic):
+            handler(topic, payload_dict)
+        return payload_dict
+
+
+_json_encode = json.JSONEncoder().encode
+
+
+def _encode_json_value(value) -> str:
+    # numbers are by far the most common field values, they are encoded without the JSON encoder
+    value_type = type(value)
+    if value_type is int:
+        return int.__repr__(value)
+    if value_type is float and math.isfinite(value):
+        return float.__repr__(value)
+    return _json_encode(value)
+
+
+class CommandTemplate:
+    '''JSON command whose constant parts are serialised once.
+
+    Values that change between commands are marked with CommandTemplate.field(name). Rendering the
+    command only encodes these values and joins them with the pre-serialised parts, which is much
+    cheaper than building and serialising pydantic models or dictionaries for every command.
+
+    example:
+        template = CommandTemplate({"type": "device", "data": {
+            "device": "timings", "command": "set", "timings": {"exposure": CommandTemplate.field("exposure")}}})
+        template.render(exposure=20.0)
+    '''
+    _field_pattern = re.compile(r'"\\u0000(\w+)\\u0000"')
+
+    def __init__(self, command: dict):
+        # json.dumps escapes the field markers as "\u0000name\u0000"
+        parts = self._field_pattern.split(json.dumps(command))
+        self.segments: List[str] = parts[0::2]
+        self.fields: List[str] = parts[1::2]
+
+    @staticmethod
+    def field(name: str) -> str:
+        return f"\x00{name}\x00"
+
+    def render(self, *values, **named_values) -> str:
+        '''Return the command with the given field values, either by name or all of them in field order.'''
+        if not values:
+            values = [named_values[name] for name in self.fields]
+        parts = [self.segments[0]]
+        for value, segment in zip(values, self.segments[1:]):
+            parts.append(_encode_json_value(value))
+            parts.append(segment)
+        return "".join(parts)
+
+
+TIMINGS_COMMAND = CommandTemplate({"type": "device", "data": {
+    "device": "timings", "command": "set", "timings": {
+        "exposure": CommandTemplate.field("exposure"),
+        "delaybefore": 0,
+        "delayafter": CommandTemplate.field("delayafter")}}})
+SETROI_COMMAND = CommandTemplate({"type": "device", "data": {
+    "device": "cameras", "command": "setroi", "name": CommandTemplate.field("name"), "roi": {
+        "top": CommandTemplate.field("top"),
+        "left": CommandTemplate.field("left"),
+        "width": CommandTemplate.field("width"),
+        "height": CommandTemplate.field("height")}}})
+TIMINGS_REQUEST = json.dumps({"type": "device", "data": {"device": "timings", "command": "get"}})
+RUN_COMMAND = json.dumps({"type": "operation", "data": {"device": "execution", "command": "run", "state": True}})
+
+
 class LuxendoAPIHandler:
+    '''Sends commands to and receives messages from the Luxendo MQTT API.
+
+    Args:
+        broker_address: address of the MQTT broker
+        broker_port: port of the MQTT broker
+        serial_number: serial number of the microscope (main topic of all messages)
+        reply_timeout_ms: time to wait for replies
+        mqtt_client: paho-mqtt compatible client to use instead of a new paho.mqtt.client.Client,
+            e.g. luxendo_emulator.LocalBroker.client() to run without the instrument
+        json_loads: JSON decoder for payloads, defaults to orjson.loads if orjson is installed
+        recorder: MessageRecorder that records all published and received messages, e.g. to measure latencies
+    '''
+
     def __init__(self, broker_address: str = "localhost", broker_port: int = 1883,
-                 serial_number: str = "", reply_timeout_ms=10000):
+                 serial_number: str = "", reply_timeout_ms=10000, mqtt_client=None, json_loads: Callable = None,
+                 recorder: MessageRecorder = None):
         self.broker_address = broker_address
+        self.recorder = recorder
         self.broker_port = broker_port
         self.main_topic = serial_number
         self.reply_timeout_ms = reply_timeout_ms
 
         self.connected = False
-        self.waiting_for_reply = False
-        self.last_published: str
-        self.latest_message: bool
-        self.reply_json: dict
-        self._publish_time: float
+        self.last_published: str = ""
+        self.latest_message = None
+        self.reply_json: dict = None
         self.message_callbacks = []
-
-        self.mqtt = mqtt.Client()
+        self.router = TopicRouter(json_loads)
+        self._connected_event = threading.Event()
+        # replies that commands in flight wait for, in the order the commands were sent, by reply topic
+        self._pending_replies: Dict[Optional[str], Deque[PendingReply]] = {}
+        self._pending_replies_lock = threading.Lock()
+
+        if mqtt_client is None:
+            # imported here, so that importing the adapter does not load the MQTT client library
+            import paho.mqtt.client as mqtt
+            mqtt_client = mqtt.Client()
+        self.mqtt = mqtt_client
         self.subscribed_topics = []
 
         self.mqtt.on_connect = self.on_connect
@@ -46,29 +255,41 @@ class LuxendoAPIHandler:
         self.mqtt.on_message = self.on_message
 
     def on_message(self, client, userdata, message):
-        # print("Received message: " + message.topic + " " + str(message.payload))
-        self.latest_message = message
-        self.reply_json = json.loads(message.payload)
-        self.waiting_for_reply = False
-        for callback in self.message_callbacks:
-            callback(self.reply_json)
+        '''Parse the payload once and pass it to the callbacks of matching subscriptions, then resolve replies.
 
-    # TODO: add callback for individual subscribed topics
-    # def topic_callback(self, callback, client, userdata, flags):
+        If the payload is not JSON or a callback raises, the reply that the message matches fails with the
+        error, so that nobody waits for it until the timeout.
+        '''
+        if self.recorder is not None:
+            self.recorder.record(message.topic, message.payload)
+        self.latest_message = message
+        reply, error = None, None
+        try:
+            reply = self.reply_json = self.router.parse(message.payload)
+            self.router.dispatch(message.topic, reply)
+            for callback in self.message_callbacks:
+                callback(reply)
+        except Exception as exception:
+            error = exception
+        if not self._resolve_pending_replies(message.topic, reply, error) and error is not None:
+            warn(f"Handling the message on {message.topic} failed: {error!r}")
 
     def on_connect(self, client, userdata, flags, result_code):
         if result_code == 0:
             print("Connected")
+            # includes the subscriptions that were made before the connection existed
             for topic in self.subscribed_topics:
                 self.mqtt.subscribe(topic)
 
             self.connected = True
+            self._connected_event.set()
         else:
             self.connected = False
             self.close()
 
     def on_disconnect(self, client, userdata, result_code):
         self.connected = False
+        self._connected_event.clear()
         if result_code == 0:
             print("Disonnected")
         else:
@@ -79,11 +300,8 @@ class LuxendoAPIHandler:
         self.mqtt.loop_start()
 
     def wait_for_connection(self):
-        started = time.time()
-        while not self.connected and time.time() - started < self.reply_timeout_ms / 1000.0:
-            time.sleep(0.1)
-        if not self.connected:
-            raise LuxendoAPIException(f"Connection to MQTT broker timed out after {self.reply_timeout_ms / 1000.0} s")
+        if not self._connected_event.wait(self.reply_timeout_ms / 1000.0):
+            raise LuxendoTimeoutError(f"Connection to MQTT broker timed out after {self.reply_timeout_ms / 1000.0} s")
 
     def ensure_connection(self):
         if not self.connected:
@@ -94,46 +312,194 @@ class LuxendoAPIHandler:
         self.mqtt.loop_stop()
         self.mqtt.disconnect()
 
-    def subscribe(self, topic: str, callback=None):
+    def subscribe(self, topic: str, callback: Callable[[str, dict], None] = None):
+        '''Subscribe to a topic (relative to the main topic) and call callback(topic, payload_dict) for its messages.
+
+        Subscriptions made before the connection exists are sent to the broker on connect.'''
         topic = self.main_topic + '/' + topic
+        if callback is not None:
+            self.router.add(topic, callback)
+        if topic in self.subscribed_topics:
+            return
         self.subscribed_topics.append(topic)
         if self.connected:
             self.mqtt.subscribe(topic)
-            if callback is not None:
-                # TODO: convert callback to partial(self.topic_callback, callback)
-                self.mqtt.message_callback_add(topic, callback)
 
     def publish(self, topic: str, payload: str):
-        self._publish_time = time.time()
         self.last_published = f"topic: {topic}, payload: {payload}"
+        if self.recorder is not None:
+            self.recorder.record(topic, payload)
         self.mqtt.publish(topic, payload)
 
     def send_command(self, command, subtopic='/gui'):
         self.publish(self.main_topic + subtopic, command)
 
-    def send_command_and_wait_for_reply(self, command, poll_interval_ms=10):
-        self.send_command(command)
-        return self.wait_for_reply(poll_interval_ms)
-
-    def keep_waiting_for_replies(self, wait_timeout_ms=10000):
-        while time.time() - self._publish_time < wait_timeout_ms / 1000.0:
-            yield self.wait_for_reply(poll_interval_ms=0.1)
-
-    def wait_for_reply(self, poll_interval_ms=10):
-        self.waiting_for_reply = True
-        waited = 0
-        while self.waiting_for_reply and waited < self.reply_timeout_ms:
-            time.sleep(poll_interval_ms / 1000.0)
-            waited += poll_interval_ms
-            if not self.waiting_for_reply:
-                return self.reply_json
-        raise LuxendoAPIException(
-            f"Timeout ({self.reply_timeout_ms / 1000.0} s) while waiting for reply to command: {self.last_published}")
+    def expect_reply(self, reply_topic: str = None, predicate: Callable[[dict], bool] = None) -> Future:
+        '''Register a reply that is expected before the command is sent.
+
+        Args:
+            reply_topic: topic (relative to the main topic) the reply arrives on, None accepts any topic
+            predicate: function that gets the parsed reply and returns True if it is the expected reply
+
+        Returns:
+            Future that is resolved with the parsed reply by the MQTT network thread
+        '''
+        topic = None if reply_topic is None else self.main_topic + '/' + reply_topic
+        pending_reply = PendingReply(topic, predicate)
+        with self._pending_replies_lock:
+            self._pending_replies.setdefault(topic, deque()).append(pending_reply)
+        return pending_reply.future
+
+    def send_command_async(self, command, reply_topic: str = None,
+                           predicate: Callable[[dict], bool] = None, subtopic='/gui') -> Future:
+        '''Send a command without waiting for the reply.
+
+        Several commands can be in flight at the same time. Their replies are matched per reply topic
+        in the order in which the commands were sent.
+
+        Args:
+            command: JSON command string
+            reply_topic: topic (relative to the main topic) the reply arrives on, None accepts any topic
+            predicate: function that gets the parsed reply and returns True if it is the expected reply
+            subtopic: subtopic the command is sent to
+
+        Returns:
+            Future that is resolved with the parsed reply
+        '''
+        future = self.expect_reply(reply_topic, predicate)
+        self.send_command(command, subtopic)
+        future.description = self.last_published
+        return future
+
+    def send_command_and_wait_for_reply(self, command, reply_topic: str = None,
+                                        predicate: Callable[[dict], bool] = None, subtopic='/gui',
+                                        timeout_ms: float = None) -> dict:
+        '''Send a command and return the parsed reply.
+
+        Args:
+            command: JSON command string
+            reply_topic: topic (relative to the main topic) the reply arrives on, None accepts any topic
+            predicate: function that gets the parsed reply and returns True if it is the expected reply
+            subtopic: subtopic the command is sent to
+            timeout_ms: time to wait for the reply, defaults to reply_timeout_ms
+        '''
+        future = self.send_command_async(command, reply_topic, predicate, subtopic)
+        return self.wait_for_reply(future, timeout_ms)
+
+    def wait_for_reply(self, future: Future, timeout_ms: float = None) -> dict:
+        '''Wait until the expected reply arrived and return it.'''
+        return self.wait_for_replies([future], timeout_ms)[0]
+
+    def wait_for_replies(self, futures: Iterable[Future], timeout_ms: float = None) -> List[dict]:
+        '''Wait until all expected replies arrived and return them in the order of the futures.
+
+        The timeout applies to all replies together.'''
+        if timeout_ms is None:
+            timeout_ms = self.reply_timeout_ms
+        deadline = time.monotonic() + timeout_ms / 1000.0
+        replies = []
+        for future in futures:
+            try:
+                replies.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+            except FutureTimeoutError:
+                self._remove_pending_replies(futures)
+                raise LuxendoTimeoutError(
+                    f"Timeout ({timeout_ms / 1000.0} s) while waiting for reply to command: "
+                    f"{getattr(future, 'description', '')}") from None
+            except Exception:
+                # e.g. handling the reply failed, the other replies are not waited for anymore
+                self._remove_pending_replies(futures)
+                raise
+        return replies
+
+    def batch(self) -> 'CommandBatch':
+        '''Return a context manager that sends commands without waiting and waits for all replies on exit.'''
+        return CommandBatch(self)
+
+    def _resolve_pending_replies(self, topic: str, reply, error: Exception = None) -> bool:
+        '''Resolve the oldest pending reply that matches the message, with the error if handling it failed.
+
+        A message that could not be parsed (reply is None) only matches replies without a predicate.
+        Returns whether a pending reply matched.
+        '''
+        if not self._pending_replies:
+            return False
+        with self._pending_replies_lock:
+            for key in (topic, None):
+                pending_replies = self._pending_replies.get(key)
+                if not pending_replies:
+                    continue
+                for pending_reply in pending_replies:
+                    if pending_reply.predicate is None or (reply is not None and pending_reply.predicate(reply)):
+                        pending_replies.remove(pending_reply)
+                        if not pending_replies:
+                            del self._pending_replies[key]
+                        if error is None:
+                            pending_reply.future.set_result(reply)
+                        else:
+                            pending_reply.future.set_exception(error)
+                        return True
+        return False
+
+    def _remove_pending_replies(self, futures: Iterable[Future]):
+        futures = set(futures)
+        with self._pending_replies_lock:
+            for key in list(self._pending_replies):
+                remaining = deque(pending_reply for pending_reply in self._pending_replies[key]
+                                  if pending_reply.future not in futures)
+                if remaining:
+                    self._pending_replies[key] = remaining
+                else:
+                    del self._pending_replies[key]
 
     def __del__(self):
         self.close()
 
 
+class PendingReply:
+    '''Reply that a command waits for.'''
+
+    def __init__(self, topic: Optional[str], predicate: Optional[Callable[[dict], bool]]):
+        self.topic = topic
+        self.predicate = predicate
+        self.future = Future()
+
+
+class CommandBatch:
+    '''Commands that are in flight together.
+
+    example:
+        with api_handler.batch() as batch:
+            stacks.remove_element("stack_0", batch=batch)
+            events.remove_element("Event_0", batch=batch)
+        # all replies have arrived here
+    '''
+
+    def __init__(self, api_handler: LuxendoAPIHandler):
+        self.api_handler = api_handler
+        self.futures: List[Future] = []
+
+    def send(self, command, reply_topic: str = None, predicate: Callable[[dict], bool] = None,
+             subtopic='/gui') -> Future:
+        future = self.api_handler.send_command_async(command, reply_topic, predicate, subtopic)
+        self.futures.append(future)
+        return future
+
+    def wait(self, timeout_ms: float = None) -> List[dict]:
+        '''Wait for the replies to all commands sent so far and return them in the order the commands were sent.'''
+        futures, self.futures = self.futures, []
+        return self.api_handler.wait_for_replies(futures, timeout_ms)
+
+    def __enter__(self) -> 'CommandBatch':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.wait()
+        else:
+            self.api_handler._remove_pending_replies(self.futures)
+
+
 class APIData(BaseModel):
     device: str
     command: str = "get"
@@ -151,7 +517,14 @@ class DelCommand(APIData):
 
 
 class BaseConfig(ABC):
-    '''Base class that gets and sets API configuration data.'''
+    '''Base class that gets and sets API configuration data.
+
+    The instrument answers every command with the state of the device (data.command "set", see the
+    recorded LuxendoLog), the same message that it broadcasts when the state changes for other reasons.
+    Commands whose effect is visible in the state pass a reply_predicate to _send_command, so that a
+    broadcast of the previous state does not count as the reply.
+    '''
+    reply_command = "set"
 
     def __init__(self, api_handler: LuxendoAPIHandler, main_topic: str,
                  request_command: APICommand, subtopic='/gui') -> None:
@@ -163,21 +536,11 @@ class BaseConfig(ABC):
         self.api_handler.subscribe(self.main_topic, self._update)
         self.subtopic = subtopic
         self.request_command = request_command
-        self.waiting_for_data = False
         self.request_configuration()
 
     def request_configuration(self):
         self._send_command(self.request_command.data)
 
-    def wait_for_reply(self):
-        # TODO: move to LuxendoAPIHandler
-        timeout = self.timeout
-        while self.waiting_for_data and timeout > 0:
-            time.sleep(0.01)
-            timeout -= 0.01
-        if timeout <= 0:
-            raise TimeoutError(f"Timeout waiting for configuration data for {self.__class__.__name__}")
-
     def is_configured(self):
         return self.data is not None
 
@@ -185,18 +548,35 @@ class BaseConfig(ABC):
     def _parse_data(self, payload_dict: dict) -> Any:
         pass
 
-    def _update(self, client, userdata, msg):
-        # TODO: move to LuxendoAPIHandler
-        payload_dict = json.loads(msg.payload)
-        self.data = self._parse_data(payload_dict)
-        self.waiting_for_data = False
+    def _is_reply(self, payload_dict: dict) -> bool:
+        '''Return True if a message on the main topic is a reply of this device.'''
+        return is_reply(payload_dict, self.request_command.data.device, self.request_command.type, self.reply_command)
+
+    def _update(self, topic: str, payload_dict: dict):
+        if self._is_reply(payload_dict):
+            self.data = self._parse_data(payload_dict)
 
-    def _send_command(self, data: APIData, **kwargs):
+    def _send_command(self, data: APIData, batch: 'CommandBatch' = None,
+                      reply_predicate: Callable[[dict], bool] = None, **kwargs):
+        '''Send a command and wait for the reply, or add it to a batch of commands in flight.
+
+        Args:
+            reply_predicate: function that gets the data of a reply and returns True if it shows the effect
+                of the command
+        '''
         command = self.request_command.copy()
         command.data = data
-        self.waiting_for_data = True
-        self.api_handler.send_command(command.json(**kwargs), subtopic=self.subtopic)
-        self.wait_for_reply()
+        if reply_predicate is not None:
+            def predicate(payload_dict):
+                return self._is_reply(payload_dict) and reply_predicate(payload_dict['data'])
+        else:
+            predicate = self._is_reply
+        if batch is not None:
+            return batch.send(command.json(**kwargs), reply_topic=self.main_topic, predicate=predicate,
+                              subtopic=self.subtopic)
+        return self.api_handler.send_command_and_wait_for_reply(
+            command.json(**kwargs), reply_topic=self.main_topic, predicate=predicate,
+            subtopic=self.subtopic, timeout_ms=self.timeout * 1000)
 
 
 class ConfigList(BaseConfig):
@@ -208,26 +588,29 @@ class ConfigList(BaseConfig):
     def __init__(self, api_handler: LuxendoAPIHandler) -> None:
         super().__init__(api_handler, "embedded/" + self.device, APICommand(type="operation", data=APIData(device=self.device)))
 
-    def add_element(self):
+    def add_element(self, batch: 'CommandBatch' = None):
         data = self.request_command.data.copy()
         data.command = "add"
-        self._send_command(data)
+        self._send_command(data, batch=batch)
 
-    def remove_element(self, name: str):
+    def remove_element(self, name: str, batch: 'CommandBatch' = None):
         data = self.del_command_class(name=name, device=self.device)
-        self._send_command(data)
+        self._send_command(data, batch=batch, reply_predicate=lambda reply: name not in self._get_names(reply))
 
     def is_configured(self):
         return len(self.data) > 0
 
+    def _get_names(self, reply_data: dict) -> List[str]:
+        return [element.get('name') for element in reply_data.get(self.device, [])]
+
     def _parse_data(self, payload_dict: dict):
         return [self.data_class(**device_data) for device_data in payload_dict['data'][self.device]]
 
 
 class StackElement(BaseModel):
     name: str
-    start: int
-    end: int
+    start: float
+    end: float
     instack: Optional[bool]
     canTile: Optional[bool]
 
@@ -245,12 +628,35 @@ class NewStack(APIData, Stack):
     pass
 
 
+class StacksCommand(APIData):
+    device: str = "stacks"
+    command: str = "replaceall"
+    stacks: List[Stack]
+
+
 class StackConfig(ConfigList):
-    '''Get and set stack configuration.'''
+    '''Get and set stack configuration.
+
+    Names handed out by get_new_name() stay reserved until the instrument reports the stack, so stacks
+    that are added in one batch get different names.
+    '''
     device: str = "stacks"
     data_class = Stack
 
-    def add_element(self, stack: Stack):
+    def __init__(self, api_handler: LuxendoAPIHandler) -> None:
+        self._pending_names = set()
+        super().__init__(api_handler)
+
+    def get_new_name(self, prefix: str = "stack_") -> str:
+        '''Return a name that is neither used by a stack nor reserved for a stack that is not confirmed yet.'''
+        names = {stack.name for stack in self.data} | self._pending_names
+        index = len(self.data)
+        while f"{prefix}{index}" in names:
+            index += 1
+        self._pending_names.add(f"{prefix}{index}")
+        return f"{prefix}{index}"
+
+    def add_element(self, stack: Stack, batch: 'CommandBatch' = None):
         new_stack = NewStack(
             device="stacks",
             command="add",
@@ -259,7 +665,19 @@ class StackConfig(ConfigList):
             reps=stack.reps,
             name=stack.name,
             description=stack.description)
-        self._send_command(data=new_stack, exclude_unset=True)
+        self._send_command(data=new_stack, batch=batch,
+                           reply_predicate=lambda reply: stack.name in self._get_names(reply), exclude_unset=True)
+
+    def replace_all(self, stacks: List[Stack], batch: 'CommandBatch' = None):
+        '''Replace all stacks on the device with a single command.'''
+        names = [stack.name for stack in stacks]
+        self._send_command(data=StacksCommand(stacks=stacks), batch=batch,
+                           reply_predicate=lambda reply: self._get_names(reply) == names, exclude_none=True)
+
+    def _parse_data(self, payload_dict: dict):
+        stacks = super()._parse_data(payload_dict)
+        self._pending_names.difference_update(stack.name for stack in stacks)
+        return stacks
 
     def remove_api_generated_elements(self):
         for stack in self.data:
@@ -309,6 +727,9 @@ class AxisCommand(APIData):
 class Stage(BaseConfig, interface.Stage):
     '''Stage class.
 
+    Positions and targets are cached from the embedded/stages messages of the instrument, so reading
+    positions and waiting for the stage does not send anything to the instrument.
+
     methods:
         get_nearest_positions_in_range(z_position: float, y_position: float, x_position: float) -> tuple
             get nearest position in range
@@ -316,8 +737,13 @@ class Stage(BaseConfig, interface.Stage):
             wait until stage is stopped, return True if stopped, False if timeout
 
     properties:
+        resolution_um: float
+            step size of the positions reported by the instrument, a requested target is confirmed by a
+            reported target that is within half a step
         axes: OrderedDict[Axes]
-            list of Axis objects
+            list of Axis objects, replaced as a whole when the instrument reports new positions
+        stopped_event: threading.Event
+            set while no axis is moving
         position_um: list[float]
             list of positions in um
         z_position_um(): float
@@ -333,8 +759,16 @@ class Stage(BaseConfig, interface.Stage):
         x_range(): tuple
             x range in µm
     '''
+    resolution_um: float = 0.1
 
     def __init__(self, api_handler: LuxendoAPIHandler) -> None:
+        self.axes = OrderedDict()
+        self.stopped_event = threading.Event()
+        self._axes_lock = threading.RLock()
+        # targets that were sent, but not yet confirmed by the instrument
+        self._requested_targets: Dict[str, float] = {}
+        self._set_command_template: CommandTemplate = None
+        self._set_command_template_key = None
         super().__init__(
             api_handler=api_handler,
             main_topic="embedded/stages",
@@ -343,48 +777,112 @@ class Stage(BaseConfig, interface.Stage):
                 data=APIData(device="stages")))
 
     def is_moving(self):
-        return any([axis.target != axis.position_um for axis in self.axes.values()])
-
-    def add_current_position_to_stacks(self, stacks: StackConfig) -> Stack:
-        new_stack = Stack(
-            elements=[],
-            n=1,
-            reps=1,
-            name=f"stack_{len(stacks.data)}",
-            description=f"MicGymV{interface.__version__}")
-        for axis in self.axes.values():
-            new_stack.elements.append(StackElement(start=axis.position_um, name=axis.name, end=axis.position_um))
-        stacks.add_element(new_stack)
+        with self._axes_lock:
+            return self._is_moving()
+
+    def wait_until_stopped(self, timeout_ms: float = 10000) -> bool:
+        return self.stopped_event.wait(timeout_ms / 1000)
+
+    def add_current_position_to_stacks(self, stacks: StackConfig, batch: 'CommandBatch' = None) -> Stack:
+        new_stack = self.get_stack(name=stacks.get_new_name())
+        stacks.add_element(new_stack, batch=batch)
         return new_stack
 
+    def get_current_position_elements(self) -> List[StackElement]:
+        '''Return stack elements that image the current position of all axes.'''
+        return [StackElement(start=axis.position_um, name=axis.name, end=axis.position_um)
+                for axis in self.axes.values()]
+
+    def get_stack(self, name: str, n: int = 1, **axis_ranges: Tuple[float, float]) -> Stack:
+        '''Return a stack at the current position of all axes, except for the axes given as name=(start, end).
+
+        example:
+            stage.get_stack("stack_0", n=11, z=(0, 10))  # 11 planes from z=0 µm to z=10 µm
+        '''
+        elements = []
+        for axis in self.axes.values():
+            start, end = axis_ranges.get(axis.name, (axis.position_um, axis.position_um))
+            elements.append(StackElement(name=axis.name, start=start, end=end))
+        return Stack(elements=elements, n=n, reps=1, name=name, description=f"MicGymV{interface.__version__}")
+
     def _parse_data(self, payload_dict: dict) -> OrderedDict:
-        axes = OrderedDict()
-        for axis_data in payload_dict['data']['axes']:
-            axis = Axis(**axis_data)
-            axes[axis.name] = axis
-        if len(axes) > 0:
+        with self._axes_lock:
+            axes = OrderedDict(self.axes)
+            for axis_data in payload_dict['data'].get('axes', []):
+                axis = Axis(**axis_data)
+                axes[axis.name] = axis
+                requested_target = self._requested_targets.get(axis.name)
+                if requested_target is not None and self._is_close(axis.target, requested_target):
+                    del self._requested_targets[axis.name]
             self.axes = axes
-        return axes
+            self._update_stopped_event()
+            return axes
 
     def _update_axes_positions(self, axis_names: List[str], positions: List[float]):
-        for name, position in zip(axis_names, positions):
-            self.axes[name].position_um = position
-        command = self.request_command.copy()
-        command.data = AxisCommand(command="set", device="stages", axes=list(self.axes.values()))
-        self.api_handler.send_command(command.json(by_alias=True))
-
-    def _process_stage_reply(self, client, userdata, message):
-        payload_dict = json.loads(message.payload)
-        axes = OrderedDict()
-        for axis_data in payload_dict['data']['axes']:
-            axis = Axis(**axis_data)
-            axes[axis.name] = axis
-        if len(axes) > 0:
-            self.axes = axes
+        with self._axes_lock:
+            # moves that the instrument has not confirmed yet must not be cancelled
+            targets = {axis.name: self._requested_targets.get(axis.name, axis.target) for axis in self.axes.values()}
+            changed = False
+            for name, position in zip(axis_names, positions):
+                axis = self.axes[name]
+                if not axis.min <= position <= axis.max:
+                    # raises the validation error of the axis
+                    Axis(**dict(axis.dict(by_alias=True), value=position))
+                if self._is_close(position, targets[name]):
+                    continue
+                changed = True
+                targets[name] = position
+                if not self._is_close(position, axis.position_um) or not self._is_close(position, axis.target):
+                    self._requested_targets[name] = position
+            if not changed:
+                # the stage is already at, or on its way to, the requested position
+                return
+            self._update_stopped_event()
+            template = self._get_set_command_template()
+            values = []
+            for axis in self.axes.values():
+                values.append(targets[axis.name])
+                values.append(axis.target)
+        self.api_handler.send_command(template.render(*values))
+
+    def _get_set_command_template(self) -> CommandTemplate:
+        '''Return the template of the set stages command for the current axes.
+
+        The template is rebuilt only when the axes or their properties other than value and target change.'''
+        key = tuple((axis.name, axis.min, axis.max, axis.guiName, axis.partOf, axis.type)
+                    for axis in self.axes.values())
+        if key != self._set_command_template_key:
+            axes = []
+            for index, axis in enumerate(self.axes.values()):
+                axis_data = axis.dict(by_alias=True)
+                axis_data['value'] = CommandTemplate.field(f"value_{index}")
+                axis_data['target'] = CommandTemplate.field(f"target_{index}")
+                axes.append(axis_data)
+            command = self.request_command.copy()
+            command.data = AxisCommand(command="set", device="stages", axes=axes)
+            self._set_command_template = CommandTemplate(json.loads(command.json(by_alias=True)))
+            self._set_command_template_key = key
+        return self._set_command_template
+
+    def _is_moving(self) -> bool:
+        return len(self._requested_targets) > 0 \
+            or any(not self._is_close(axis.target, axis.position_um) for axis in self.axes.values())
+
+    def _is_close(self, position_um: float, other_position_um: float) -> bool:
+        '''Return True if the positions are the same position of the instrument, i.e. within half a step.'''
+        return abs(position_um - other_position_um) <= self.resolution_um / 2 + 1e-9
+
+    def _update_stopped_event(self):
+        if self._is_moving():
+            self.stopped_event.clear()
+        else:
+            self.stopped_event.set()
 
-    def _get_stage_status(self):
-        message = self.api_handler.send_command_and_wait_for_reply(self.default_command.json())
-        return message['data']['axes']
+    def _get_stage_status(self) -> List[dict]:
+        '''Request the stage state from the instrument, instead of using the cached state.'''
+        self.request_configuration()
+        with self._axes_lock:
+            return [axis.dict(by_alias=True) for axis in self.axes.values()]
 
 
 class ROIProperty(BaseModel):
@@ -527,25 +1025,48 @@ class EventConfig(ConfigList):
     data_class = Event
     del_command_class = EventDelCommand
 
-    def add_task(self, event_name: str, task: Task):
+    def add_task(self, event_name: str, task: Task, batch: 'CommandBatch' = None):
         command_data = EventCommand(device="events", command="addtask", event=event_name, tasks=[task])
-        self._send_command(data=command_data, exclude_unset=True)
+        self._send_command(data=command_data, batch=batch, exclude_unset=True)
+
+    def replace_tasks(self, event_name: str, tasks: List[Task], batch: 'CommandBatch' = None):
+        command_data = EventCommand(device="events", command="replacetasks", event=event_name, tasks=tasks)
+        self._send_command(data=command_data, batch=batch, exclude_unset=True)
 
-    def del_task(self, event_name: str, task_name: str):
+    def del_task(self, event_name: str, task_name: str, batch: 'CommandBatch' = None):
         command_data = EventCommand(device="events", command="del", event=event_name, task=task_name)
-        self._send_command(data=command_data, exclude_unset=True)
+        self._send_command(data=command_data, batch=batch, exclude_unset=True)
 
-    def add_trigger(self, event_name: str, trigger: Trigger):
+    def add_trigger(self, event_name: str, trigger: Trigger, batch: 'CommandBatch' = None):
         command_data = EventCommand(device="events", command="addtrigger", event=event_name, triggers=[trigger])
-        self._send_command(data=command_data, exclude_unset=True)
+        self._send_command(data=command_data, batch=batch, exclude_unset=True)
 
-    def del_trigger(self, event_name: str, trigger_name: str):
+    def del_trigger(self, event_name: str, trigger_name: str, batch: 'CommandBatch' = None):
         command_data = EventCommand(device="events", command="del", event=event_name, trigger=trigger_name)
-        self._send_command(data=command_data, exclude_unset=True)
+        self._send_command(data=command_data, batch=batch, exclude_unset=True)
+
+
+class AcquisitionSession():
+    '''Long-lived acquisition configuration on the instrument.
 
+    Entering the session backs up and removes the events and stacks configured by the user and creates
+    a single stack, event, task and trigger that image the current stage position. Leaving the session
+    restores the user configuration.
+
+    Entering the session again while it is active (e.g. once per frame in Camera.capture_image) does
+    not change the configuration. A frame then only costs the run command, plus a single stack update
+    if the stage has moved. A run can also image several stacks (see set_stacks), so that the
+    instrument sequences z-planes and tile positions by itself.
+
+    example:
+        with camera.acquisition_session():
+            for y, x in positions:
+                microscope.move_stage_to(absolute_y_position_um=y, absolute_x_position_um=x)
+                images.append(camera.capture_image())
+    '''
 
-class TemporaryEvent():
     def __init__(self, api_handler: LuxendoAPIHandler, stage: Stage, active_channel: str = None):
+        self.api_handler = api_handler
         self.stage = stage
         self.stacks = StackConfig(api_handler)
         self.events = EventConfig(api_handler)
@@ -560,55 +1081,123 @@ class TemporaryEvent():
                     f"More than one channel configured, using {self.active_channel}. \
                         If you want to use a different channel, please set the active_channel \
                         property to the name of that channel (e.g. 'channel_1').")
-        self.current_stack = None
+        self.current_stacks: List[Stack] = []
+        self.current_channels: List[str] = [self.active_channel]
+        self.current_event = None
         self.events_backup = None
-
-    def __enter__(self) -> 'TemporaryEvent':
+        self.stacks_backup = None
+        self._depth = 0
+
+    @property
+    def is_active(self) -> bool:
+        return self._depth > 0
+
+    @property
+    def current_stack(self) -> Optional[Stack]:
+        return self.current_stacks[0] if self.current_stacks else None
+
+    def set_stacks(self, stacks: List[Stack], channels: List[str] = None):
+        '''Image the given stacks, in this order, in the next run.
+
+        Every stack is imaged in all channels (default: the active channel) before the next stack, the
+        instrument switches the channels itself. Only the stacks and tasks that differ from the current
+        configuration are sent to the instrument.'''
+        stacks = list(stacks)
+        channels = self._validate_channels(channels)
+        with self.api_handler.batch() as batch:
+            if stacks != self.current_stacks:
+                self.stacks.replace_all(stacks, batch=batch)
+            if [stack.name for stack in stacks] != [stack.name for stack in self.current_stacks] \
+                    or channels != self.current_channels:
+                self.events.replace_tasks(self.current_event, self._get_tasks(stacks, channels), batch=batch)
+        self.current_stacks = stacks
+        self.current_channels = channels
+
+    def get_task_order(self) -> List[Tuple[str, str]]:
+        '''Return (stack name, channel name) of the tasks of the next run in the order they are imaged.'''
+        return [(stack.name, channel) for stack in self.current_stacks for channel in self.current_channels]
+
+    def update_current_stack(self, channels: List[str] = None):
+        '''Image a single plane at the current stage position in the next run.'''
+        current_stack = self.current_stack.copy(update={'elements': self.stage.get_current_position_elements(),
+                                                        'n': 1})
+        self.set_stacks([current_stack], channels)
+
+    def __enter__(self) -> 'AcquisitionSession':
+        self._depth += 1
+        if self._depth > 1:
+            return self
+        # independent commands are sent together, so that each step costs a single round-trip
         self.events_backup = deepcopy(self.events.data)
-        if self.events_backup is not None:
-            for event in self.events_backup:
-                self.events.remove_element(event.name)
         self.stacks_backup = deepcopy(self.stacks.data)
-        if self.stacks_backup is not None:
-            for stack in self.stacks_backup:
-                self.stacks.remove_element(stack.name)
-        self.current_stack = self.stage.add_current_position_to_stacks(self.stacks)
-        self.events.add_element()
-        current_task = Task(
-            name='Task_000',
-            type='StackChannel',
-            channel=self.active_channel,
-            stack=self.current_stack.name,
-            configuration='default',
-            order=0,
-            ablation=[])
+        current_stacks = [self.stage.get_stack(name="stack_0")]
+        with self.api_handler.batch() as batch:
+            for event in self.events_backup or []:
+                self.events.remove_element(event.name, batch=batch)
+            self.stacks.replace_all(current_stacks, batch=batch)
+            self.events.add_element(batch=batch)
+        self.current_stacks = current_stacks
+        self.current_channels = [self.active_channel]
+        self.current_event = self.events.data[-1].name
         current_trigger = Trigger(
             name='Trigger_000',
             type='StartIntervalRepeats',
             start=Time(h=0, m=0, s=0),
             interval=Time(h=0, m=0, s=0), reps=1)
-        self.current_event = self.events.data[-1].name
-        self.events.add_task(self.current_event, current_task)
-        self.events.add_trigger(self.current_event, current_trigger)
+        with self.api_handler.batch() as batch:
+            self.events.replace_tasks(self.current_event, self._get_tasks(current_stacks), batch=batch)
+            self.events.add_trigger(self.current_event, current_trigger, batch=batch)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.events.remove_element(self.current_event)
-        self.stacks.remove_element(self.current_stack.name)
-        if self.events_backup is not None:
-            for event in self.events_backup:
-                self.events.add_element()
-                name = self.events.data[-1].name
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        events_backup = self.events_backup or []
+        with self.api_handler.batch() as batch:
+            self.events.remove_element(self.current_event, batch=batch)
+            self.stacks.replace_all(self.stacks_backup or [], batch=batch)
+            for event in events_backup:
+                self.events.add_element(batch=batch)
+        self.current_stacks = []
+        self.current_event = None
+        restored_event_names = [event.name for event in self.events.data[len(self.events.data) - len(events_backup):]]
+        with self.api_handler.batch() as batch:
+            for event, name in zip(events_backup, restored_event_names):
                 for task in event.tasks:
-                    self.events.add_task(name, task)
-                    self.events.wait_for_reply()
+                    self.events.add_task(name, task, batch=batch)
                 for trigger in event.triggers:
-                    self.events.add_trigger(name, trigger)
-                    self.events.wait_for_reply()
-        if self.stacks_backup is not None:
-            for stack in self.stacks_backup:
-                self.stacks.add_element(stack)
-                self.stacks.wait_for_reply()
+                    self.events.add_trigger(name, trigger, batch=batch)
+
+    def _get_tasks(self, stacks: List[Stack], channels: List[str] = None) -> List[Task]:
+        channels = channels or [self.active_channel]
+        stack_channels = [(stack.name, channel) for stack in stacks for channel in channels]
+        return [Task(
+            name=f'Task_{order:03d}',
+            type='StackChannel',
+            channel=channel,
+            stack=stack_name,
+            configuration='default',
+            order=order,
+            ablation=[]) for order, (stack_name, channel) in enumerate(stack_channels)]
+
+    def _validate_channels(self, channels: Optional[List[str]]) -> List[str]:
+        if channels is None:
+            return [self.active_channel]
+        channels = list(channels)
+        if not channels:
+            raise ValueError("At least one channel is required.")
+        configured_channels = [channel.name for channel in self.channels.data]
+        for channel in channels:
+            if channel not in configured_channels:
+                raise ValueError(f"Channel {channel} is not configured, available channels: {configured_channels}")
+        if len(set(channels)) != len(channels):
+            raise ValueError(f"Channels must be unique, got {channels}")
+        return channels
+
+
+# backwards compatible name, a single frame is a session that is entered once
+TemporaryEvent = AcquisitionSession
 
 
 class FolderChild(BaseModel):
@@ -660,7 +1249,32 @@ class DiskCommand(APIData):
     type: str = "camerasaving"
 
 
+class SetSourceCommand(APIData):
+    device: str = "disk"
+    command: str = "set"
+    type: str = "camerasaving"
+    selectedsource: str
+
+
+class AcquisitionEstimate(BaseModel):
+    '''Data volume and sustained write throughput of a planned acquisition.'''
+    data_volume_bytes: int
+    throughput_bytes_per_s: float
+    duration_s: float
+
+
 class DiskConfig(BaseConfig):
+    '''Storage targets (sources) of the camera files.
+
+    Source.free and Source.size are in bytes, Source.speed is the sustained write speed in MB/s. The instrument
+    reports a speed of 0 if it has not measured it, such sources are never rejected for being too slow.
+
+    methods:
+        find_source(estimate, margin) -> Source
+        check_source(name, estimate, margin)
+        select_source(name)
+    '''
+    bytes_per_speed_unit = 1e6
 
     def __init__(self, api_handler: LuxendoAPIHandler):
         super().__init__(
@@ -671,28 +1285,307 @@ class DiskConfig(BaseConfig):
                 data=DiskCommand()),
             subtopic='/gui/directory')
 
+    @property
+    def sources(self) -> List[Source]:
+        return self.data.sources.options
+
+    @property
+    def selected_source(self) -> str:
+        return self.data.selectedsource
+
+    def find_source(self, estimate: AcquisitionEstimate, margin: float = 1.1) -> Source:
+        '''Return the fastest source with enough free space and write speed for the acquisition.
+
+        Raises LuxendoStorageError if no source can store the acquisition.'''
+        sources = [source for source in self.sources if not self._get_problems(source, estimate, margin)]
+        if not sources:
+            problems = [problem for source in self.sources for problem in self._get_problems(source, estimate, margin)]
+            raise LuxendoStorageError("No storage source can store the acquisition: " + "; ".join(problems))
+        # sources of unknown speed (0) come last, the selected source wins a tie
+        return max(sources, key=lambda source: (source.speed, source.name == self.selected_source))
+
+    def check_source(self, name: str, estimate: AcquisitionEstimate, margin: float = 1.1) -> None:
+        '''Raise LuxendoStorageError if the source cannot store the acquisition.'''
+        source = next((source for source in self.sources if source.name == name), None)
+        if source is None:
+            raise LuxendoStorageError(f"Unknown storage source {name}")
+        problems = self._get_problems(source, estimate, margin)
+        if problems:
+            raise LuxendoStorageError("; ".join(problems))
+
+    def select_source(self, name: str) -> None:
+        if name != self.selected_source:
+            self._send_command(SetSourceCommand(selectedsource=name),
+                               reply_predicate=lambda reply: reply.get('selectedsource') == name)
+
+    def _get_problems(self, source: Source, estimate: AcquisitionEstimate, margin: float) -> List[str]:
+        problems = []
+        if source.free < estimate.data_volume_bytes * margin:
+            problems.append(f"{source.name} has {source.free / 1e9:.1f} GB free, "
+                            f"the acquisition needs {estimate.data_volume_bytes / 1e9:.1f} GB")
+        speed_bytes_per_s = source.speed * self.bytes_per_speed_unit
+        if 0 < speed_bytes_per_s < estimate.throughput_bytes_per_s * margin:
+            problems.append(f"{source.name} writes {speed_bytes_per_s / 1e6:.0f} MB/s, "
+                            f"the acquisition records {estimate.throughput_bytes_per_s / 1e6:.0f} MB/s")
+        return problems
+
     def _parse_data(self, payload_dict: dict):
         return Disk(**payload_dict['data'])
 
 
+class LazyFrameStack:
+    '''Image stack in an HDF5 file that is read on demand.
+
+    Indexing reads only the requested planes or region of interest, e.g. stack[3] or
+    stack[:, 100:200, 100:200]. numpy.asarray(stack) reads the whole stack.
+
+    properties:
+        path: Path
+        dataset: str
+            name of the dataset in the file
+        shape: tuple
+        dtype: numpy.dtype
+    '''
+
+    def __init__(self, path: Path, dataset: str = 'Data'):
+        import h5py
+        self.path = Path(path)
+        self.dataset = dataset
+        with h5py.File(self.path, 'r') as image_file:
+            self.shape = image_file[dataset].shape
+            self.dtype = image_file[dataset].dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        import h5py
+        with h5py.File(self.path, 'r') as image_file:
+            return image_file[self.dataset][key]
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        array = self[()]
+        return array if dtype is None else array.astype(dtype)
+
+    def __repr__(self):
+        return f"LazyFrameStack(path={str(self.path)!r}, shape={self.shape}, dtype={self.dtype})"
+
+
+def open_frame_stack(path: Path, dataset: str = 'Data'):
+    '''Open the image stack of a Luxendo HDF5 file without reading it.
+
+    Contiguous, uncompressed datasets (the default of the Luxendo software) are memory-mapped, all other
+    datasets are read through h5py on demand.
+
+    Returns:
+        numpy.memmap or LazyFrameStack
+    '''
+    import h5py
+    with h5py.File(path, 'r') as image_file:
+        data = image_file[dataset]
+        offset = data.id.get_offset()
+        if data.chunks is None and data.compression is None and offset is not None:
+            return np.memmap(path, dtype=data.dtype, mode='r', offset=offset, shape=data.shape)
+    return LazyFrameStack(path, dataset)
+
+
+def wait_until_file_is_ready(path: Path, timeout_s: float, poll_interval_s: float = 0.01) -> dict:
+    '''Wait until the instrument has finished writing a file and return its metadata.
+
+    A file is ready when its size did not change between two polls and HDF5 can read the metadata, i.e.
+    the writer has closed the file.'''
+    import h5py
+    deadline = time.monotonic() + timeout_s
+    previous_size = -1
+    while True:
+        size = path.stat().st_size if path.exists() else -1
+        if size > 0 and size == previous_size:
+            try:
+                with h5py.File(path, 'r') as image_file:
+                    return json.loads(image_file['metadata'][()])
+            except (OSError, KeyError):
+                pass
+        if time.monotonic() > deadline:
+            raise LuxendoTimeoutError(f"Timeout ({timeout_s} s) while waiting for file {path}")
+        previous_size = size
+        time.sleep(poll_interval_s)
+
+
+class MultiViewResult:
+    '''Images of a run, per view (camera).
+
+    Every view is completed on its own as soon as all of its files are loaded, so that processing (e.g.
+    fusion) can start on the first view while the files of the other views are still being read.
+
+    methods:
+        view(name, timeout_s) -> list of image stacks (n, height, width), one for each file of the view
+        metadata(name, timeout_s) -> list of file metadata dicts of the view
+        as_completed(timeout_s) -> iterator over view names in the order they are loaded
+        wait(timeout_s) -> {view name: list of image stacks}
+        to_array(timeout_s) -> numpy.ndarray (view, file, n, height, width)
+
+    properties:
+        views: list of view (camera) names
+        tasks: {view name: [(stack name, channel name) of each file in recording order]}
+        file_paths, images, metadatas: {view name: list}, filled in while the files are reported and loaded
+    '''
+
+    def __init__(self, tasks: Dict[str, List[Tuple[str, str]]]):
+        self.tasks = tasks
+        self.file_paths: Dict[str, List[Path]] = {name: [] for name in tasks}
+        self.images: Dict[str, List[Any]] = {name: [] for name in tasks}
+        self.metadatas: Dict[str, List[dict]] = {name: [] for name in tasks}
+        self._futures: Dict[str, Future] = {name: Future() for name in tasks}
+        self._files_reported = threading.Event()
+        self._lock = threading.Lock()
+        if not tasks:
+            self._files_reported.set()
+
+    @property
+    def views(self) -> List[str]:
+        return list(self.tasks)
+
+    def add_file(self, name: str, path: Path) -> int:
+        '''Reserve the slot of a reported file and return its index within the view.'''
+        with self._lock:
+            index = len(self.file_paths.setdefault(name, []))
+            self.file_paths[name].append(path)
+            self.images.setdefault(name, []).append(None)
+            self.metadatas.setdefault(name, []).append(None)
+            if all(len(self.file_paths[view]) >= len(tasks) for view, tasks in self.tasks.items()):
+                self._files_reported.set()
+        return index
+
+    def set_image(self, name: str, index: int, image, metadata: dict):
+        with self._lock:
+            self.images[name][index] = image
+            self.metadatas[name][index] = metadata
+            future = self._futures.get(name)
+            view_is_loaded = future is not None and len(self.images[name]) >= len(self.tasks[name]) \
+                and all(view_image is not None for view_image in self.images[name])
+        if view_is_loaded and not future.done():
+            future.set_result(self.images[name])
+
+    def set_error(self, name: str, error: Exception):
+        future = self._futures.get(name)
+        if future is not None and not future.done():
+            future.set_exception(error)
+
+    def is_loaded(self) -> bool:
+        return all(future.done() and future.exception() is None for future in self._futures.values())
+
+    def wait_for_files(self, timeout_s: float = None):
+        '''Wait until the instrument has reported the files of all views, i.e. the run is finished.'''
+        if not self._files_reported.wait(timeout_s):
+            raise LuxendoTimeoutError(f"Timeout ({timeout_s} s) while waiting for the files of the run")
+
+    def view(self, name: str, timeout_s: float = None) -> List[Any]:
+        try:
+            return self._futures[name].result(timeout_s)
+        except FutureTimeoutError:
+            raise LuxendoTimeoutError(f"Timeout ({timeout_s} s) while waiting for the images of {name}") from None
+
+    def metadata(self, name: str, timeout_s: float = None) -> List[dict]:
+        self.view(name, timeout_s)
+        return self.metadatas[name]
+
+    def as_completed(self, timeout_s: float = None) -> Iterable[str]:
+        names = {future: name for name, future in self._futures.items()}
+        try:
+            for future in as_completed(names, timeout_s):
+                yield names[future]
+        except FutureTimeoutError:
+            raise LuxendoTimeoutError(f"Timeout ({timeout_s} s) while waiting for the images of the run") from None
+
+    def wait(self, timeout_s: float = None) -> Dict[str, List[Any]]:
+        deadline = None if timeout_s is None else time.monotonic() + timeout_s
+        for name in self.views:
+            remaining_s = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            self.view(name, remaining_s)
+        return self.images
+
+    def to_array(self, timeout_s: float = None) -> np.ndarray:
+        '''Stack all views into one array with a leading view axis, in the order of views.'''
+        images = self.wait(timeout_s)
+        arrays = [np.asarray(images[name]) for name in self.views]
+        shapes = {name: array.shape for name, array in zip(self.views, arrays)}
+        if len(set(shapes.values())) > 1:
+            raise ValueError(f"Views have different shapes and cannot be stacked: {shapes}")
+        return np.stack(arrays)
+
+
 class Camera(interface.Camera):
-    def __init__(self, api_handler: LuxendoAPIHandler, stage: Stage, disk: DiskConfig, new_image_timeout_ms=60000):
+    '''Cameras of the active channel, or of a list of channels that are imaged in the same run.
+
+    Every run of the instrument records one file per stack and camera. capture_image and capture_stacks
+    return the images as {camera name: [image stack (n, height, width) for each stack]}. The files are
+    opened by a pool of loader threads, so that the MQTT client thread is never blocked, and the image
+    stacks are memory-mapped or read on demand (see open_frame_stack). capture_views returns as soon as
+    the run is finished, with a MultiViewResult whose views (cameras) can be used as soon as each is loaded.
+
+    Before a run is started, its data volume and write throughput are estimated (see estimate_acquisition)
+    and checked against the storage sources of the instrument, so that an acquisition that does not fit
+    fails before it starts instead of running out of disk space or dropping frames.
+
+    close() stops the loader threads and the live preview, see Microscope.close.
+
+    Args:
+        new_image_timeout_ms: time to wait for the images of a run
+        file_poll_interval_s: interval in which files reported by the instrument are checked for readiness
+        loader_threads: number of threads that open files
+        storage_policy: "validate" checks the selected storage source, "select" switches to the fastest source
+            that can store the acquisition (see DiskConfig.find_source), None disables the check
+        storage_margin: required reserve of free space and write speed, e.g. 1.1 for 10 %
+        live_preview_url: websocket url of the live stream that take_snapshot uses (see LivePreview)
+        live_preview_timeout_s: time to wait for a live frame
+    '''
+    bytes_per_pixel = 2
+    storage_policies = (None, "validate", "select")
+
+    def __init__(self, api_handler: LuxendoAPIHandler, stage: Stage, disk: DiskConfig, new_image_timeout_ms=60000,
+                 file_poll_interval_s: float = 0.01, loader_threads: int = 4, storage_policy: str = "validate",
+                 storage_margin: float = 1.1, live_preview_url: str = None, live_preview_timeout_s: float = 1.0):
+        if storage_policy not in self.storage_policies:
+            raise ValueError(f"storage_policy must be one of {self.storage_policies}, got {storage_policy!r}")
+        self.storage_policy = storage_policy
+        self.storage_margin = storage_margin
+        self.live_preview = LivePreview(live_preview_url) if live_preview_url else None
+        self.live_preview_timeout_s = live_preview_timeout_s
         self.file_paths = {}
-        self.has_new_image = False
+        self.new_image_event = threading.Event()
         self.current_images = {}
         self.current_metadatas = {}
         self.new_image_timeout_ms = new_image_timeout_ms
+        self.file_poll_interval_s = file_poll_interval_s
+        self._loader = ThreadPoolExecutor(max_workers=loader_threads, thread_name_prefix="LuxendoFileLoader")
+        self._images_lock = threading.Lock()
+        self._current_result: Optional[MultiViewResult] = None
+        # (stack name, channel name) of the files expected from each camera, in the order they are recorded
+        self._expected_tasks: Dict[str, List[Tuple[str, str]]] = {}
         self.metadata = {}
         self.stage = stage
-        self.event_handler = TemporaryEvent(api_handler, stage)
+        self.event_handler = AcquisitionSession(api_handler, stage)
+        self._cameras_configured_event = threading.Event()
+        self._expected_cameras = {device.name for channel in self.event_handler.channels.data
+                                  for device in channel.devices if device.type == 'cameras'}
+        self.cameras = {}
+        self.serial_number_names = {}
+        # settings state: what the instrument reported last, and what was sent since and not yet reported
+        self.acknowledged_timings: Dict[str, float] = {}
+        self._requested_timings: Optional[Tuple[float, float]] = None
+        self._requested_rois: Dict[str, Tuple[int, int, int, int]] = {}
+        self._settings_lock = threading.RLock()
         self.disk = disk
         self.api_handler = api_handler
         self.api_handler.ensure_connection()
         self.api_handler.subscribe("datahub/cameras/#", self._update_camera)
         self.api_handler.subscribe("embedded/cameras", self._update_camera)
         self.api_handler.subscribe("embedded/timings", self._update_exposure_settings)
-        self.timings_command = {"type": "device", "data": {"device": "timings", "command": "set"}}
-        self.cameras_command = {"type": "device", "data": {"device": "cameras", "command": "setroi"}}
+        self.api_handler.send_command(TIMINGS_REQUEST)
         self.file_command = {
             "type": "device",
             "data": {
@@ -700,47 +1593,115 @@ class Camera(interface.Camera):
                 "command": "getconfig",
                 "type": "camerasaving"}}
         self.active_channel = "channel_0"
-        self.cameras = {}
-        self.serial_number_names = {}
         self._get_config()
 
     def take_snapshot(self) -> np.ndarray:
-        # TODO: implement using websocket add warning about lower quality
-        raise NotImplementedError
+        '''Return the next frame of the live stream of the first camera of the active channel.
 
-    def capture_image(self) -> np.ndarray:
-        self.has_new_image = False
+        Live frames arrive with sub-second latency, but are a preview: they are not saved and may be of lower
+        quality than the files of a run. Without a live stream, a single plane is acquired with capture_image.'''
+        camera_name = self._get_channel_cameras()[0]
+        if self.live_preview is None:
+            return np.asarray(self.capture_image()[camera_name][0][0])
+        self.live_preview.start()
+        return self.live_preview.wait_for_frame(camera_name, self.live_preview_timeout_s)
+
+    def close(self):
+        '''Stop the loader threads and the live preview, files that are not loaded yet are not loaded anymore.'''
+        self._loader.shutdown(wait=True, cancel_futures=True)
+        if self.live_preview is not None:
+            self.live_preview.stop()
+
+    @property
+    def has_new_image(self) -> bool:
+        return self.new_image_event.is_set()
+
+    @property
+    def settings(self) -> CameraSettings:
+        '''Settings of the first camera of the active channel.'''
+        return self.cameras[self._get_channel_cameras()[0]]
+
+    @settings.setter
+    def settings(self, value: CameraSettings):
+        self.configure_camera(value)
+
+    def acquisition_session(self) -> AcquisitionSession:
+        '''Return a context manager that keeps the acquisition configuration on the instrument between frames.'''
+        return self.event_handler
+
+    def capture_image(self, channels: List[str] = None) -> Dict[str, List[np.ndarray]]:
+        '''Image the current stage position, in several channels if given (see capture_stacks).'''
         with self.event_handler:
-            self._send_capture_command()
-            timeout = self.new_image_timeout_ms / 1000.0
-            poll_interval = 0.01
-            while not self.has_new_image and timeout > 0:
-                time.sleep(poll_interval)
-                timeout -= poll_interval
-            if timeout <= 0:
-                raise LuxendoAPIException(
-                    f"Timeout ({self.new_image_timeout_ms / 1000.0} s) while waiting for new image")
-        self.has_new_image = False
-        return self.current_images
+            self.event_handler.update_current_stack(channels)
+            images = self._run()
+        return images if channels is None else self._group_by_channel(images)
+
+    def capture_stacks(self, stacks: List[Stack], channels: List[str] = None) -> Dict[str, List[np.ndarray]]:
+        '''Image several stacks (e.g. tiles of a z-stack) in a single run of the instrument.
+
+        Without channels, the stacks are imaged in the active channel and the images are returned as
+        {camera name: [image stack for each stack]}. With a list of channel names, every stack is imaged in
+        all channels within the same run and the images are returned as
+        {camera name: {channel name: [image stack for each stack]}}, for the channels the camera records.'''
+        with self.event_handler:
+            self.event_handler.set_stacks(stacks, channels)
+            images = self._run()
+        return images if channels is None else self._group_by_channel(images)
+
+    def capture_views(self, stacks: List[Stack] = None, channels: List[str] = None) -> MultiViewResult:
+        '''Image the stacks (default: the current stage position) and return when the run is finished.
+
+        The files of the views are still being loaded when this returns, see MultiViewResult.'''
+        with self.event_handler:
+            if stacks is None:
+                self.event_handler.update_current_stack(channels)
+            else:
+                self.event_handler.set_stacks(stacks, channels)
+            result = self._start_run()
+            result.wait_for_files(self.new_image_timeout_ms / 1000.0)
+        return result
+
+    def estimate_acquisition(self, stacks: List[Stack], channels: List[str] = None) -> AcquisitionEstimate:
+        '''Estimate the data volume and write throughput of imaging the stacks in the channels.'''
+        channels = channels or [self.event_handler.active_channel]
+        expected_tasks = self._get_expected_tasks([(stack.name, channel) for stack in stacks for channel in channels])
+        return self._estimate_acquisition(expected_tasks, {stack.name: stack for stack in stacks})
 
     def configure_camera(self, settings: CameraSettings) -> None:
-        command = deepcopy(self.timings_command)
-        command['data']['timings'] = {}
-        command['data']['timings']['exposure'] = settings.exposure_time_ms
-        command['data']['timings']['delaybefore'] = 0
-        command['data']['timings']['delayafter'] = settings.delay
-        self.api_handler.send_command(json.dumps(command))
-        command = deepcopy(self.cameras_command)
-        command['data']['name'] = settings.name
-        command['data']['roi'] = {}
-        command['data']['roi']['top'] = settings.top
-        command['data']['roi']['left'] = settings.left
-        command['data']['roi']['width'] = settings.width_pixels
-        command['data']['roi']['height'] = settings.height_pixels
-        self.api_handler.publish(self.api_handler.main_topic + "/gui/datahub", json.dumps(command))
-
-    def _update_camera(self, client, userdata, message):
-        data = json.loads(message.payload)['data']
+        '''Apply camera settings.
+
+        Only the commands for settings that differ from the state of the instrument are sent: timings if the
+        exposure or delay changed, setroi if the region of interest of the camera changed.'''
+        with self._settings_lock:
+            timings = (settings.exposure_time_ms, settings.delay)
+            if timings != self._get_expected_timings():
+                self._requested_timings = timings
+                self.api_handler.send_command(TIMINGS_COMMAND.render(
+                    exposure=settings.exposure_time_ms, delayafter=settings.delay))
+            roi = (settings.top, settings.left, settings.width_pixels, settings.height_pixels)
+            if roi != self._get_expected_roi(settings.name):
+                self._requested_rois[settings.name] = roi
+                self.api_handler.publish(self.api_handler.main_topic + "/gui/datahub", SETROI_COMMAND.render(
+                    name=settings.name, top=settings.top, left=settings.left,
+                    width=settings.width_pixels, height=settings.height_pixels))
+
+    def _get_expected_timings(self) -> Optional[Tuple[float, float]]:
+        if self._requested_timings is not None:
+            return self._requested_timings
+        if self.acknowledged_timings:
+            return self.acknowledged_timings['exposure'], self.acknowledged_timings['delay']
+        return None
+
+    def _get_expected_roi(self, name: str) -> Optional[Tuple[int, int, int, int]]:
+        if name in self._requested_rois:
+            return self._requested_rois[name]
+        camera = self.cameras.get(name)
+        if camera is None:
+            return None
+        return camera.top, camera.left, camera.width_pixels, camera.height_pixels
+
+    def _update_camera(self, topic: str, payload_dict: dict):
+        data = payload_dict['data']
         if data['device'] == 'cameras':
             if 'mode' in data.keys() \
                     and data['mode']["value"] == 'area' \
@@ -749,47 +1710,135 @@ class Camera(interface.Camera):
                 left = ROIProperty(**data['roi']['left'])
                 width = ROIProperty(**data['roi']['width'])
                 height = ROIProperty(**data['roi']['height'])
-                self.cameras[data['name']] = CameraSettings(name=data['name'],
-                                                            top_props=top,
-                                                            left_props=left,
-                                                            width_props=width,
-                                                            height_props=height,
-                                                            top=top.value,
-                                                            left=left.value,
-                                                            width_pixels=width.value,
-                                                            height_pixels=height.value)
+                with self._settings_lock:
+                    self.cameras[data['name']] = CameraSettings(name=data['name'],
+                                                                top_props=top,
+                                                                left_props=left,
+                                                                width_props=width,
+                                                                height_props=height,
+                                                                top=top.value,
+                                                                left=left.value,
+                                                                width_pixels=width.value,
+                                                                height_pixels=height.value,
+                                                                **self.acknowledged_timings)
+                    self._requested_rois.pop(data['name'], None)
+                if self._expected_cameras.issubset(self.cameras):
+                    self._cameras_configured_event.set()
             if 'sn' in data.keys() and 'name' in data.keys():
                 self.serial_number_names[data['sn']] = data['name']
             if 'file_paths' in data.keys():
                 cam_name = self.serial_number_names[data['sn']]
-                self.file_paths[cam_name] = [Path(path_string) for path_string in data['file_paths']]
-                self._load_images()
-
-    def _update_exposure_settings(self, client, userdata, message):
-        payload_dict = json.loads(message.payload)
-        for camera in self.cameras.values():
-            camera.exposure_time_ms = payload_dict['data']['exposure']
-            camera.delay = payload_dict['data']['delay']
+                paths = [Path(path_string) for path_string in data['file_paths']]
+                with self._images_lock:
+                    result = self._current_result
+                if result is None:
+                    return
+                for path in paths:
+                    # reserve the slot in reply order, files can finish loading in any order
+                    index = result.add_file(cam_name, path)
+                    self._loader.submit(self._load_image, result, cam_name, index, path)
+
+    def _update_exposure_settings(self, topic: str, payload_dict: dict):
+        with self._settings_lock:
+            self.acknowledged_timings = {'exposure': payload_dict['data']['exposure'],
+                                         'delay': payload_dict['data']['delay']}
+            self._requested_timings = None
+            for camera in self.cameras.values():
+                camera.exposure_time_ms = payload_dict['data']['exposure']
+                camera.delay = payload_dict['data']['delay']
 
     def _get_current_path(self):
         self.api_handler.publish(self.api_handler.main_topic + "/gui/directory", json.dumps(self.file_command))
 
     def _send_capture_command(self):
-        command = {"type": "operation", "data": {"device": "execution", "command": "run", "state": True}}
-        self.api_handler.send_command(json.dumps(command))
-
-    def _load_images(self):
-        time.sleep(1)
-        for name, paths in self.file_paths.items():
-            self.current_images[name] = []
-            self.current_metadatas[name] = []
-            for path in paths:
-                print(path)
-                with h5py.File(path, 'r') as image:
-                    print(image)
-                    self.current_metadatas[name].append(json.loads(image['metadata'][()]))
-                    self.current_images[name].append(np.asarray(image['Data']))
-                self.has_new_image = True
+        self.api_handler.send_command(RUN_COMMAND)
+
+    def _run(self) -> Dict[str, List[np.ndarray]]:
+        '''Run the configured event and wait until the files of all stacks and cameras are loaded.'''
+        images = self._start_run().wait(self.new_image_timeout_ms / 1000.0)
+        self.new_image_event.clear()
+        return images
+
+    def _start_run(self) -> MultiViewResult:
+        self.new_image_event.clear()
+        result = MultiViewResult(self._get_expected_tasks(self.event_handler.get_task_order()))
+        self._check_storage(result.tasks)
+        with self._images_lock:
+            self._current_result = result
+            self.file_paths = result.file_paths
+            self.current_images = result.images
+            self.current_metadatas = result.metadatas
+            self._expected_tasks = result.tasks
+        self._send_capture_command()
+        return result
+
+    def _get_channel_cameras(self, channel_name: str = None) -> List[str]:
+        channel_name = channel_name or self.event_handler.active_channel
+        for channel in self.event_handler.channels.data:
+            if channel.name == channel_name:
+                return [device.name for device in channel.devices if device.type == 'cameras']
+        return []
+
+    def _get_expected_tasks(self, tasks: List[Tuple[str, str]]) -> Dict[str, List[Tuple[str, str]]]:
+        channel_cameras = {channel: self._get_channel_cameras(channel) for _, channel in tasks}
+        expected_tasks = {}
+        for stack_name, channel in tasks:
+            for camera_name in channel_cameras[channel]:
+                expected_tasks.setdefault(camera_name, []).append((stack_name, channel))
+        return expected_tasks
+
+    def _estimate_acquisition(self, expected_tasks: Dict[str, List[Tuple[str, str]]],
+                              stacks: Dict[str, Stack]) -> AcquisitionEstimate:
+        # the cameras record simultaneously, each one frame per exposure and delay
+        with self._settings_lock:
+            timings = self._get_expected_timings() or (self.settings.exposure_time_ms, self.settings.delay)
+            cameras = dict(self.cameras)
+        frame_period_s = sum(timings) / 1000.0
+        data_volume_bytes = 0
+        throughput_bytes_per_s = 0.0
+        duration_s = 0.0
+        for camera_name, tasks in expected_tasks.items():
+            settings = cameras.get(camera_name)
+            if settings is None:
+                continue
+            frame_bytes = settings.width_pixels * settings.height_pixels * self.bytes_per_pixel
+            n_frames = sum(stacks[stack_name].n * stacks[stack_name].reps for stack_name, _ in tasks)
+            data_volume_bytes += n_frames * frame_bytes
+            throughput_bytes_per_s += frame_bytes / frame_period_s
+            duration_s = max(duration_s, n_frames * frame_period_s)
+        return AcquisitionEstimate(data_volume_bytes=data_volume_bytes, throughput_bytes_per_s=throughput_bytes_per_s,
+                                   duration_s=duration_s)
+
+    def _check_storage(self, expected_tasks: Dict[str, List[Tuple[str, str]]]):
+        if self.storage_policy is None or self.disk is None or not self.disk.is_configured():
+            return
+        estimate = self._estimate_acquisition(
+            expected_tasks, {stack.name: stack for stack in self.event_handler.current_stacks})
+        if self.storage_policy == "select":
+            self.disk.select_source(self.disk.find_source(estimate, self.storage_margin).name)
+        else:
+            self.disk.check_source(self.disk.selected_source, estimate, self.storage_margin)
+
+    def _group_by_channel(self, images: Dict[str, List[np.ndarray]]) -> Dict[str, Dict[str, List[np.ndarray]]]:
+        '''Sort the images of a run, recorded in task order, by channel.'''
+        grouped_images = {}
+        for camera_name, tasks in self._expected_tasks.items():
+            camera_images = grouped_images.setdefault(camera_name, {})
+            for (_, channel), image in zip(tasks, images.get(camera_name, [])):
+                camera_images.setdefault(channel, []).append(image)
+        return grouped_images
+
+    def _load_image(self, result: MultiViewResult, name: str, index: int, path: Path):
+        try:
+            metadata = wait_until_file_is_ready(path, self.new_image_timeout_ms / 1000.0, self.file_poll_interval_s)
+            image = open_frame_stack(path)
+        except Exception as error:
+            warn(f"Could not load {path}: {error}")
+            result.set_error(name, error)
+            return
+        result.set_image(name, index, image, metadata)
+        if result is self._current_result and result.is_loaded():
+            self.new_image_event.set()
 
     def _get_config(self):
         command = {
@@ -800,9 +1849,248 @@ class Camera(interface.Camera):
             }
         }
         self.api_handler.send_command(json.dumps(command))
-        timeout = 10
-        while self.cameras == {} and timeout > 0:
-            time.sleep(0.1)
-            timeout -= 0.1
-        if timeout <= 0:
-            raise LuxendoAPIException("Timeout while waiting for camera configuration")
+        if not self._cameras_configured_event.wait(self.api_handler.reply_timeout_ms / 1000.0):
+            raise LuxendoTimeoutError("Timeout while waiting for camera configuration")
+
+
+class Microscope(interface.Microscope):
+    '''Luxendo TruLive3D microscope.
+
+    z-stacks and tiled acquisitions are compiled into a list of device-side stacks that the instrument
+    images in a single run, instead of moving the stage and starting a run for every plane and tile.
+    Images are returned per camera (view): {camera name: numpy.ndarray}.
+
+    All acquisition methods accept a list of channel names. The channels are then imaged in the same run
+    (one task per stack and channel) and the arrays get a channel axis in front of the z (or plane) axis,
+    e.g. (channel, z, y, x) for acquire_z_stack. Cameras that do not record all of the channels are left out.
+
+    methods:
+        acquire_image(channels) -> {camera name: array (channel, y, x)}
+        acquire_z_stack(z_range) -> {camera name: array (z, y, x)}
+        acquire_tiled_image(y_range, x_range) -> {camera name: array (tile, y, x)}
+        acquire_tiled_z_stack(z_range, y_range, x_range) -> {camera name: array (tile, z, y, x)}
+        acquire_sparse_tiled_image(mask) -> {camera name: SparseTileStore of arrays (y, x)}
+        acquire_overview_image(y_range, x_range, binning) -> {camera name: stitched and binned array (y, x)}
+        get_overview_geometry(y_range, x_range, binning) -> (pixel size in µm, (y, x) origin in µm)
+        get_metadata()
+        close()
+
+    The microscope can be used as a context manager that closes it on exit.
+    '''
+    capabilities = MicroscopeCapabilities(
+        supports_roi=True,
+        hardware_z_stack=True,
+        hardware_tiling=True,
+        multi_channel=True,
+        multi_view=True)
+
+    def __init__(self, camera: Camera, stage: Stage, objective: Objective, objectives: List[Objective] = None):
+        super().__init__(camera, stage, objective, objectives)
+        # Camera.take_snapshot only reads a live stream if the camera has one, otherwise it runs a full acquisition
+        if camera.live_preview is not None:
+            self.capabilities = self.capabilities.copy(update={'live_preview': True})
+
+    def close(self):
+        '''Stop the threads of the camera and disconnect from the instrument.'''
+        self.camera.close()
+        self.camera.api_handler.close()
+
+    def __enter__(self) -> 'Microscope':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def acquire_image(self, channels: List[str] = None):
+        if channels is None:
+            return super().acquire_image()
+        images = self._acquire_stacks([self._get_stack("stack_0")], channels)
+        return {name: camera_images[0, :, 0] for name, camera_images in images.items()}
+
+    def acquire_z_stack(self, z_range: tuple = (), channels: List[str] = None) -> Dict[str, np.ndarray]:
+        stacks = [self._get_stack("stack_0", z_range)]
+        if channels is None:
+            # a single stack is returned as opened, i.e. memory-mapped
+            images = self.camera.capture_stacks(stacks)
+        else:
+            images = self._acquire_stacks(stacks, channels)
+        return {name: camera_images[0] for name, camera_images in images.items()}
+
+    def acquire_tiled_image(self, y_range: tuple = (), x_range: tuple = (), channels: List[str] = None
+                            ) -> Dict[str, np.ndarray]:
+        images = self._acquire_tiled(None, y_range, x_range, channels)
+        return {name: np.take(camera_images, 0, axis=-3) for name, camera_images in images.items()}
+
+    def acquire_tiled_z_stack(self, z_range: tuple = (), y_range: tuple = (), x_range: tuple = (),
+                              channels: List[str] = None) -> Dict[str, np.ndarray]:
+        return self._acquire_tiled(z_range, y_range, x_range, channels)
+
+    def acquire_overview_image(self, y_range: tuple = (), x_range: tuple = (), binning: int = 8
+                               ) -> Dict[str, np.ndarray]:
+        '''Acquire a tiled image in one run and stitch it into one binned overview image per camera.
+
+        The instrument has no overview camera. The tiles are binned by averaging binning x binning pixels and
+        placed at their stage positions, overlapping tiles are max-projected. get_overview_geometry returns the
+        pixel size and the position of the overview, e.g. to pass a mask of it to acquire_sparse_tiled_image.
+
+        Args:
+            y_range, x_range: see acquire_tiled_image, default: the entire stage range
+            binning: number of pixels along y and x that are averaged into one overview pixel
+        '''
+        y_positions, x_positions = self.get_scan_positions(y_range, x_range)
+        pixel_size_um, origin_um = self.get_overview_geometry(y_range, x_range, binning)
+        images = self.acquire_tiled_image(y_range, x_range)
+        return {name: self._stitch_tiles(tiles, y_positions, x_positions, pixel_size_um, origin_um, binning)
+                for name, tiles in images.items()}
+
+    def get_overview_geometry(self, y_range: tuple = (), x_range: tuple = (), binning: int = 8
+                              ) -> Tuple[float, np.ndarray]:
+        '''Return the pixel size in µm and the (y, x) stage position in µm of the top left corner of the overview
+        image that acquire_overview_image(y_range, x_range, binning) returns.'''
+        y_positions, x_positions = self.get_scan_positions(y_range, x_range)
+        origin_um = np.asarray((y_positions.min(), x_positions.min())) - self.get_field_of_view_um() / 2
+        return self.get_sample_pixel_size_um() * binning, origin_um
+
+    def get_metadata(self) -> dict:
+        '''Get metadata of the microscope and the metadata of the last acquired files.'''
+        return {
+            'camera': {
+                'pixel_size': self.camera.pixel_size_um,
+                'width': self.camera.width_pixels,
+                'height': self.camera.height_pixels,
+                'settings': self.camera.settings,
+                'image_shape': self.camera.image_shape,
+                'files': self.camera.current_metadatas,
+            },
+            'stage': {
+                'x_range': self.stage.x_range,
+                'y_range': self.stage.y_range,
+                'z_range': self.stage.z_range
+            },
+            'objective': {
+                'magnification': self.objective.magnification,
+                'working_distance': self.objective.working_distance,
+                'numerical_aperture': self.objective.numerical_aperture,
+                'immersion': self.objective.immersion
+            },
+        }
+
+    def acquire_sparse_tiled_image(self, mask: np.ndarray, mask_pixel_size_um: float = None,
+                                   mask_origin_um: tuple = (0, 0), y_range: tuple = (), x_range: tuple = (),
+                                   channels: List[str] = None) -> Dict[str, SparseTileStore]:
+        y_positions, x_positions, grid_indices, grid_shape = self.get_mask_scan_positions(
+            mask, mask_pixel_size_um, mask_origin_um, y_range, x_range)
+        positions_um = np.stack([y_positions, x_positions], axis=1)
+        if len(positions_um) == 0:
+            return {name: SparseTileStore(grid_shape, grid_indices, positions_um, self._get_empty_tiles(name, channels))
+                    for name in self._get_cameras_of_channels(channels)}
+        images = self._acquire_tiles(None, y_positions, x_positions, channels)
+        return {name: SparseTileStore(grid_shape, grid_indices, positions_um, np.take(camera_images, 0, axis=-3))
+                for name, camera_images in images.items()}
+
+    def _acquire_tiled(self, z_range: tuple = None, y_range: tuple = (), x_range: tuple = (),
+                       channels: List[str] = None) -> Dict[str, np.ndarray]:
+        return self._acquire_tiles(z_range, *self.get_scan_positions(y_range, x_range), channels)
+
+    def _acquire_tiles(self, z_range: tuple, y_positions: np.ndarray, x_positions: np.ndarray,
+                       channels: List[str] = None) -> Dict[str, np.ndarray]:
+        '''Image all tile positions in one run.'''
+        stacks = [self._get_stack(f"stack_{index}", z_range, y, x)
+                  for index, (y, x) in enumerate(zip(y_positions, x_positions))]
+        return self._acquire_stacks(stacks, channels)
+
+    def _acquire_stacks(self, stacks: List[Stack], channels: List[str] = None) -> Dict[str, np.ndarray]:
+        '''Image the stacks in one run and return {camera name: array (stack, [channel,] z, y, x)}.'''
+        if channels is None:
+            images = self.camera.capture_stacks(stacks)
+            return {name: np.asarray(camera_images) for name, camera_images in images.items()}
+        channel_images = self.camera.capture_stacks(stacks, channels)
+        images = {}
+        for name, images_by_channel in channel_images.items():
+            missing_channels = [channel for channel in channels if channel not in images_by_channel]
+            if missing_channels:
+                warn(f"Camera {name} does not record channels {missing_channels}, its images are left out.")
+                continue
+            images[name] = np.stack([np.asarray(images_by_channel[channel]) for channel in channels], axis=1)
+        return images
+
+    def _get_cameras_of_channels(self, channels: List[str] = None) -> List[str]:
+        '''Return the cameras that record all channels, default: the cameras of the active channel.'''
+        if channels is None:
+            return self.camera._get_channel_cameras()
+        cameras_of_channels = [self.camera._get_channel_cameras(channel) for channel in channels]
+        return [name for name in cameras_of_channels[0] if all(name in cameras for cameras in cameras_of_channels)]
+
+    def _get_empty_tiles(self, name: str, channels: List[str] = None) -> np.ndarray:
+        '''Return an array without tiles with the shape of the tiles of a camera, see acquire_sparse_tiled_image.'''
+        settings = self.camera.cameras[name]
+        channel_shape = () if channels is None else (len(channels),)
+        return np.empty((0,) + channel_shape + (settings.height_pixels, settings.width_pixels), dtype=np.uint16)
+
+    @staticmethod
+    def _stitch_tiles(tiles: np.ndarray, y_positions: np.ndarray, x_positions: np.ndarray, pixel_size_um: float,
+                      origin_um: np.ndarray, binning: int) -> np.ndarray:
+        '''Bin tiles (tile, y, x) that are centred at the stage positions and max-project them into one image.'''
+        tiles = np.asarray(tiles)
+        height, width = tiles.shape[-2] // binning, tiles.shape[-1] // binning
+        binned = tiles[:, :height * binning, :width * binning].reshape(
+            len(tiles), height, binning, width, binning).mean(axis=(2, 4)).astype(tiles.dtype)
+        tops = np.round((y_positions - origin_um[0]) / pixel_size_um - tiles.shape[-2] / binning / 2).astype(int)
+        lefts = np.round((x_positions - origin_um[1]) / pixel_size_um - tiles.shape[-1] / binning / 2).astype(int)
+        tops, lefts = np.maximum(tops, 0), np.maximum(lefts, 0)
+        overview = np.zeros((tops.max() + height, lefts.max() + width), dtype=tiles.dtype)
+        for tile, top, left in zip(binned, tops, lefts):
+            region = overview[top:top + height, left:left + width]
+            np.maximum(region, tile, out=region)
+        return overview
+
+    def _get_stack(self, name: str, z_range: tuple = None, y_position_um: float = None,
+                   x_position_um: float = None) -> Stack:
+        '''Compile a z-range (see interface.Microscope.acquire_z_stack) and a tile position into a stack.'''
+        axis_ranges = {}
+        n = 1
+        if z_range is not None:
+            z_range = self._set_range(z_range, default_range=self.stage.z_range + (1,))
+            z_positions = np.arange(z_range[0], z_range[1], z_range[2])
+            if len(z_positions) == 0:
+                raise ValueError(f"The z range {tuple(z_range)} contains no z positions, start must be below stop "
+                                 "for a positive step")
+            axis_ranges['z'] = (float(z_positions[0]), float(z_positions[-1]))
+            n = len(z_positions)
+        if y_position_um is not None:
+            axis_ranges['y'] = (float(y_position_um), float(y_position_um))
+        if x_position_um is not None:
+            axis_ranges['x'] = (float(x_position_um), float(x_position_um))
+        return self.stage.get_stack(name, n=n, **axis_ranges)
+
+
+def microscope_factory(broker_address: str = "localhost", broker_port: int = 1883, serial_number: str = "",
+                       reply_timeout_ms: float = 10000, mqtt_client=None, new_image_timeout_ms: float = 60000,
+                       file_poll_interval_s: float = 0.01, storage_policy: str = "validate",
+                       live_preview_url: str = None, objective_magnification=20, objective_working_distance=2.0,
+                       objective_numerical_aperture=1.0, objective_immersion="water"):
+    '''Connect to a Luxendo TruLive3D microscope and create a microscope object.
+
+    Args:
+        broker_address, broker_port, serial_number, reply_timeout_ms, mqtt_client:
+            see LuxendoAPIHandler
+        new_image_timeout_ms, file_poll_interval_s, storage_policy, live_preview_url:
+            see Camera
+        objective_magnification, objective_working_distance, objective_numerical_aperture, objective_immersion:
+            detection objective
+    '''
+    api_handler = LuxendoAPIHandler(broker_address=broker_address, broker_port=broker_port,
+                                    serial_number=serial_number, reply_timeout_ms=reply_timeout_ms,
+                                    mqtt_client=mqtt_client)
+    api_handler.ensure_connection()
+    stage = Stage(api_handler)
+    camera = Camera(api_handler, stage, DiskConfig(api_handler), new_image_timeout_ms=new_image_timeout_ms,
+                    file_poll_interval_s=file_poll_interval_s, storage_policy=storage_policy,
+                    live_preview_url=live_preview_url)
+    objective = Objective(
+        name=f"{objective_magnification}x {objective_immersion}",
+        magnification=objective_magnification,
+        working_distance=objective_working_distance,
+        numerical_aperture=objective_numerical_aperture,
+        immersion=objective_immersion)
+    return Microscope(camera, stage, objective)
@@ -1,22 +1,178 @@
+'''Registry and factory for microscope adapters.
+
+Adapters are discovered through the "microscope_gym.adapters" entry point group. Each entry
+point names an adapter module that provides a Microscope class and a microscope_factory()
+function. The adapters that ship with microscope_gym are always available, even if the
+package is not installed.
+
+Resolved adapters are cached, so creating further microscopes does not re-import or re-probe
+the adapter module.
+'''
 import importlib
+import threading
+from typing import Dict, FrozenSet, List
+
+from microscope_gym.interface import Camera, MicroscopeCapabilities, Objective, Stage
+
+COMPONENT_CLASSES = (Camera, Stage, Objective)
+
+ENTRY_POINT_GROUP = "microscope_gym.adapters"
+BUILTIN_ADAPTERS = {
+    "mock_scope": "microscope_gym.microscope_adapters.mock_scope",
+    "luxendo_trulive3d": "microscope_gym.microscope_adapters.luxendo_trulive3d",
+}
+
+
+def _discover_entry_points(group: str) -> dict:
+    '''Return {name: module name} of all adapters registered for the entry point group.'''
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        return {}
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, "select"):
+        selected = all_entry_points.select(group=group)
+    else:  # Python < 3.10
+        selected = all_entry_points.get(group, [])
+    return {entry_point.name: entry_point.value for entry_point in selected}
+
+
+class Adapter:
+    '''Resolved microscope adapter.
+
+    properties:
+        name: str
+            name under which the adapter is registered
+        module: module
+            the imported adapter module
+        microscope_class: type
+            Microscope class of the adapter
+        capabilities: MicroscopeCapabilities
+            capabilities that every microscope of the adapter has, an instance can have more
+            (see interface.Microscope.capabilities)
+        components: frozenset[str]
+            names of the interface components the adapter provides classes for, e.g. 'Camera' or 'Stage'
+    '''
+
+    def __init__(self, name: str, module):
+        self.name = name
+        self.module = module
+        self.microscope_class = module.Microscope
+        self.capabilities: MicroscopeCapabilities = self.microscope_class.capabilities
+        classes = [value for value in vars(module).values() if isinstance(value, type)]
+        self.components: FrozenSet[str] = frozenset(
+            component_class.__name__ for component_class in COMPONENT_CLASSES
+            if any(issubclass(value, component_class) for value in classes))
+        self._factory = getattr(module, "microscope_factory", None)
+
+    def supports(self, component: str) -> bool:
+        return component in self.components
+
+    def create_microscope(self, components: dict = None, **kwargs):
+        '''Create a microscope instance.
+
+        Args:
+            components: dict
+                Keys are component names that the adapter must support, values are
+                component-specific keyword arguments for the adapter's microscope_factory().
+            kwargs:
+                further keyword arguments for the adapter's microscope_factory().
+
+        Each keyword argument can only be given once, by one component or in kwargs.
+        '''
+        configurations = {}
+        for component, configuration in (components or {}).items():
+            if not self.supports(component):
+                raise AttributeError(f"Adapter {self.name} does not support {component}.")
+            configurations[component] = configuration or {}
+        configurations["kwargs"] = kwargs
+        factory_kwargs = {}
+        given_by = {}
+        for source, configuration in configurations.items():
+            for key, value in configuration.items():
+                if key in given_by:
+                    raise ValueError(f"Keyword argument {key} is given by both {given_by[key]} and {source}.")
+                factory_kwargs[key] = value
+                given_by[key] = source
+        if self._factory is None:
+            raise AttributeError(f"Adapter {self.name} does not provide a microscope_factory.")
+        return self._factory(**factory_kwargs)
 
+    def __repr__(self):
+        return f"Adapter(name={self.name!r}, module={self.module.__name__!r})"
 
-def microscope_factory(adapter_name: str, components: dict):
+
+class AdapterRegistry:
+    '''Cache of microscope adapters discovered through entry points.
+
+    methods:
+        available_adapters() -> list[str]
+        register(name, module_name)
+        get_adapter(name) -> Adapter
+        get_capabilities(name) -> MicroscopeCapabilities
+        create_microscope(name, components, **kwargs) -> Microscope
+    '''
+
+    def __init__(self, group: str = ENTRY_POINT_GROUP):
+        self.group = group
+        self._module_names: Dict[str, str] = None
+        self._adapters: Dict[str, Adapter] = {}
+        self._lock = threading.RLock()
+
+    def available_adapters(self) -> List[str]:
+        return sorted(self._get_module_names())
+
+    def register(self, name: str, module_name: str) -> None:
+        '''Register an adapter module under a name, replacing a previously resolved adapter.'''
+        with self._lock:
+            self._get_module_names()[name] = module_name
+            self._adapters.pop(name, None)
+
+    def get_adapter(self, name: str) -> Adapter:
+        '''Return the adapter registered under name.
+
+        For backwards compatibility, name can also be the module name of an adapter that is
+        not registered.'''
+        adapter = self._adapters.get(name)
+        if adapter is not None:
+            return adapter
+        with self._lock:
+            if name not in self._adapters:
+                module_name = self._get_module_names().get(name, name)
+                self._adapters[name] = Adapter(name, importlib.import_module(module_name))
+            return self._adapters[name]
+
+    def get_capabilities(self, name: str) -> MicroscopeCapabilities:
+        return self.get_adapter(name).capabilities
+
+    def create_microscope(self, name: str, components: dict = None, **kwargs):
+        return self.get_adapter(name).create_microscope(components, **kwargs)
+
+    def _get_module_names(self) -> Dict[str, str]:
+        with self._lock:
+            if self._module_names is None:
+                module_names = dict(BUILTIN_ADAPTERS)
+                module_names.update(_discover_entry_points(self.group))
+                self._module_names = module_names
+            return self._module_names
+
+
+registry = AdapterRegistry()
+
+
+def microscope_factory(adapter_name: str, components: dict = None, **kwargs):
     '''Factory for microscope adapters.
 
     Args:
         adapter_name: str
-            Module name of the adapter to use.
+            Name of a registered adapter (e.g. 'mock_scope') or module name of the adapter to use.
         components: dict
             Dictionary of components to use. Keys are component names, values are
             component-specific configuration dictionaries.
+        kwargs:
+            Further keyword arguments passed on to the adapter's microscope_factory().
 
     Returns:
         Microscope instance
         '''
-
-    adapter_module = importlib.import_module(adapter_name)
-    for component in components:
-        if not hasattr(adapter_module, component):
-            raise AttributeError(f"Adapter {adapter_name} does not support {component}.")
-    return adapter_module.Microscope(components)
+    return registry.create_microscope(adapter_name, components, **kwargs)
@@ -3,7 +3,7 @@ from pydantic import create_model
 import numpy as np
 import time
 from microscope_gym import interface
-from microscope_gym.interface import Objective, CameraSettings
+from microscope_gym.interface import Objective, CameraSettings, MicroscopeCapabilities
 
 
 class Axis(interface.stage.Axis):
@@ -68,20 +68,50 @@ class Camera(interface.Camera):
             Camera settings.
         overview_image(): numpy.ndarray
             Overview image of the sample. In order to conform with the image dimensions commonly used in microscopy, the overview image should be a 3D array with dimensions (z, y, x).
+        objective: Objective
+            Objective in use, set by the Microscope. The overview image is sampled at one pixel per µm of stage movement with the
+            first objective of the microscope (reference_objective). Images of other objectives are resampled from it according to
+            their magnification and calibration offset, so all objectives image the same sample.
     '''
 
     def __init__(self, settings: interface.CameraSettings, overview_image, stage: Stage):
         self._settings = settings
         self.overview_image = overview_image
         self.stage = stage
+        self.objective: Objective = None
+        self.reference_objective: Objective = None
 
     def capture_image(self) -> np.ndarray:
         '''Capture image the current stage position.'''
         z, y, x = self.stage.z_position_um, self.stage.y_position_um, self.stage.x_position_um
+        if self.objective is not None and self.objective != self.reference_objective:
+            scale = self.reference_objective.magnification / self.objective.magnification
+            offset = np.subtract(self.objective.calibration_offset_um, self.reference_objective.calibration_offset_um)
+            return self._capture_resampled(int(z), y + offset[0], x + offset[1], scale)
         y_offset = self.height_pixels / 2
         x_offset = self.width_pixels / 2
         return self.overview_image[int(z), int(y - y_offset):int(y + y_offset), int(x - x_offset):int(x + x_offset)]
 
+    def _capture_resampled(self, z: int, y: float, x: float, scale: float) -> np.ndarray:
+        '''Sample the overview image with pixels of scale overview pixels centred at (y, x).'''
+        from scipy import ndimage
+        # overview coordinates of the pixel centres, for scale 1 these are the pixels of capture_image
+        rows = y - self.height_pixels * scale / 2 + (np.arange(self.height_pixels) + 0.5) * scale - 0.5
+        columns = x - self.width_pixels * scale / 2 + (np.arange(self.width_pixels) + 0.5) * scale - 0.5
+        margin = int(np.ceil(scale)) + 1
+        top = max(int(np.floor(rows[0])) - margin, 0)
+        left = max(int(np.floor(columns[0])) - margin, 0)
+        region = self.overview_image[z, top:int(np.ceil(rows[-1])) + margin + 1,
+                                     left:int(np.ceil(columns[-1])) + margin + 1].astype(float)
+        if scale > 1:
+            # integrate over the area of the larger pixels
+            region = ndimage.uniform_filter(region, size=int(round(scale)))
+        coordinates = np.meshgrid(rows - top, columns - left, indexing='ij')
+        image = ndimage.map_coordinates(region, coordinates, order=1, mode='constant', cval=0.0)
+        if np.issubdtype(self.overview_image.dtype, np.integer):
+            image = np.rint(image)
+        return image.astype(self.overview_image.dtype)
+
     def configure_camera(self, settings: interface.CameraSettings) -> None:
         self._settings = settings
 
@@ -93,12 +123,22 @@ class Microscope(interface.Microscope):
         move_stage(z, y, x)
         capture_image()
         get_metadata()
+        switch_objective(name)
 
     properties:
         camera(): Camera object
         stage(): Stage object
         objective(): Objective object
+        objectives: {name: Objective}
     '''
+    capabilities = MicroscopeCapabilities(objective_switching=True)
+
+    def __init__(self, camera: Camera, stage: Stage, objective: Objective, objectives: List[Objective] = None):
+        super().__init__(camera, stage, objective, objectives)
+        camera.objective = camera.reference_objective = objective
+
+    def _change_objective(self, objective: Objective):
+        self.camera.objective = objective
 
     def get_metadata(self):
         '''Get metadata of the microscope.
@@ -138,8 +178,9 @@ class Microscope(interface.Microscope):
         return self.camera.overview_image
 
 
-def microscope_factory(overview_image=np.random.normal(size=(10, 1024, 1024)), camera_pixel_size=1, camera_height_pixels=512, camera_width_pixels=512, settings={},
-                       objective_magnification=1, objective_working_distance=0.29, objective_numerical_aperture=0.95, objective_immersion="air"):
+def microscope_factory(overview_image=None, camera_pixel_size=1, camera_height_pixels=512, camera_width_pixels=512, settings={},
+                       objective_magnification=1, objective_working_distance=0.29, objective_numerical_aperture=0.95, objective_immersion="air",
+                       additional_objectives: List[Objective] = None):
     '''Create a microscope object.
 
     Args:
@@ -152,8 +193,12 @@ def microscope_factory(overview_image=np.random.normal(size=(10, 1024, 1024)), c
         settings: dict
             camera settings
         overview_image: np.ndarray
-            overview image
+            overview image, defaults to random noise of shape (10, 1024, 1024)
+        additional_objectives: list of Objective
+            objectives to switch to with Microscope.switch_objective, they image the same overview image (see Camera)
     '''
+    if overview_image is None:
+        overview_image = np.random.normal(size=(10, 1024, 1024))
 
     # makes sure that the overview image has at least 3 dimensions
     while overview_image.ndim < 3:
@@ -184,4 +229,4 @@ def microscope_factory(overview_image=np.random.normal(size=(10, 1024, 1024)), c
         working_distance=objective_working_distance,
         numerical_aperture=objective_numerical_aperture,
         immersion=objective_immersion)
-    return Microscope(camera, stage, objective)
+    return Microscope(camera, stage, objective, additional_objectives)
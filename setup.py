@@ -8,8 +8,14 @@ setuptools.setup(
     license="BSD-3-Clause",
     packages=setuptools.find_packages(exclude=["docs"]),
     include_package_data=True,
-    install_requires=["numpy", "pyclesperanto_prototype>=0.24.0", "apoc", "paho-mqtt", "pydantic", "h5py"],
+    install_requires=["numpy", "scipy", "pyclesperanto_prototype>=0.24.0", "apoc", "paho-mqtt", "pydantic", "h5py"],
     python_requires=">=3.7",
+    entry_points={
+        "microscope_gym.adapters": [
+            "mock_scope = microscope_gym.microscope_adapters.mock_scope",
+            "luxendo_trulive3d = microscope_gym.microscope_adapters.luxendo_trulive3d",
+        ],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: BSD License",
@@ -0,0 +1,20 @@
+import pytest
+from microscope_gym.microscope_adapters.luxendo_emulator import LocalBroker, TruLive3DEmulator
+from microscope_gym.microscope_adapters.luxendo_trulive3d import LuxendoAPIHandler
+
+
+@pytest.fixture
+def emulator(tmp_path):
+    broker = LocalBroker(latency_ms=1, jitter_ms=1, seed=0)
+    emulator = TruLive3DEmulator(broker.client(), data_directory=tmp_path, time_scale=0)
+    emulator.start()
+    yield emulator
+    emulator.stop()
+
+
+@pytest.fixture
+def api_handler(emulator):
+    api_handler = LuxendoAPIHandler(serial_number=emulator.serial_number,
+                                    mqtt_client=emulator.client.broker.client(), reply_timeout_ms=2000)
+    yield api_handler
+    api_handler.close()
@@ -0,0 +1,62 @@
+'''Import-time regression tests.
+
+Each module is imported in a fresh interpreter with `python -X importtime`. Heavy
+dependencies must not be imported until a feature or adapter actually uses them and
+the cumulative import time must stay within budget. The budget can be adjusted for
+slow machines with the MICROSCOPE_GYM_IMPORT_BUDGET_MS environment variable.
+'''
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+REPOSITORY_ROOT = Path(__file__).resolve().parents[1]
+IMPORT_BUDGET_MS = float(os.environ.get("MICROSCOPE_GYM_IMPORT_BUDGET_MS", 1000))
+HEAVY_MODULES = ("pyclesperanto_prototype", "pyopencl", "apoc", "sklearn", "skimage", "paho", "h5py")
+LIGHTWEIGHT_MODULES = [
+    "microscope_gym.interface",
+    "microscope_gym.features",
+    "microscope_gym.features.smart_object_finder",
+    "microscope_gym.features.canny_edge_detector",
+    "microscope_gym.features.label_backends",
+    "microscope_gym.features.tile_segmentation",
+    "microscope_gym.features.object_index",
+    "microscope_gym.features.tile_prescreen",
+    "microscope_gym.features.overview_workflow",
+    "microscope_gym.microscope_adapters",
+    "microscope_gym.microscope_adapters.microscope_factory",
+    "microscope_gym.microscope_adapters.mock_scope",
+    "microscope_gym.microscope_adapters.luxendo_trulive3d",
+    "microscope_gym.microscope_adapters.luxendo_emulator",
+    "microscope_gym.microscope_adapters.luxendo_live_preview",
+    "microscope_gym.microscope_adapters.luxendo_recorder",
+    "microscope_gym.microscope_adapters.luxendo_replay",
+]
+
+
+def get_import_times(module: str) -> dict:
+    '''Import module in a fresh interpreter and return {module name: cumulative import time in ms}.'''
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPOSITORY_ROOT, capture_output=True, text=True, check=True)
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        import_times[name.strip()] = int(cumulative_us) / 1000.0
+    return import_times
+
+
+@pytest.mark.parametrize("module", LIGHTWEIGHT_MODULES)
+def test_heavy_dependencies_are_not_imported(module):
+    imported_packages = {name.split(".")[0] for name in get_import_times(module)}
+    assert imported_packages.isdisjoint(HEAVY_MODULES), \
+        f"importing {module} imports {sorted(imported_packages.intersection(HEAVY_MODULES))}"
+
+
+@pytest.mark.parametrize("module", LIGHTWEIGHT_MODULES)
+def test_import_time_budget(module):
+    import_time_ms = get_import_times(module)[module]
+    assert import_time_ms < IMPORT_BUDGET_MS, \
+        f"importing {module} took {import_time_ms:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)"
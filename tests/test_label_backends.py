@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from microscope_gym.features.label_backends import ClesperantoBackend, NumpyBackend, get_label_backend
+from microscope_gym.features.smart_object_finder import SmartObjectFinder
+
+
+@pytest.fixture
+def label_image():
+    labels = np.zeros((40, 50), dtype=np.uint32)
+    labels[2:8, 2:8] = 1
+    labels[2:8, 8:12] = 4  # touches label 1
+    labels[20:23, 30:33] = 2
+    labels[30:38, 5:15] = 3
+    labels[30:38, 15:18] = 5  # touches label 3
+    labels[12:13, 40:41] = 6
+    intensities = np.arange(labels.size, dtype=np.float32).reshape(labels.shape) % 17
+    return intensities, labels
+
+
+class ThresholdSegmenter:
+    def predict(self, features, image):
+        rows, columns = np.indices(image.shape)
+        return (np.asarray(image) > 0).astype(np.uint32) * (1 + (columns >= 10) + 2 * (rows >= 12))
+
+
+def test_numpy_backend(label_image):
+    intensities, labels = label_image
+    backend = get_label_backend("numpy")
+    merged = backend.merge_touching_labels(labels)
+    assert merged.max() == 4
+    assert len(np.unique(merged[labels == 1])) == 1 and np.all(merged[labels == 4] == merged[2, 2])
+    filtered = backend.exclude_labels_outside_size_range(merged, minimum_size=5, maximum_size=100)
+    assert sorted(np.bincount(filtered.ravel())[1:]) == [9, 60]
+    centroids = backend.centroids_of_labels(filtered)
+    assert centroids.shape == (2, 2)
+    statistics = backend.statistics_of_labelled_pixels(intensities, filtered)
+    assert list(statistics['label']) == [1, 2]
+    index = int(np.argmax(statistics['area']))
+    assert statistics['centroid_x'][index] == pytest.approx(6.5)
+    assert statistics['centroid_y'][index] == pytest.approx(4.5)
+    assert statistics['sum_intensity'][index] == pytest.approx(intensities[filtered == index + 1].sum())
+    assert statistics['standard_deviation_intensity'][index] == pytest.approx(intensities[filtered == index + 1].std())
+    with pytest.raises(ValueError):
+        get_label_backend("cupy")
+
+
+def test_backends_agree(label_image):
+    pytest.importorskip("pyclesperanto_prototype")
+    intensities, labels = label_image
+    results = []
+    for backend in (ClesperantoBackend(), NumpyBackend()):
+        merged = np.asarray(backend.merge_touching_labels(labels))
+        filtered = np.asarray(backend.exclude_labels_outside_size_range(merged, minimum_size=5, maximum_size=100))
+        results.append((merged, filtered, backend.centroids_of_labels(filtered),
+                        backend.statistics_of_labelled_pixels(intensities, filtered)))
+    (merged, filtered, centroids, statistics), expected = results[1], results[0]
+    np.testing.assert_array_equal(merged, expected[0])
+    np.testing.assert_array_equal(filtered, expected[1])
+    np.testing.assert_allclose(centroids, expected[2], rtol=1e-5)
+    for key in ('area', 'min_intensity', 'max_intensity', 'sum_intensity', 'mean_intensity',
+                'standard_deviation_intensity', 'centroid_x', 'centroid_y', 'mass_center_x', 'mass_center_y'):
+        np.testing.assert_allclose(statistics[key], expected[3][key], rtol=1e-4, err_msg=key)
+
+
+def test_smart_object_finder_with_numpy_backend():
+    image = np.zeros((20, 20))
+    image[5:9, 4:14] = 1.0
+    image[14:16, 2:4] = 2.0
+    finder = SmartObjectFinder(None, ThresholdSegmenter(), "", backend="numpy")
+    segmentation = finder.find_objects_in_image(image, object_size_range=(5, 100))
+    assert segmentation.max() == 1
+    np.testing.assert_allclose(finder.find_centroids(segmentation), [[6.5, 8.5]])
+    assert finder.find_best_centroid(image, segmentation) == pytest.approx((6.5, 8.5))
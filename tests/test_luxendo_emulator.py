@@ -0,0 +1,86 @@
+import json
+import time
+import numpy as np
+import pytest
+from microscope_gym.microscope_adapters.luxendo_emulator import LocalBroker, DEFAULT_LOG_PATH
+from microscope_gym.microscope_adapters.luxendo_recorder import parse_log_time, load_luxendo_log
+from microscope_gym.microscope_adapters.luxendo_trulive3d import (
+    Stage, StackConfig, EventConfig, ChannelConfig, DiskConfig, Camera, topic_matches)
+
+
+def test_topic_matches():
+    assert topic_matches("a/b", "a/b")
+    assert not topic_matches("a/b", "a/bc")
+    assert topic_matches("a/+/c", "a/b/c")
+    assert not topic_matches("a/+/c", "a/b/d/c")
+    assert topic_matches("a/#", "a")
+    assert topic_matches("a/#", "a/b/c")
+    assert topic_matches("#", "a/b")
+
+
+def test_parse_log_time():
+    assert parse_log_time("25/04/2023, 08:57:10.14") - parse_log_time("25/04/2023, 08:57:10.0") == pytest.approx(0.014, abs=1e-6)
+    entries = load_luxendo_log(DEFAULT_LOG_PATH)
+    times = [parse_log_time(entry['time']) for entry in entries]
+    assert times == sorted(times)
+
+
+def test_broker_latency():
+    broker = LocalBroker(latency_ms=50)
+    receiver = broker.client()
+    received = []
+    receiver.on_message = lambda client, userdata, message: received.append((time.time(), message.payload))
+    receiver.connect()
+    receiver.subscribe("test/#")
+    receiver.loop_start()
+    published = time.time()
+    broker.client().publish("test/topic", json.dumps({"a": 1}))
+    broker.client().publish("other/topic", "ignored")
+    time.sleep(0.2)
+    receiver.loop_stop()
+    assert len(received) == 1
+    assert received[0][0] - published >= 0.05
+    assert json.loads(received[0][1]) == {"a": 1}
+
+
+def test_stage_moves(api_handler):
+    stage = Stage(api_handler)
+    assert list(stage.axes.keys()) == ['x', 'y', 'z', 'cr']
+    stage.x_position_um = 100.0
+    assert stage.wait_until_stopped(1000)
+    assert stage.x_position_um == 100.0
+
+
+def test_config_lists(api_handler):
+    stage = Stage(api_handler)
+    stacks = StackConfig(api_handler)
+    n_stacks = len(stacks.data)
+    new_stack = stage.add_current_position_to_stacks(stacks)
+    assert [stack.name for stack in stacks.data][-1] == new_stack.name
+    stacks.remove_api_generated_elements()
+    assert len(stacks.data) == n_stacks
+
+    events = EventConfig(api_handler)
+    events.add_element()
+    assert events.data[-1].tasks == []
+    events.remove_element(events.data[-1].name)
+
+    channels = ChannelConfig(api_handler)
+    assert channels.data[0].name == "channel_0"
+
+    disk = DiskConfig(api_handler)
+    assert disk.data.selectedsource == "LocalRaid"
+
+
+def test_camera_capture_image(emulator, api_handler):
+    stage = Stage(api_handler)
+    camera = Camera(api_handler, stage, DiskConfig(api_handler))
+    assert set(camera.cameras) == {'long', 'short'}
+    events_before = [event.name for event in camera.event_handler.events.data]
+
+    images = camera.capture_image()
+    emulator.wait_until_idle()
+    assert images['long'][0].shape == (1, 2304, 2304)
+    assert images['long'][0].dtype == np.uint16
+    # the user configuration is restored after the acquisition
+    assert [event.name for event in camera.event_handler.events.data] == events_before
@@ -0,0 +1,76 @@
+import json
+import pytest
+from microscope_gym.microscope_adapters.luxendo_emulator import TruLive3DEmulator
+from microscope_gym.microscope_adapters.luxendo_recorder import (
+    MessageRecorder, load_luxendo_log, parse_log_time, format_log_time, command_latencies, summarize_latencies,
+    format_summary, main)
+from microscope_gym.microscope_adapters.luxendo_trulive3d import LuxendoAPIHandler, Stage, StackConfig, Camera, DiskConfig
+
+
+def test_format_log_time():
+    timestamp = parse_log_time("25/04/2023, 08:57:10.14")
+    assert format_log_time(timestamp) == "25/04/2023, 08:57:10.14"
+    assert parse_log_time(format_log_time(timestamp + 0.9996)) == pytest.approx(timestamp + 1.0)
+
+
+def test_record_session(emulator, tmp_path):
+    path = tmp_path / "recording.json"
+    with MessageRecorder(path) as recorder:
+        api_handler = LuxendoAPIHandler(serial_number=emulator.serial_number,
+                                        mqtt_client=emulator.client.broker.client(), recorder=recorder)
+        stage = Stage(api_handler)
+        stacks = StackConfig(api_handler)
+        stacks.request_configuration()
+        # the camera requests the rest of the configuration that the emulator needs
+        Camera(api_handler, stage, DiskConfig(api_handler))
+        stage.x_position_um = 100.0
+        stage.wait_until_stopped(1000)
+        api_handler.close()
+    entries = load_luxendo_log(path)
+    assert len(entries) == recorder.n_recorded
+    assert {entry['topic'] for entry in entries} >= {emulator.serial_number + "/gui",
+                                                     emulator.serial_number + "/embedded/stacks"}
+    times = [entry['timestamp'] for entry in entries]
+    assert times == sorted(times)
+    latencies = command_latencies(entries)
+    assert len(latencies[('stacks', 'get')]) >= 2
+    assert all(latency >= 0 for device_latencies in latencies.values() for latency in device_latencies)
+    rows = summarize_latencies(entries)
+    assert {'device', 'command', 'n', 'p50_ms', 'p99_ms', 'max_ms'} <= set(rows[0])
+    assert "stacks" in format_summary(rows)
+    # recordings of a session that configured all devices are valid emulator input
+    replayed = TruLive3DEmulator(emulator.client.broker.client(), log_path=path)
+    assert replayed.serial_number == emulator.serial_number
+    assert [axis['value'] for axis in replayed.axes if axis['name'] == 'x'] == [100.0]
+
+
+def test_unfinished_recording_is_loaded(tmp_path, capsys):
+    path = tmp_path / "recording.json"
+    command = {"type": "operation", "data": {"device": "stacks", "command": "get"}}
+    reply = {"type": "operation", "data": {"device": "stacks", "command": "set", "stacks": []}}
+    entries = [{"topic": "sn/gui", "time": format_log_time(10.0), "timestamp": 10.0, "message": command},
+               {"topic": "sn/embedded/stacks", "time": format_log_time(10.25), "timestamp": 10.25, "message": reply}]
+    path.write_text("[\n" + ",\n".join(json.dumps(entry) for entry in entries))
+    assert load_luxendo_log(path) == entries
+    assert command_latencies(entries) == {('stacks', 'get'): [0.25]}
+    main([str(path)])
+    assert "250.0" in capsys.readouterr().out
+
+
+def test_broadcasts_are_not_replies():
+    def entry(topic, timestamp, message_type, data):
+        return {"topic": topic, "timestamp": timestamp, "message": {"type": message_type, "data": data}}
+    entries = [
+        entry("sn/gui", 1.0, "operation", {"device": "stages", "command": "move", "axes": []}),
+        entry("sn/embedded/stages", 1.1, "operation", {"device": "stages", "command": "position"}),
+        entry("sn/embedded/stages", 1.5, "device", {"device": "stages", "command": "set"}),
+        entry("sn/embedded/stages", 2.0, "operation", {"device": "stages", "command": "set"}),
+        entry("sn/gui", 3.0, "operation", {"device": "stacks", "command": "get"}),
+        entry("sn/embedded/progress", 3.1, "operation", {"device": "stacks", "command": "setprogress"}),
+        entry("sn/embedded/stacks", 3.5, "operation", {"device": "stacks", "command": "set"}),
+        # a broadcast without a pending command
+        entry("sn/embedded/stacks", 4.0, "operation", {"device": "stacks", "command": "set"})]
+    latencies = command_latencies(entries)
+    assert latencies.keys() == {('stages', 'move'), ('stacks', 'get')}
+    assert latencies[('stages', 'move')] == pytest.approx([1.0])
+    assert latencies[('stacks', 'get')] == pytest.approx([0.5])
@@ -0,0 +1,35 @@
+import time
+from microscope_gym.microscope_adapters.luxendo_emulator import DEFAULT_LOG_PATH
+from microscope_gym.microscope_adapters.luxendo_recorder import MessageRecorder
+from microscope_gym.microscope_adapters.luxendo_replay import SessionReplayer
+from microscope_gym.microscope_adapters.luxendo_trulive3d import LuxendoAPIHandler, Stage, StackConfig, Camera, DiskConfig
+
+
+def test_replay_recorded_log(tmp_path):
+    replayer = SessionReplayer(DEFAULT_LOG_PATH, data_directory=tmp_path, roi_size=64)
+    report = replayer.run()
+    assert report.n_commands == len(replayer.get_commands())
+    assert {"connect", "run", "loading", "stacks", "events"} <= set(report.phases)
+    assert report.n_frames > 0 and report.n_bytes >= report.n_frames * 64 * 64 * 2
+    assert report.throughput()["frames_per_s"] > 0
+    assert "loading" in report.format()
+
+
+def test_replay_timing(emulator, tmp_path):
+    path = tmp_path / "recording.json"
+    with MessageRecorder(path) as recorder:
+        api_handler = LuxendoAPIHandler(serial_number=emulator.serial_number,
+                                        mqtt_client=emulator.client.broker.client(), recorder=recorder)
+        stage = Stage(api_handler)
+        Camera(api_handler, stage, DiskConfig(api_handler))
+        stacks = StackConfig(api_handler)
+        time.sleep(0.3)
+        stage.x_position_um = 100.0
+        stage.wait_until_stopped(1000)
+        stacks.request_configuration()
+        api_handler.close()
+    fast = SessionReplayer(path, time_scale=0, data_directory=tmp_path).run()
+    real_time = SessionReplayer(path, time_scale=1, data_directory=tmp_path).run()
+    assert fast.n_commands == real_time.n_commands
+    assert "stages" in real_time.phases
+    assert real_time.wall_time_s - fast.wall_time_s > 0.25
@@ -0,0 +1,547 @@
+import json
+import time
+import numpy as np
+import pytest
+from microscope_gym.microscope_adapters.luxendo_emulator import LocalBroker, TruLive3DEmulator, LivePreviewServer
+from microscope_gym.microscope_adapters.luxendo_live_preview import LivePreview
+from microscope_gym.microscope_adapters.luxendo_trulive3d import LuxendoAPIHandler, LuxendoTimeoutError, Stage, StackConfig, EventConfig, DiskConfig, Camera, microscope_factory, LazyFrameStack, open_frame_stack, wait_until_file_is_ready, TopicRouter, CommandTemplate, APICommand, AxisCommand, MultiViewResult, LuxendoStorageError
+
+
+def test_reply_is_matched_by_topic_and_predicate(emulator, api_handler):
+    api_handler.ensure_connection()
+    api_handler.subscribe("embedded/test", lambda topic, payload_dict: None)
+    future = api_handler.expect_reply("embedded/test", lambda reply: reply['data']['device'] == 'test')
+    publisher = emulator.client.broker.client()
+    publisher.publish(emulator.serial_number + "/embedded/other", json.dumps({"data": {"device": "test"}}))
+    publisher.publish(emulator.serial_number + "/embedded/test", json.dumps({"data": {"device": "unrelated"}}))
+    time.sleep(0.05)
+    assert not future.done()
+    publisher.publish(emulator.serial_number + "/embedded/test", json.dumps({"data": {"device": "test"}}))
+    assert api_handler.wait_for_reply(future, timeout_ms=1000) == {"data": {"device": "test"}}
+
+
+def test_failing_handler_fails_reply(emulator, api_handler):
+    api_handler.ensure_connection()
+
+    def failing_handler(topic, payload_dict):
+        raise KeyError("device")
+    api_handler.subscribe("embedded/test", failing_handler)
+    publisher = emulator.client.broker.client()
+    future = api_handler.expect_reply("embedded/test", lambda reply: reply['data']['device'] == 'test')
+    publisher.publish(emulator.serial_number + "/embedded/test", json.dumps({"data": {"device": "test"}}))
+    with pytest.raises(KeyError):
+        api_handler.wait_for_reply(future, timeout_ms=1000)
+    # a payload that is not JSON fails the reply that waits for any message on the topic
+    api_handler.subscribe("embedded/raw", lambda topic, payload_dict: None)
+    future = api_handler.expect_reply("embedded/raw")
+    publisher.publish(emulator.serial_number + "/embedded/raw", "not json")
+    with pytest.raises(ValueError):
+        api_handler.wait_for_reply(future, timeout_ms=1000)
+
+
+def test_broadcast_is_not_taken_for_reply(tmp_path):
+    broker = LocalBroker(latency_ms=20)
+    emulator = TruLive3DEmulator(broker.client(), data_directory=tmp_path, time_scale=0)
+    emulator.start()
+    api_handler = LuxendoAPIHandler(serial_number=emulator.serial_number, mqtt_client=broker.client())
+    try:
+        stage = Stage(api_handler)
+        stacks = StackConfig(api_handler)
+        stale_state = {"type": "operation", "data": {"command": "set", "device": "stacks", "stacks": [
+            stack.dict() for stack in stacks.data]}}
+        publisher = broker.client()
+        with api_handler.batch() as batch:
+            new_stack = stage.add_current_position_to_stacks(stacks, batch=batch)
+            # broadcasts that arrive before the reply
+            publisher.publish(emulator.serial_number + "/embedded/stacks", json.dumps(
+                {"type": "operation", "data": {"command": "setprogress", "device": "stacks"}}))
+            publisher.publish(emulator.serial_number + "/embedded/stacks", json.dumps(stale_state))
+        assert new_stack.name in [stack.name for stack in stacks.data]
+    finally:
+        api_handler.close()
+        emulator.stop()
+
+
+def test_router_parses_payload_once():
+    parsed_payloads = []
+
+    def loads(payload):
+        parsed_payloads.append(payload)
+        return json.loads(payload)
+    router = TopicRouter(loads)
+    received = []
+    router.add("sn/embedded/stages", lambda topic, payload_dict: received.append(("exact", payload_dict)))
+    router.add("sn/datahub/cameras/#", lambda topic, payload_dict: received.append(("cameras", topic)))
+    router.add("sn/+/stages", lambda topic, payload_dict: received.append(("wildcard", topic)))
+    router.dispatch("sn/embedded/stages", b'{"data": {}}')
+    assert parsed_payloads == [b'{"data": {}}']
+    assert received == [("exact", {"data": {}}), ("wildcard", "sn/embedded/stages")]
+    received.clear()
+    router.dispatch("sn/datahub/cameras/long", b'{}')
+    router.dispatch("sn/datahub/cameras", b'{}')
+    router.dispatch("sn/embedded/cameras", b'{}')
+    assert received == [("cameras", "sn/datahub/cameras/long"), ("cameras", "sn/datahub/cameras")]
+    # the cached matches are updated when handlers change
+    router.remove("sn/+/stages")
+    received.clear()
+    router.dispatch("sn/embedded/stages", b'{}')
+    assert received == [("exact", {})]
+
+
+def test_subscription_before_connect(emulator):
+    api_handler = LuxendoAPIHandler(serial_number=emulator.serial_number, mqtt_client=emulator.client.broker.client())
+    received = []
+    api_handler.subscribe("embedded/stages", lambda topic, payload_dict: received.append(payload_dict))
+    api_handler.ensure_connection()
+    stage = Stage(api_handler)
+    assert received and received[-1]['data']['axes']
+    assert stage.is_configured()
+    api_handler.close()
+
+
+def test_reply_timeout(api_handler):
+    stacks = StackConfig(api_handler)
+    started = time.time()
+    with pytest.raises(LuxendoTimeoutError):
+        api_handler.send_command_and_wait_for_reply('{"type": "operation", "data": {"device": "unknown"}}',
+                                                    reply_topic="embedded/unknown", timeout_ms=100)
+    assert time.time() - started < 0.5
+    # a timeout does not affect later commands
+    stacks.request_configuration()
+    assert stacks.is_configured()
+
+
+def test_batched_commands_are_in_flight_together(tmp_path):
+    broker = LocalBroker(latency_ms=20)
+    emulator = TruLive3DEmulator(broker.client(), data_directory=tmp_path, time_scale=0)
+    emulator.start()
+    api_handler = LuxendoAPIHandler(serial_number=emulator.serial_number, mqtt_client=broker.client())
+    try:
+        stage = Stage(api_handler)
+        stacks = StackConfig(api_handler)
+        EventConfig(api_handler)
+        n_stacks = len(stacks.data)
+        started = time.time()
+        with api_handler.batch() as batch:
+            new_stacks = [stage.add_current_position_to_stacks(stacks, batch=batch) for _ in range(10)]
+        # ten serial round-trips would take at least 10 * 2 * 20 ms
+        assert time.time() - started < 0.2
+        assert len({stack.name for stack in new_stacks}) == 10
+        assert len(stacks.data) == n_stacks + 10
+        assert {stack.name for stack in new_stacks} <= {stack.name for stack in stacks.data}
+
+        started = time.time()
+        replies = api_handler.wait_for_replies([
+            api_handler.send_command_async('{"type": "operation", "data": {"device": "stacks", "command": "get"}}',
+                                           reply_topic="embedded/stacks"),
+            api_handler.send_command_async('{"type": "operation", "data": {"device": "events", "command": "get"}}',
+                                           reply_topic="embedded/events")])
+        assert time.time() - started < 0.2
+        assert [reply['data']['device'] for reply in replies] == ["stacks", "events"]
+    finally:
+        api_handler.close()
+        emulator.stop()
+
+
+def received_commands(emulator, n_commands, expected_count, timeout_s=5.0):
+    '''Return the commands the emulator received after the first n_commands, once expected_count arrived.'''
+    deadline = time.monotonic() + timeout_s
+    while len(emulator.commands) < n_commands + expected_count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    emulator.wait_until_idle()
+    return [command['data']['command'] for _, command in emulator.commands[n_commands:]]
+
+
+def test_acquisition_session_reuses_event(emulator, api_handler):
+    stage = Stage(api_handler)
+    camera = Camera(api_handler, stage, DiskConfig(api_handler))
+    stacks_before = [stack.name for stack in camera.event_handler.stacks.data]
+    with camera.acquisition_session():
+        camera.capture_image()
+        for x in (100.0, 200.0):
+            stage.x_position_um = x
+            stage.wait_until_stopped()
+            n_commands = len(emulator.commands)
+            camera.capture_image()
+            assert received_commands(emulator, n_commands, 2) == ['replaceall', 'run']
+            assert camera.event_handler.stacks.data[0].elements[0].start == x
+        n_commands = len(emulator.commands)
+        camera.capture_image()
+        # the stage has not moved, so the stack does not need to be updated
+        assert received_commands(emulator, n_commands, 1) == ['run']
+    assert not camera.event_handler.is_active
+    assert [stack.name for stack in camera.event_handler.stacks.data] == stacks_before
+
+
+@pytest.fixture
+def microscope(emulator, api_handler):
+    microscope = microscope_factory(serial_number=emulator.serial_number, mqtt_client=api_handler.mqtt,
+                                    reply_timeout_ms=10000)
+    # a small region of interest keeps the synthetic images small
+    for settings in list(microscope.camera.cameras.values()):
+        settings = settings.copy()
+        settings.width_pixels = settings.height_pixels = 256
+        microscope.camera.configure_camera(settings)
+    deadline = time.monotonic() + 5
+    while any(settings.width_pixels != 256 for settings in microscope.camera.cameras.values()):
+        assert time.monotonic() < deadline, "camera ROI was not updated"
+        time.sleep(0.01)
+    return microscope
+
+
+def sent_commands(emulator, n_commands):
+    return [command['data'] for _, command in emulator.commands[n_commands:]]
+
+
+def test_hardware_z_stack(emulator, microscope):
+    n_commands = len(emulator.commands)
+    images = microscope.acquire_z_stack((0, 5, 1))
+    commands = sent_commands(emulator, n_commands)
+    assert [command['command'] for command in commands].count('run') == 1
+    assert not any(command['device'] == 'stages' for command in commands)
+    assert set(images) == set(microscope.camera.cameras)
+    for name, image in images.items():
+        settings = microscope.camera.cameras[name]
+        assert image.shape == (5, settings.height_pixels, settings.width_pixels)
+        z_element = next(element for element in microscope.camera.current_metadatas[name][0]['stack']['elements']
+                         if element['name'] == 'z')
+        assert (z_element['start'], z_element['end']) == (0, 4)
+
+
+def test_hardware_tiled_z_stack(emulator, microscope):
+    field_of_view = microscope.get_field_of_view_um()
+    y_range = (0, field_of_view[0] * 0.9 * 2, field_of_view[0] * 0.9)
+    x_range = (0, field_of_view[1] * 0.9, field_of_view[1] * 0.9)
+    n_commands = len(emulator.commands)
+    images = microscope.acquire_tiled_z_stack((0, 3, 1), y_range, x_range)
+    commands = sent_commands(emulator, n_commands)
+    assert [command['command'] for command in commands].count('run') == 1
+    assert not any(command['device'] == 'stages' for command in commands)
+    n_tiles = len(microscope.get_scan_positions(y_range, x_range)[0])
+    assert n_tiles > 1
+    for name, image in images.items():
+        settings = microscope.camera.cameras[name]
+        assert image.shape == (n_tiles, 3, settings.height_pixels, settings.width_pixels)
+    tiled_images = microscope.acquire_tiled_image(y_range, x_range)
+    for name, image in tiled_images.items():
+        assert image.shape == (n_tiles,) + images[name].shape[2:]
+
+
+def test_sparse_tiled_image(emulator, microscope):
+    field_of_view = microscope.get_field_of_view_um()
+    y_range = (0, field_of_view[0] * 0.9 * 2, field_of_view[0] * 0.9)
+    x_range = (0, field_of_view[1] * 0.9, field_of_view[1] * 0.9)
+    # a single mask pixel at stage position (0, 0) is only in the field of view of the first tile
+    mask = np.zeros((int(field_of_view[0] * 3), int(field_of_view[1] * 2)), dtype=bool)
+    mask[int(field_of_view[0] / 2), int(field_of_view[1] / 2)] = True
+    n_commands = len(emulator.commands)
+    stores = microscope.acquire_sparse_tiled_image(mask, mask_pixel_size_um=1.0,
+                                                   mask_origin_um=-field_of_view / 2 + 0.5,
+                                                   y_range=y_range, x_range=x_range)
+    commands = sent_commands(emulator, n_commands)
+    assert [command['command'] for command in commands].count('run') == 1
+    tasks = [command['tasks'] for command in commands if command['command'] == 'replacetasks'][-1]
+    assert len(tasks) == 1
+    assert set(stores) == set(microscope.camera.cameras)
+    for name, store in stores.items():
+        settings = microscope.camera.cameras[name]
+        assert len(store) == 1 and store.grid_shape[0] > 1
+        assert store.get_tile(0, 0).shape == (settings.height_pixels, settings.width_pixels)
+        np.testing.assert_allclose(store.positions_um, [[0, 0]])
+    # without tiles in the mask, the stores keep the grid
+    empty_stores = microscope.acquire_sparse_tiled_image(np.zeros((4, 4)), y_range=y_range, x_range=x_range)
+    assert set(empty_stores) == set(stores)
+    for name, store in empty_stores.items():
+        assert len(store) == 0 and store.grid_shape == stores[name].grid_shape
+        assert store.to_dense().shape == store.grid_shape + stores[name].tiles.shape[1:]
+
+
+def test_overview_image_is_mask_source(emulator, microscope):
+    field_of_view = microscope.get_field_of_view_um()
+    # two overlapping rows of tiles
+    y_range = (0, field_of_view[0] * 0.9, field_of_view[0] * 0.5)
+    x_range = (0, field_of_view[1] * 0.9, field_of_view[1] * 0.9)
+    n_commands = len(emulator.commands)
+    overviews = microscope.acquire_overview_image(y_range, x_range, binning=8)
+    assert [command['command'] for command in sent_commands(emulator, n_commands)].count('run') == 1
+    pixel_size_um, origin_um = microscope.get_overview_geometry(y_range, x_range, binning=8)
+    assert pixel_size_um == microscope.get_sample_pixel_size_um() * 8
+    np.testing.assert_allclose(origin_um, -field_of_view / 2)
+    y_positions, x_positions = microscope.get_scan_positions(y_range, x_range)
+    assert len(y_positions) == 2
+    for name, overview in overviews.items():
+        expected_shape = (np.ptp(y_positions) + field_of_view[0], np.ptp(x_positions) + field_of_view[1])
+        np.testing.assert_allclose(overview.shape, np.asarray(expected_shape) / pixel_size_um, atol=1)
+        assert overview.min() > 0
+    # the overview covers all tiles of the range
+    stores = microscope.acquire_sparse_tiled_image(next(iter(overviews.values())) > 0, pixel_size_um, origin_um,
+                                                   y_range, x_range)
+    assert all(len(store) == len(y_positions) for store in stores.values())
+
+
+def test_empty_z_range(microscope):
+    with pytest.raises(ValueError, match="no z positions"):
+        microscope.acquire_z_stack((5, 0, 1))
+
+
+def test_channels_are_acquired_in_one_run(emulator, microscope):
+    channels = microscope.camera.event_handler.channels
+    channels.add_element()
+    deadline = time.monotonic() + 5
+    while len(channels.data) < 2:
+        assert time.monotonic() < deadline, "channel was not added"
+        time.sleep(0.01)
+    channel_names = [channel.name for channel in channels.data]
+    n_commands = len(emulator.commands)
+    images = microscope.acquire_z_stack((0, 3, 1), channels=channel_names)
+    commands = sent_commands(emulator, n_commands)
+    assert [command['command'] for command in commands].count('run') == 1
+    tasks = [command['tasks'] for command in commands if command['command'] == 'replacetasks'][-1]
+    assert [(task['stack'], task['channel'], task['order']) for task in tasks] == [
+        ('stack_0', channel_names[0], 0), ('stack_0', channel_names[1], 1)]
+    assert set(images) == set(microscope.camera.cameras)
+    for name, image in images.items():
+        settings = microscope.camera.cameras[name]
+        assert image.shape == (2, 3, settings.height_pixels, settings.width_pixels)
+        assert [metadata['channel'] for metadata in microscope.camera.current_metadatas[name]] == channel_names
+    single_plane = microscope.acquire_image(channels=channel_names[::-1])
+    for name, image in single_plane.items():
+        assert image.shape == (2,) + images[name].shape[2:]
+    # without channels, only the active channel is imaged again
+    images = microscope.acquire_z_stack((0, 3, 1))
+    for name, image in images.items():
+        assert image.shape[0] == 3
+    with pytest.raises(ValueError):
+        microscope.acquire_image(channels=["unknown"])
+
+
+def test_views_are_completed_independently():
+    result = MultiViewResult({'long': [('stack_0', 'channel_0')], 'short': [('stack_0', 'channel_0')]})
+    indices = {name: result.add_file(name, f"{name}.lux.h5") for name in result.views}
+    result.wait_for_files(timeout_s=0)
+    result.set_image('short', indices['short'], np.ones((2, 4, 4)), {'name': 'short'})
+    assert next(result.as_completed(timeout_s=1)) == 'short'
+    assert result.metadata('short', timeout_s=0) == [{'name': 'short'}]
+    with pytest.raises(LuxendoTimeoutError):
+        result.view('long', timeout_s=0.01)
+    result.set_image('long', indices['long'], np.zeros((2, 4, 4)), {'name': 'long'})
+    assert result.is_loaded()
+    assert result.to_array(timeout_s=0).shape == (2, 1, 2, 4, 4)
+
+
+def test_capture_views(microscope):
+    stacks = [microscope._get_stack("stack_0", (0, 3, 1))]
+    result = microscope.camera.capture_views(stacks)
+    assert not microscope.camera.event_handler.is_active
+    assert set(result.views) == set(microscope.camera.cameras)
+    assert sorted(result.as_completed(timeout_s=5)) == sorted(result.views)
+    for name in result.views:
+        assert result.metadata(name)[0]['stack']['name'] == "stack_0"
+    settings = microscope.camera.settings
+    assert result.to_array().shape == (len(result.views), 1, 3, settings.height_pixels, settings.width_pixels)
+
+
+def test_storage_source_is_checked_before_run(emulator, microscope):
+    camera = microscope.camera
+    stacks = [microscope._get_stack("stack_0", (0, 100, 1))]
+    estimate = camera.estimate_acquisition(stacks)
+    frame_bytes = 256 * 256 * Camera.bytes_per_pixel
+    assert estimate.data_volume_bytes == len(camera.cameras) * 100 * frame_bytes
+    # the selected source is almost full, another one is fast enough
+    sources = emulator.disk['sources']['options']
+    sources[0]['free'] = estimate.data_volume_bytes // 2
+    sources[1]['speed'] = 10 * estimate.throughput_bytes_per_s / DiskConfig.bytes_per_speed_unit
+    camera.disk.request_configuration()
+    n_commands = len(emulator.commands)
+    with pytest.raises(LuxendoStorageError):
+        camera.capture_stacks(stacks)
+    assert 'run' not in [command['data']['command'] for _, command in emulator.commands[n_commands:]]
+    camera.storage_policy = "select"
+    images = camera.capture_stacks(stacks)
+    assert camera.disk.selected_source == sources[1]['name'] == emulator.disk['selectedsource']
+    assert all(len(camera_images) == 1 for camera_images in images.values())
+    # no source writes fast enough
+    sources[1]['speed'] = estimate.throughput_bytes_per_s / 2 / DiskConfig.bytes_per_speed_unit
+    camera.disk.request_configuration()
+    with pytest.raises(LuxendoStorageError, match="MB/s"):
+        camera.disk.find_source(estimate)
+
+
+def test_take_snapshot_from_live_stream(emulator, microscope):
+    server = LivePreviewServer(emulator, frame_rate=100)
+    server.start()
+    camera = microscope.camera
+    try:
+        camera.live_preview = LivePreview(server.url)
+        started = time.monotonic()
+        image = camera.take_snapshot()
+        assert time.monotonic() - started < 1.0
+        name, expected = emulator.get_live_frames()[0]
+        assert name == camera.settings.name
+        np.testing.assert_array_equal(image, expected)
+        # frames are received into the same buffer, snapshots are copies
+        frames_received = camera.live_preview.frames_received
+        assert camera.take_snapshot() is not image
+        assert camera.live_preview.frames_received > frames_received
+    finally:
+        camera.live_preview.stop()
+        server.stop()
+
+
+def test_live_preview_capability(microscope):
+    # take_snapshot only uses a live preview if the camera has a stream, so only such instances report it
+    assert not type(microscope).capabilities.live_preview
+    assert not microscope.capabilities.live_preview
+    camera = microscope.camera
+    camera.live_preview = LivePreview("ws://127.0.0.1:1")
+    assert type(microscope)(camera, microscope.stage, microscope.objective).capabilities.live_preview
+
+
+def test_close_stops_camera_threads(emulator, microscope):
+    server = LivePreviewServer(emulator, frame_rate=100)
+    server.start()
+    try:
+        with microscope:
+            microscope.camera.live_preview = LivePreview(server.url)
+            microscope.camera.take_snapshot()
+            assert microscope.camera.live_preview.is_running
+        assert not microscope.camera.live_preview.is_running
+        with pytest.raises(RuntimeError):
+            microscope.camera._loader.submit(print)
+    finally:
+        server.stop()
+
+
+def test_images_are_opened_lazily(microscope):
+    images = microscope.acquire_z_stack((0, 3, 1))
+    for name, image in images.items():
+        assert isinstance(image, np.memmap)
+        path = microscope.camera.file_paths[name][0]
+        assert np.array_equal(image[1, :10, :10], np.asarray(LazyFrameStack(path)[1, :10, :10]))
+
+
+def test_chunked_files_are_read_on_demand(tmp_path):
+    import h5py
+    path = tmp_path / "Cam_long_00000.lux.h5"
+    data = np.arange(3 * 8 * 8, dtype=np.uint16).reshape(3, 8, 8)
+    with h5py.File(path, 'w') as image_file:
+        image_file.create_dataset('Data', data=data, chunks=(1, 8, 8), compression='gzip')
+        image_file.create_dataset('metadata', data=json.dumps({"camera": "long"}))
+    assert wait_until_file_is_ready(path, timeout_s=1) == {"camera": "long"}
+    stack = open_frame_stack(path)
+    assert isinstance(stack, LazyFrameStack)
+    assert stack.shape == data.shape
+    assert np.array_equal(stack[2, 2:4], data[2, 2:4])
+    assert np.array_equal(np.asarray(stack), data)
+
+
+def test_missing_file_is_not_ready(tmp_path):
+    with pytest.raises(LuxendoTimeoutError):
+        wait_until_file_is_ready(tmp_path / "missing.lux.h5", timeout_s=0.05)
+
+
+def test_stage_state_is_cached(emulator, api_handler):
+    stage = Stage(api_handler)
+    n_commands = len(emulator.commands)
+    for _ in range(10):
+        assert stage.position_um == stage.position_um
+        assert not stage.is_moving()
+    assert stage.wait_until_stopped(timeout_ms=0)
+    assert len(emulator.commands) == n_commands
+
+    emulator.time_scale = 1
+    emulator.stage_speed_um_per_s = 1000
+    stage.x_position_um = 200.0
+    # the move counts as started as soon as it was requested
+    assert stage.is_moving()
+    assert not stage.wait_until_stopped(timeout_ms=50)
+    assert stage.wait_until_stopped(timeout_ms=5000)
+    assert stage.x_position_um == 200.0
+    assert [command['data']['device'] for _, command in emulator.commands[n_commands:]] == ['stages']
+
+
+def test_stage_ignores_outdated_state(emulator, api_handler):
+    stage = Stage(api_handler)
+    outdated_state = {'data': {'command': 'set', 'axes': [axis.dict(by_alias=True) for axis in stage.axes.values()]}}
+    emulator.time_scale = 1
+    emulator.stage_speed_um_per_s = 1000
+    stage.x_position_um = 100.0
+    stage._parse_data(outdated_state)
+    assert stage.is_moving()
+    assert stage.wait_until_stopped(timeout_ms=5000)
+    assert stage.x_position_um == 100.0
+
+
+def test_stage_moves_axes_with_one_command(emulator, api_handler):
+    stage = Stage(api_handler)
+    n_commands = len(emulator.commands)
+    stage.move_axes(x=120.0, y=30.0)
+    assert stage.wait_until_stopped(timeout_ms=1000)
+    assert (stage.y_position_um, stage.x_position_um) == (30.0, 120.0)
+    assert [command['data']['command'] for _, command in emulator.commands[n_commands:]] == ['set']
+
+
+def test_stage_move_to_position_between_steps(tmp_path):
+    broker = LocalBroker(latency_ms=1)
+    emulator = TruLive3DEmulator(broker.client(), data_directory=tmp_path, time_scale=0, stage_resolution_um=0.1)
+    emulator.start()
+    api_handler = LuxendoAPIHandler(serial_number=emulator.serial_number, mqtt_client=broker.client())
+    try:
+        stage = Stage(api_handler)
+        stage.x_position_um = 12.345
+        # the instrument reports the target rounded to 0.1 µm
+        assert stage.wait_until_stopped(timeout_ms=1000)
+        assert stage.x_position_um == pytest.approx(12.3)
+        assert not stage.is_moving()
+        n_commands = len(emulator.commands)
+        stage.x_position_um = 12.34
+        assert len(emulator.commands) == n_commands
+    finally:
+        api_handler.close()
+        emulator.stop()
+
+
+def test_command_template():
+    template = CommandTemplate({"type": "device", "data": {"name": CommandTemplate.field("name"), "roi": {
+        "top": CommandTemplate.field("top"), "exposure": CommandTemplate.field("exposure"), "fixed": [1, 2]}}})
+    assert template.fields == ["name", "top", "exposure"]
+    expected = {"type": "device", "data": {"name": "long \"a\"", "roi": {"top": 3, "exposure": 0.1, "fixed": [1, 2]}}}
+    assert json.loads(template.render(name='long "a"', top=3, exposure=0.1)) == expected
+    assert template.render('long "a"', 3, 0.1) == json.dumps(expected)
+
+
+def test_stage_command_matches_pydantic_encoding(emulator, api_handler):
+    stage = Stage(api_handler)
+    sent = []
+    api_handler.send_command = lambda command, subtopic='/gui': sent.append(command)
+    stage.x_position_um = 150.0
+    # the second move is sent before the instrument confirmed the first one
+    stage.z_position_um = -2.5
+    expected_axes = [axis.copy(update={'position_um': {'x': 150.0, 'z': -2.5}.get(axis.name, axis.target)})
+                     for axis in stage.axes.values()]
+    expected = APICommand(type="device", data=AxisCommand(command="set", device="stages", axes=expected_axes))
+    assert sent[-1] == expected.json(by_alias=True)
+
+
+def test_only_changed_settings_are_sent(emulator, microscope):
+    camera = microscope.camera
+
+    def sent_after(action):
+        n_commands = len(emulator.commands)
+        action()
+        time.sleep(0.05)
+        return [(command['data']['device'], command['data']['command']) for _, command in emulator.commands[n_commands:]]
+    settings = camera.cameras['long'].copy()
+    assert sent_after(lambda: camera.configure_camera(settings)) == []
+    settings.exposure_time_ms = 20.0
+    assert sent_after(lambda: camera.configure_camera(settings)) == [('timings', 'set')]
+    # the exposure of the other cameras was updated with the acknowledged timings
+    other_settings = camera.cameras['short'].copy()
+    assert other_settings.exposure_time_ms == 20.0
+    assert sent_after(lambda: camera.configure_camera(other_settings)) == []
+    other_settings.width_pixels = 128
+    assert sent_after(lambda: camera.configure_camera(other_settings)) == [('cameras', 'setroi')]
+    assert camera.cameras['short'].width_pixels == 128
+    assert camera.cameras['short'].exposure_time_ms == 20.0
+    # a stage move to the current target is not sent either
+    assert sent_after(lambda: microscope.move_stage_to(absolute_x_position_um=microscope.stage.x_position_um)) == []
@@ -0,0 +1,64 @@
+import importlib
+import pytest
+from microscope_gym import interface
+from microscope_gym.microscope_adapters import mock_scope
+from microscope_gym.microscope_adapters.microscope_factory import AdapterRegistry, microscope_factory
+
+
+def test_builtin_adapters_are_available():
+    registry = AdapterRegistry()
+    assert {"mock_scope", "luxendo_trulive3d"}.issubset(registry.available_adapters())
+
+
+def test_adapter_is_cached(monkeypatch):
+    registry = AdapterRegistry()
+    adapter = registry.get_adapter("mock_scope")
+    assert adapter.microscope_class is mock_scope.Microscope
+
+    def fail(*args, **kwargs):
+        raise AssertionError("adapter module imported twice")
+    monkeypatch.setattr(importlib, "import_module", fail)
+    assert registry.get_adapter("mock_scope") is adapter
+    microscope = registry.create_microscope("mock_scope", camera_height_pixels=64, camera_width_pixels=64)
+    assert isinstance(microscope, mock_scope.Microscope)
+
+
+def test_adapter_capabilities():
+    registry = AdapterRegistry()
+    capabilities = registry.get_capabilities("mock_scope")
+    assert isinstance(capabilities, interface.MicroscopeCapabilities)
+    assert capabilities == mock_scope.Microscope.capabilities
+
+
+def test_register_module_name():
+    registry = AdapterRegistry()
+    registry.register("my_scope", "microscope_gym.microscope_adapters.mock_scope")
+    assert "my_scope" in registry.available_adapters()
+    assert registry.get_adapter("my_scope").module is mock_scope
+
+
+def test_microscope_factory_components():
+    components = {"Camera": {"camera_height_pixels": 32, "camera_width_pixels": 16}, "Stage": {}}
+    microscope = microscope_factory("mock_scope", components)
+    assert microscope.camera.image_shape == (32, 16)
+
+    # module names are accepted for backwards compatibility
+    microscope = microscope_factory("microscope_gym.microscope_adapters.mock_scope", components)
+    assert isinstance(microscope, interface.Microscope)
+
+    with pytest.raises(AttributeError):
+        microscope_factory("mock_scope", {"Laser": {}})
+    # imported classes are not components
+    assert not AdapterRegistry().get_adapter("luxendo_trulive3d").supports("Path")
+    assert AdapterRegistry().get_adapter("luxendo_trulive3d").components == {"Camera", "Stage", "Objective"}
+    with pytest.raises(ValueError, match="camera_height_pixels"):
+        microscope_factory("mock_scope", {"Camera": {"camera_height_pixels": 32}, "Stage": {"camera_height_pixels": 16}})
+    with pytest.raises(ValueError, match="camera_width_pixels"):
+        microscope_factory("mock_scope", {"Camera": {"camera_width_pixels": 32}}, camera_width_pixels=16)
+
+
+def test_luxendo_capabilities():
+    capabilities = AdapterRegistry().get_capabilities("luxendo_trulive3d")
+    assert capabilities.hardware_z_stack and capabilities.hardware_tiling
+    # only microscopes whose camera has a live stream have a live preview
+    assert not capabilities.live_preview
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from microscope_gym.features.object_index import ObjectIndex
+from microscope_gym.features.smart_object_finder import SmartObjectFinder
+from microscope_gym.microscope_adapters.mock_scope import microscope_factory
+
+
+class ThresholdSegmenter:
+    def predict(self, features, image):
+        from scipy import ndimage
+        return ndimage.label(np.asarray(image) > 0.5)[0]
+
+
+def test_duplicates_are_merged():
+    index = ObjectIndex(tolerance_um=5)
+    first, is_new = index.add(10.0, 20.0, metric=1.0)
+    assert is_new and first.id == 0
+    duplicate, is_new = index.add(12.0, 22.0, metric=3.0)
+    assert duplicate is first and not is_new
+    assert first.position_um == (11.0, 21.0)
+    assert first.n_detections == 2 and first.metric == 3.0
+    second, is_new = index.add(10.0, 30.0)
+    assert is_new and len(index) == 2
+    np.testing.assert_array_equal(index.positions_um, [[11.0, 21.0], [10.0, 30.0]])
+    with pytest.raises(ValueError):
+        ObjectIndex(tolerance_um=0)
+
+
+def test_queries_match_brute_force():
+    rng = np.random.default_rng(0)
+    index = ObjectIndex(tolerance_um=5)
+    for y, x in rng.uniform(-200, 200, size=(300, 2)):
+        index.add(y, x)
+    positions = index.positions_um
+    for query in rng.uniform(-300, 300, size=(50, 2)):
+        distances = np.hypot(*(positions - query).T)
+        assert index.nearest(*query).id == np.argmin(distances)
+        assert [detected_object.id for detected_object in index.within_radius(*query, radius_um=30)] == \
+            [int(i) for i in np.argsort(distances, kind='stable') if distances[i] <= 30]
+        nearby = index.nearest(*query, max_distance_um=4)
+        assert (nearby is None) == (distances.min() > 4)
+    assert ObjectIndex(1).nearest(0, 0) is None
+
+
+def test_scan_images_each_object_once():
+    overview_image = np.zeros((320, 320))
+    for y, x in [(70, 70), (150, 150), (240, 100), (100, 250)]:
+        overview_image[y - 3:y + 3, x - 3:x + 3] = 1.0
+    microscope = microscope_factory(overview_image, camera_height_pixels=100, camera_width_pixels=100)
+    finder = SmartObjectFinder(microscope, ThresholdSegmenter(), "", backend="numpy")
+    # overlapping tiles, the objects are detected in up to four tiles
+    index = ObjectIndex(tolerance_um=5)
+    images = finder.scan_for_objects(100, y_range=(50, 250, 40), x_range=(50, 250, 40), object_index=index)
+    assert len(index) == 4
+    assert len(images) == 4
+    assert max(detected_object.n_detections for detected_object in index) > 1
+    assert all(detected_object.last_imaged == 1 for detected_object in index)
+    # the next time point images the objects again
+    images = finder.scan_for_objects(2, y_range=(50, 250, 40), x_range=(50, 250, 40), object_index=index)
+    assert len(images) == 2 and len(index) == 4
+    assert index.time_point == 2
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from microscope_gym.features.overview_workflow import OverviewWorkflow
+from microscope_gym.features.smart_object_finder import SmartObjectFinder
+from microscope_gym.interface import Objective
+from microscope_gym.microscope_adapters.mock_scope import microscope_factory
+
+
+class ThresholdSegmenter:
+    def predict(self, features, image):
+        from scipy import ndimage
+        return ndimage.label(np.asarray(image) > 0.5)[0]
+
+
+@pytest.fixture
+def microscope():
+    overview_image = np.zeros((1, 600, 600))
+    for y, x in [(100, 100), (300, 450), (480, 200)]:
+        overview_image[0, y - 5:y + 5, x - 5:x + 5] = 1.0
+    imaging_objective = Objective(name="4x", magnification=4, working_distance=1.0, numerical_aperture=0.5,
+                                  immersion="air", calibration_offset_um=(2.0, -1.5))
+    return microscope_factory(overview_image, camera_height_pixels=64, camera_width_pixels=64,
+                              additional_objectives=[imaging_objective])
+
+
+def test_switch_objective(microscope):
+    assert set(microscope.objectives) == {"1x air", "4x"}
+    assert microscope.capabilities.objective_switching
+    microscope.move_stage_to(absolute_y_position_um=100, absolute_x_position_um=100)
+    np.testing.assert_array_equal(microscope.get_field_of_view_um(), (64, 64))
+    microscope.switch_objective("4x")
+    np.testing.assert_array_equal(microscope.get_field_of_view_um(), (16, 16))
+    # the field of view of the 4x objective is offset by its calibration, the object appears shifted by 4 pixels/µm
+    image = microscope.acquire_image()
+    assert image.shape == (64, 64)
+    rows, columns = np.nonzero(image > 0.5)
+    assert rows.mean() == pytest.approx(31.5 - 2 * 4, abs=0.5)
+    assert columns.mean() == pytest.approx(31.5 + 1.5 * 4, abs=0.5)
+    np.testing.assert_allclose(microscope.get_sample_position_um(), (102, 98.5))
+    np.testing.assert_allclose(microscope.get_stage_position_for_sample_position((102, 98.5)), (100, 100))
+    with pytest.raises(ValueError):
+        microscope.switch_objective("100x oil")
+
+
+def test_overview_workflow(microscope):
+    finder = SmartObjectFinder(microscope, ThresholdSegmenter(), "", backend="numpy")
+    workflow = OverviewWorkflow(finder, overview_objective="1x air", imaging_objective="4x")
+    assert workflow.object_index.tolerance_um == pytest.approx(4)
+    targets, images = workflow.run(object_size_range=(20, 1000))
+    assert len(targets) == 3
+    np.testing.assert_allclose(sorted(target.position_um for target in targets),
+                               [(100, 100), (300, 450), (480, 200)], atol=1)
+    assert microscope.objective.name == "4x"
+    for image in images:
+        rows, columns = np.nonzero(image > 0.5)
+        # each target is centred in the field of view of the imaging objective, the mock scope crops the images
+        # of the overview objective at whole µm, i.e. at 4 pixels of the imaging objective
+        assert rows.mean() == pytest.approx(31.5, abs=4)
+        assert columns.mean() == pytest.approx(31.5, abs=4)
+    # a second overview finds no new targets, image_targets images the known targets again
+    assert workflow.find_targets(object_size_range=(20, 1000)) == []
+    assert len(workflow.image_targets(max_targets=2)) == 2
+    with pytest.raises(ValueError):
+        OverviewWorkflow(finder, overview_objective="1x air", imaging_objective="40x")
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from microscope_gym.features.smart_object_finder import SmartObjectFinder
+from microscope_gym.features.tile_prescreen import ScanStatistics, TilePrescreen
+from microscope_gym.microscope_adapters.mock_scope import microscope_factory
+
+
+class CountingSegmenter:
+    def __init__(self):
+        self.n_calls = 0
+
+    def predict(self, features, image):
+        self.n_calls += 1
+        return (np.asarray(image) > 0.5).astype(np.uint32)
+
+
+def test_prescreen_statistics():
+    rng = np.random.default_rng(0)
+    empty = rng.normal(0.0, 0.1, size=(64, 66))
+    with_object = empty.copy()
+    with_object[10:18, 20:28] += 1.0
+    prescreen = TilePrescreen(intensity_threshold=0.5, binning=4)
+    assert not prescreen.passes(empty)
+    assert prescreen.passes(with_object)
+    statistics = prescreen.get_statistics(with_object)
+    assert statistics['percentile_intensity'] > prescreen.get_statistics(empty)['percentile_intensity']
+    # a single bright pixel is averaged out by binning, but raises the local variance
+    spot = empty.copy()
+    spot[30, 30] = 5.0
+    assert not prescreen.passes(spot)
+    assert TilePrescreen(variance_threshold=0.5, percentile=100, binning=4).passes(spot)
+    # z-stacks are projected and tiles smaller than a bin are not binned
+    assert TilePrescreen(intensity_threshold=0.5, binning=8).passes(np.stack([empty[:5, :5], with_object[12:17, 22:27]]))
+    with pytest.raises(ValueError):
+        TilePrescreen()
+
+
+def test_scan_statistics():
+    statistics = ScanStatistics()
+    assert statistics.skipped_fraction == 0 and statistics.time_saved_s == 0
+    statistics.n_tiles, statistics.n_skipped, statistics.n_captured = 10, 8, 2
+    statistics.prescreen_time_s, statistics.capture_time_s, statistics.segmentation_time_s = 1.0, 2.0, 4.0
+    assert statistics.n_segmented == 2
+    assert statistics.time_saved_s == pytest.approx(8 * 3.0 - 1.0)
+    # the skipped tiles were captured to pre-screen them
+    statistics.n_captured, statistics.capture_time_s = 10, 10.0
+    assert statistics.time_saved_s == pytest.approx(8 * 2.0 - 1.0)
+    assert statistics.summary()['skipped_fraction'] == pytest.approx(0.8)
+
+
+def test_scan_skips_empty_tiles():
+    overview_image = np.zeros((1, 400, 400))
+    overview_image[0, 320:340, 320:340] = 1.0
+    microscope = microscope_factory(overview_image, camera_height_pixels=100, camera_width_pixels=100)
+    segmenter = CountingSegmenter()
+    finder = SmartObjectFinder(microscope, segmenter, "", backend="numpy")
+    snapshots = []
+
+    def take_snapshot():
+        snapshots.append(microscope.camera.capture_image())
+        return snapshots[-1]
+
+    prescreen = TilePrescreen(intensity_threshold=0.1, binning=5, capture_function=take_snapshot)
+    images = finder.scan_for_objects(1, y_range=(50, 350, 75), x_range=(50, 350, 75), prescreen=prescreen)
+    assert len(images) == 1
+    statistics = finder.scan_statistics
+    assert statistics.n_tiles == len(snapshots) == 16
+    assert statistics.n_skipped == 15 and segmenter.n_calls == 1
+    assert statistics.prescreen_time_s > 0 and statistics.capture_time_s > 0
+    # without prescreen every tile is segmented
+    finder.scan_for_objects(1, y_range=(50, 350, 75), x_range=(50, 350, 75))
+    assert finder.scan_statistics.n_skipped == 0
+    assert finder.scan_statistics.n_tiles == segmenter.n_calls - 1 == 16
+
+
+def test_scan_without_live_preview_prescreens_capture():
+    overview_image = np.zeros((1, 400, 400))
+    overview_image[0, 320:340, 320:340] = 1.0
+    microscope = microscope_factory(overview_image, camera_height_pixels=100, camera_width_pixels=100)
+    assert not microscope.capabilities.live_preview
+    segmenter = CountingSegmenter()
+    finder = SmartObjectFinder(microscope, segmenter, "", backend="numpy")
+    captures = []
+    acquire_image = microscope.acquire_image
+    microscope.acquire_image = lambda: captures.append(1) or acquire_image()
+    microscope.camera.take_snapshot = lambda: pytest.fail("the snapshot is a full capture")
+    with pytest.warns(UserWarning, match="live preview"):
+        finder.scan_for_objects(1, y_range=(50, 350, 75), x_range=(50, 350, 75),
+                                prescreen=TilePrescreen(intensity_threshold=0.1, binning=5))
+    statistics = finder.scan_statistics
+    # every tile is captured once, the capture of the tile with the object is reused and imaged once more
+    assert statistics.n_captured == statistics.n_tiles == 16
+    assert len(captures) == 17
+    assert statistics.n_skipped == 15 and segmenter.n_calls == 1
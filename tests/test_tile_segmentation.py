@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from microscope_gym.features.smart_object_finder import SmartObjectFinder
+from microscope_gym.features.tile_segmentation import TileSegmentationPool, mosaic_tiles, split_mosaic
+from microscope_gym.microscope_adapters.mock_scope import microscope_factory
+
+
+class ThresholdSegmenter:
+    '''Picklable stand-in for a trained apoc.ObjectSegmenter.'''
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+
+    def predict(self, features, image):
+        if features == "fail":
+            raise RuntimeError("prediction failed")
+        return (np.asarray(image) > self.threshold).astype(np.uint32)
+
+
+class BlurSegmenter:
+    '''Segmenter with a feature filter that clamps to the edge, like the pyclesperanto filters.'''
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def predict(self, features, image):
+        from scipy import ndimage
+        self.n_calls += 1
+        blurred = ndimage.gaussian_filter(np.asarray(image, dtype=float), 2, mode='nearest', truncate=3)
+        return ndimage.label(blurred > 0.5)[0]
+
+
+class DiagonalSegmenter:
+    '''Segmenter that labels 8-connected components, like apoc.ObjectSegmenter.'''
+
+    def predict(self, features, image):
+        from scipy import ndimage
+        return ndimage.label(np.asarray(image) > 0.5, structure=np.ones((3, 3)))[0]
+
+
+def test_tiles_are_segmented_in_order():
+    rng = np.random.default_rng(0)
+    tiles = [rng.random((16 + index, 24)) for index in range(7)]
+    with TileSegmentationPool(ThresholdSegmenter(0.5), "", n_workers=2, max_pending=3) as pool:
+        segmentations = list(pool.map(tiles))
+        assert len(pool._slots) <= 4
+    assert len(segmentations) == len(tiles)
+    for tile, segmentation in zip(tiles, segmentations):
+        assert segmentation.dtype == np.uint32
+        np.testing.assert_array_equal(segmentation, tile > 0.5)
+
+
+def test_segmentation_errors_are_raised():
+    with TileSegmentationPool(ThresholdSegmenter(0.5), "fail", n_workers=1) as pool:
+        segmentation = pool.submit(np.zeros((4, 4)))
+        with pytest.raises(RuntimeError):
+            segmentation.result(timeout=60)
+        assert pool._free_slots == pool._slots
+
+
+def test_scan_for_objects_with_workers():
+    overview_image = np.zeros((256, 256))
+    for y, x in [(40, 40), (120, 200), (200, 90)]:
+        overview_image[y - 4:y + 4, x - 4:x + 4] = 1.0
+    results = []
+    for n_workers in (None, 2):
+        microscope = microscope_factory(overview_image, camera_height_pixels=64, camera_width_pixels=64)
+        finder = SmartObjectFinder(microscope, ThresholdSegmenter(0.5), "", backend="numpy")
+        results.append(finder.scan_for_objects(3, object_size_range=(10, 1000), n_workers=n_workers))
+    assert len(results[0]) > 0
+    np.testing.assert_array_equal(results[1], results[0])
+
+
+def test_mosaic_tiles():
+    tiles = [np.full((4, 6), index, dtype=np.uint16) for index in range(4)] + [np.ones((3, 5), dtype=np.uint16)]
+    mosaic, regions = mosaic_tiles(tiles, padding=2)
+    assert mosaic.shape == (2 * 8, 3 * 10)
+    assert mosaic.dtype == np.uint16
+    for tile, region in zip(tiles, regions):
+        np.testing.assert_array_equal(mosaic[region], tile)
+    labels = (mosaic > 0).astype(np.uint32)
+    assert [segmentation.max() for segmentation in split_mosaic(labels, regions)] == [0, 1, 1, 1, 1]
+    with pytest.raises(ValueError):
+        mosaic_tiles([np.zeros((2, 3, 4))])
+
+
+def test_find_objects_in_images():
+    rng = np.random.default_rng(1)
+    tiles = np.zeros((5, 40, 40))
+    for tile in tiles:
+        for y, x in rng.integers(0, 40, size=(4, 2)):
+            tile[max(y - 3, 0):y + 3, max(x - 3, 0):x + 3] = 1.0
+    segmenter = BlurSegmenter()
+    finder = SmartObjectFinder(None, segmenter, "", backend="numpy")
+    expected = [finder.find_objects_in_image(tile, object_size_range=(5, 1000)) for tile in tiles]
+    segmenter.n_calls = 0
+    segmentations = finder.find_objects_in_images(tiles, object_size_range=(5, 1000), padding=8, tiles_per_batch=3)
+    assert segmenter.n_calls == 2
+    assert len(segmentations) == len(tiles)
+    for segmentation, single in zip(segmentations, expected):
+        np.testing.assert_array_equal(segmentation > 0, single > 0)
+        assert segmentation.max() == single.max()
+
+
+def test_mosaic_keeps_segmenter_connectivity():
+    tile = np.zeros((12, 12))
+    # two squares that touch diagonally are one 8-connected object
+    tile[2:5, 2:5] = tile[5:8, 5:8] = 1.0
+    tile[9:11, 0:2] = 1.0
+    tiles = [tile, np.zeros((12, 12)), np.ones((12, 12))]
+    finder = SmartObjectFinder(None, DiagonalSegmenter(), "", backend="numpy")
+    expected = [finder.find_objects_in_image(tile) for tile in tiles]
+    assert expected[0].max() == 2
+    for segmentation, single in zip(finder.find_objects_in_images(tiles, padding=2), expected):
+        np.testing.assert_array_equal(segmentation, single)
+
+
+def test_mosaic_does_not_bridge_objects_through_padding():
+    left = np.zeros((12, 12))
+    # two objects at the right edge, next to the bar at the left edge of the neighbouring tile
+    left[2:4, 10:] = left[7:9, 10:] = 1.0
+    right = np.zeros((12, 12))
+    right[:, :2] = 1.0
+    finder = SmartObjectFinder(None, DiagonalSegmenter(), "", backend="numpy")
+    expected = [finder.find_objects_in_image(tile) for tile in (left, right)]
+    assert [single.max() for single in expected] == [2, 1]
+    for segmentation, single in zip(finder.find_objects_in_images([left, right], padding=2), expected):
+        np.testing.assert_array_equal(segmentation, single)
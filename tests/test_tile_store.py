@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from microscope_gym.interface import SparseTileStore
+from microscope_gym.microscope_adapters.mock_scope import microscope_factory
+
+
+def test_sparse_tile_store():
+    tiles = np.arange(2 * 3 * 4).reshape(2, 3, 4)
+    store = SparseTileStore((2, 3), [(0, 1), (1, 2)], [(10.0, 20.0), (30.0, 40.0)], tiles)
+    assert len(store) == 2 and (1, 2) in store and (0, 0) not in store
+    assert store.coverage == pytest.approx(2 / 6)
+    np.testing.assert_array_equal(store.get_tile(1, 2), tiles[1])
+    assert store.get_tile(0, 0) is None
+    np.testing.assert_array_equal(store.get_acquired_mask(), [[False, True, False], [False, False, True]])
+    dense = store.to_dense(fill_value=-1)
+    assert dense.shape == (2, 3, 3, 4)
+    np.testing.assert_array_equal(dense[0, 1], tiles[0])
+    assert np.all(dense[1, 0] == -1)
+    assert dict(store.items()).keys() == {(0, 1), (1, 2)}
+    with pytest.raises(ValueError):
+        SparseTileStore((2, 3), [(0, 1)], [(10.0, 20.0)], tiles)
+
+
+def test_only_tiles_in_mask_are_acquired():
+    overview_image = np.zeros((1, 400, 400))
+    overview_image[0, 60:80, 300:330] = 1.0
+    microscope = microscope_factory(overview_image, camera_height_pixels=100, camera_width_pixels=100)
+    mask = overview_image[0] > 0
+    y_range, x_range = (50, 350, 90), (50, 350, 90)
+    all_y_positions, all_x_positions = microscope.get_scan_positions(y_range, x_range)
+    y_positions, x_positions, grid_indices, grid_shape = microscope.get_mask_scan_positions(
+        mask, y_range=y_range, x_range=x_range)
+    # brute force: a tile is needed if its field of view contains a mask pixel
+    expected = [np.any(mask[max(int(y) - 50, 0):int(y) + 50, max(int(x) - 50, 0):int(x) + 50])
+                for y, x in zip(all_y_positions, all_x_positions)]
+    np.testing.assert_array_equal(np.ravel_multi_index(grid_indices.T, grid_shape), np.flatnonzero(expected))
+    np.testing.assert_array_equal(y_positions, all_y_positions[expected])
+    store = microscope.acquire_sparse_tiled_image(mask, y_range=y_range, x_range=x_range)
+    assert 0 < len(store) < np.prod(grid_shape)
+    tiled_image = microscope.acquire_tiled_image(y_range, x_range)
+    np.testing.assert_array_equal(store.tiles, tiled_image[expected])
+    assert np.all(tiled_image[np.logical_not(expected)] == 0)
+    # the mask is projected along z and can be given at another pixel size and origin
+    coarse_mask = np.zeros((3, 40, 40), dtype=np.uint16)
+    coarse_mask[1, 6:8, 30:33] = 5
+    coarse_y_positions = microscope.get_mask_scan_positions(coarse_mask, mask_pixel_size_um=10,
+                                                            y_range=y_range, x_range=x_range)[0]
+    np.testing.assert_array_equal(coarse_y_positions, y_positions)
+    assert len(microscope.acquire_sparse_tiled_image(np.zeros((10, 10)))) == 0